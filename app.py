@@ -1,17 +1,27 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context
 import pyrebase
 import os
 from datetime import datetime
 import uuid
 import json
 import random  # Add the missing import for random
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
-import torch
 import re # Ensure re is imported at the top
+import contextlib
+import time
+from itsdangerous import BadSignature, URLSafeTimedSerializer
 
 # Import our new modules
-from emotion_detector import detect_emotion, get_emotion_response_style, get_relevant_resources
+from emotion_detector import analyze_emotion, get_emotion_response_style, get_relevant_resources, get_emotion_batcher_stats, get_cascade_stats, get_emotion_cache_stats
+from generation import PrefixCachedGenerator, generation_stats, prefix_cache, session_kv_stats
 from knowledge_base import KnowledgeBase
+from crisis_screener import CRISIS_RESOURCES
+from message_analysis import analyze_message
+from model_registry import model_registry
+from prompt_budget import prompt_budget_stats
+from reply_latency import reply_latency
+from reply_validator import REPLY_CANDIDATES, UNSAFE_KEYWORDS, reply_validator
+from session_state import SessionStateStore
+from topic_classifier import TOPIC_KEYWORDS, topic_cache
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -32,19 +42,80 @@ firebase = pyrebase.initialize_app(firebase_config)
 db = firebase.database()
 
 # Set up a simpler text generation pipeline instead of full model
-try:
+def load_generator():
     from transformers import pipeline, set_seed
     set_seed(42)  # For consistency
-    generator = pipeline('text-generation', model="gpt2")  # Using GPT-2 which is more reliable
-    print("Text generation model loaded successfully")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    # Define a rule-based fallback if models fail
-    generator = None
-    print("Using rule-based fallback responses")
-
-# Initialize knowledge base
+    # Using GPT-2 which is more reliable; the wrapper reuses the prompt header's KV cache
+    return PrefixCachedGenerator(pipeline('text-generation', model="gpt2"))
+
+# If it fails to load, get_kozy_response uses the rule-based fallback responses
+generator_model = model_registry.register(
+    "generator", load_generator,
+    warmup=lambda generator: generator("Hello", max_new_tokens=4, pad_token_id=50256))
+
+# Load models in the background (or eagerly/lazily, see KOZY_MODEL_LOADING)
+model_registry.start()
+
+# Initialize knowledge base (shared, read-only content); a rebuilt bundle is picked up
+# without a restart (`python knowledge_bundle.py build`, see KOZY_KNOWLEDGE_RELOAD)
 knowledge_base = KnowledgeBase()
+knowledge_base.watch_bundle()
+
+# What the knowledge base remembers per conversation (suggested features/FAQs, topics)
+session_states = SessionStateStore()
+
+# Crisis replies are fixed text so they can be sent without waiting on any model
+CRISIS_RESPONSES = [
+    ["I'm really concerned about what you just shared, and I'm glad you felt you could tell me.",
+     "Those feelings are incredibly difficult to bear alone, and it takes courage to speak about them.",
+     "Would it be okay if we talked about some resources that might help? There are people trained specifically to help with these intense feelings.",
+     "The National Suicide Prevention Lifeline is available 24/7 at 988 or 1-800-273-8255, and they really do care."],
+    ["I'm giving you my full attention right now because what you're sharing matters deeply.",
+     "Those dark thoughts can feel overwhelming, but please know you don't have to face them by yourself.",
+     "Sometimes talking to a crisis counselor who's specially trained can make a real difference - would you consider reaching out to one?",
+     "You can text HOME to 741741 to reach the Crisis Text Line anytime - they're really good at helping in moments like this."],
+    ["Thank you for trusting me with something so personal and difficult. That shows real strength.",
+     "These feelings are incredibly painful, but they don't define you or your future. Things really can get better with support.",
+     "Would you be willing to talk to a professional who can help navigate these feelings? You deserve that kind of specialized support.",
+     "The 988 Suicide & Crisis Lifeline has helped many people through moments just like this - they're just a call or text away."]
+]
+
+# Where a generated reply is cut off; generation also stops as soon as one appears
+REPLY_CUTOFF_MARKERS = ["Friend:", "\n\n", "\nFriend", "You are Kozy", "respond with empathy", "Listen carefully", "1. IDENTIFY", "2. RECALL", "3. CONSIDER", "4. PLAN", "Before responding"]
+
+# Sampling for Kozy's generated replies (max_new_tokens comes from the prompt's budget)
+KOZY_SAMPLING = {
+    "temperature": 0.8,  # Slightly increased for more adaptability to new situations
+    "top_k": 50,
+    "top_p": 0.94,  # Increased slightly for more creative responses
+    "do_sample": True,
+    "repetition_penalty": 1.2,  # Add repetition penalty to avoid circular reasoning
+    "pad_token_id": 50256
+}
+
+# Sent instead of a reply that contains an unsafe keyword
+UNSAFE_REPLY_SUBSTITUTE = [
+    "I sense a lot of strong emotions right now, and I want to make sure we talk safely.",
+    "Violence isn't the answer. Can we talk more about what led to this feeling? I'm here to support you. ♥"
+]
+
+# Replies sent over /stream_message come back signed in their `done` event (the session cookie
+# is already sent when they finish); the page posts them to /commit_turn to add them to the history
+turn_serializer = URLSafeTimedSerializer(app.secret_key, salt="kozy-streamed-turn")
+STREAMED_TURN_MAX_AGE = 3600
+
+# History entries shown to the generator. With a session KV cache the window's start stays put
+# (so each prompt extends the last one) until it holds MAX_ANCHORED_EXCHANGES entries
+RECENT_EXCHANGES = 6
+MAX_ANCHORED_EXCHANGES = 12
+
+def get_crisis_response():
+    """Pick a crisis reply and follow it with the crisis resources"""
+    response = list(random.choice(CRISIS_RESPONSES))
+    for resource in CRISIS_RESOURCES:
+        link = f" {resource['link']}" if resource['link'] else ""
+        response.append(f"{resource['title']}: {resource['description']}.{link}")
+    return response
 
 # Global counters for tracking conversation depth
 def initialize_user_tracking():
@@ -59,35 +130,32 @@ def initialize_user_tracking():
         }
     return session['user_tracking']
 
-def get_kozy_response(message, chat_history):
-    """Generate better empathetic responses without prompt leakage"""
-    
-    # Update tracking metrics to improve context
-    tracking = initialize_user_tracking()
-    tracking['message_count'] += 1
-    
-    # Detect emotion in the current message
-    detected_emotion = detect_emotion(message, chat_history)
-    if detected_emotion and detected_emotion != "neutral":
-        tracking['detected_emotions'].append(detected_emotion)
-        # Keep only the last 5 emotions
-        if len(tracking['detected_emotions']) > 5:
-            tracking['detected_emotions'] = tracking['detected_emotions'][-5:]
+def build_kozy_prompt(budget, message, chat_history, emotion_result, analysis, history_start=None):
+    """Build the generator prompt as a BudgetedPrompt that fits the model's context
+
+    The prefix is the instruction header, which only changes with the emotion and
+    response style, so its KV cache is reused across requests (see generation.py).
+    After it come the recent conversation, topic notes, the current message and
+    the reasoning instructions; `budget` (a PromptBudget) drops the oldest turns
+    and notes that don't fit (see prompt_budget.py). prompt_input is the current
+    message's line, used to find the reply in the generated text. The conversation
+    offered is the last RECENT_EXCHANGES entries, or everything from history_start
+    on when given.
+    """
+    detected_emotion = emotion_result.emotion
     
-    # If we couldn't load the model, use rule-based responses
-    if generator is None:
-        return get_rule_based_response(message, chat_history, detected_emotion)
+    # Get emotion response style to guide the model
+    emotion_style = get_emotion_response_style(detected_emotion, emotion_result.intensity)
     
-    try:
-        # Get emotion response style to guide the model
-        emotion_style = get_emotion_response_style(detected_emotion)
-        
-        # Much simpler prompt strategy to avoid instruction leakage
-        recent_exchanges = min(6, len(chat_history)) # Slightly more context
+    # Much simpler prompt strategy to avoid instruction leakage
+    if history_start is not None:
+        recent_history = chat_history[history_start:]
+    else:
+        recent_exchanges = min(RECENT_EXCHANGES, len(chat_history)) # Slightly more context
         recent_history = chat_history[-recent_exchanges:] if recent_exchanges > 0 else []
-        
-        # IMPROVED PROMPT: Create a more directive prompt with emotion awareness
-        prompt_header = f"""You are Kozy, a deeply empathetic and insightful AI companion that excels at supportive conversation.
+    
+    # IMPROVED PROMPT: Create a more directive prompt with emotion awareness
+    prompt_header = f"""You are Kozy, a deeply empathetic and insightful AI companion that excels at supportive conversation.
 
 IMPORTANT INSTRUCTIONS:
 1. ALWAYS acknowledge and address the specific topics the user mentions (like work issues, boss problems, conflicts with peers, etc.)
@@ -98,7 +166,7 @@ IMPORTANT INSTRUCTIONS:
 6. If the user mentions a problem with their boss, workplace, peers, or conflicts, focus your response on that specific issue
 7. End with an open-ended question related to what they've just shared
 
-USER'S CURRENT EMOTION: {detected_emotion}
+USER'S CURRENT EMOTION: {detected_emotion} ({emotion_result.level})
 RESPONSE STYLE: Use a {emotion_style['tone']} tone. {emotion_style['validation']}. {emotion_style['approach']}.
 
 CONVERSATION STYLE:
@@ -109,33 +177,28 @@ CONVERSATION STYLE:
 - Keep your responses conversational and natural
 
 """
-        conversation = prompt_header
-        
-        # Add context about previous messages to help model understand the conversation flow
-        for entry in recent_history:
-            if entry.get('user') and entry.get('user').strip():
-                conversation += f"Friend: {entry['user']}\nKozy: {entry['kozy']}\n"
-            # Include Kozy's previous multi-part messages correctly if stored that way
-            elif entry.get('kozy') and isinstance(entry['kozy'], list):
-                 conversation += f"Kozy: {' '.join(entry['kozy'])}\n"
-            elif entry.get('kozy'):
-                 conversation += f"Kozy: {entry['kozy']}\n"
-
-        # Add explicit contextual hints for important topics
-        message_lower = message.lower()
-        if any(term in message_lower for term in ["boss", "manager", "supervisor"]):
-            conversation += "Note: The user is mentioning issues with their boss or manager. Make sure to address this specific workplace concern.\n"
-        if any(term in message_lower for term in ["work", "job", "task", "assignment"]) and any(term in message_lower for term in ["too much", "so much", "overload", "stress"]):
-            conversation += "Note: The user is mentioning workload stress or overwhelming job responsibilities. Focus on this workplace concern.\n"
-        if any(term in message_lower for term in ["peer", "colleague", "coworker"]) and any(term in message_lower for term in ["fight", "conflict", "argument"]):
-            conversation += "Note: The user is mentioning interpersonal conflict at work. Address this relationship concern specifically.\n"
-
-        # Add the current message with simple formatting
-        prompt_input = f"Friend: {message}\nKozy:"
-        conversation += prompt_input
-        
-        # Add structured reasoning step for complex situations with advice component
-        reasoning_prompt = f"""
+    # Add context about previous messages to help model understand the conversation flow
+    history_lines = []
+    for entry in recent_history:
+        if entry.get('user') and entry.get('user').strip():
+            history_lines.append(f"Friend: {entry['user']}\nKozy: {entry['kozy']}\n")
+        # Include Kozy's previous multi-part messages correctly if stored that way
+        elif entry.get('kozy') and isinstance(entry['kozy'], list):
+             history_lines.append(f"Kozy: {' '.join(entry['kozy'])}\n")
+        elif entry.get('kozy'):
+             history_lines.append(f"Kozy: {entry['kozy']}\n")
+
+    # Add explicit contextual hints for important topics
+    notes = []
+    if analysis.has("boss"):
+        notes.append("Note: The user is mentioning issues with their boss or manager. Make sure to address this specific workplace concern.\n")
+    if analysis.has("work") and analysis.has("workload", "stress"):
+        notes.append("Note: The user is mentioning workload stress or overwhelming job responsibilities. Focus on this workplace concern.\n")
+    if analysis.has("peers") and analysis.has("conflict"):
+        notes.append("Note: The user is mentioning interpersonal conflict at work. Address this relationship concern specifically.\n")
+    
+    # Add structured reasoning step for complex situations with advice component
+    reasoning_prompt = f"""
 Before responding as Kozy, analyze the situation first:
 1. IDENTIFY the key issues or emotions in the user's message
 2. RECALL any relevant context from the conversation history
@@ -150,387 +213,468 @@ always include a brief supportive suggestion or gentle advice along with your qu
 
 Now, formulate your response as Kozy:
 """
-        conversation += reasoning_prompt
+
+    # The header ends in a blank line; the prefix keeps only the first of its two newlines,
+    # which is where the whole prompt's tokens split cleanly into prefix and the rest
+    # (the current message goes in as "Friend: {message}\nKozy:")
+    return budget.build(prompt_header[:-1], "\n", history_lines, notes, message, reasoning_prompt)
+
+def start_kozy_turn(message, chat_history, emotion_result=None):
+    """Count the turn in the session's tracking and detect the message's emotion, unless the caller already did"""
+    # Update tracking metrics to improve context
+    tracking = initialize_user_tracking()
+    tracking['message_count'] += 1
+    
+    # Detect emotion in the current message, unless the caller already did this turn
+    if emotion_result is None:
+        emotion_result = analyze_emotion(message, chat_history)
+        if emotion_result.emotion != "neutral":
+            tracking['detected_emotions'].append(emotion_result.emotion)
+            # Keep only the last 5 emotions
+            if len(tracking['detected_emotions']) > 5:
+                tracking['detected_emotions'] = tracking['detected_emotions'][-5:]
+    return emotion_result
+
+def prepare_kozy_prompt(generator, message, chat_history, emotion_result, analysis):
+    """The next prompt of the conversation, and its GenerationSession (None without one)"""
+    # This conversation's KV cache, so only the turns added since the last prompt are prefilled
+    generation_session = generator.session(session.get('firebase_session_key'))
+    history_start = None
+    if generation_session is not None:
+        history_start = generation_session.window_start(len(chat_history), RECENT_EXCHANGES, MAX_ANCHORED_EXCHANGES)
+    prompt = build_kozy_prompt(generator.budget, message, chat_history, emotion_result, analysis,
+                               history_start=history_start)
+    stats = prompt.stats
+    print(f"Prompt: {stats['prompt_tokens']}/{stats['budget']} tokens, {stats['history_kept']} history entries "
+          f"({stats['history_dropped']} dropped), {stats['notes_dropped']} notes dropped, "
+          f"{stats['message_tokens_cut']} message tokens cut")
+    if stats['history_dropped'] and history_start is not None:
+        # The anchored window outgrew the budget; the next one starts with half of what fit,
+        # so it can grow again for a few turns before it has to move
+        generation_session.restart_window(len(chat_history) - stats['history_kept'] // 2)
+    return prompt, generation_session
+
+def cut_kozy_reply(kozy_response):
+    """A generated reply without the trailing text or repeated prompts after a cutoff marker"""
+    for marker in REPLY_CUTOFF_MARKERS:
+        if marker in kozy_response:
+            kozy_response = kozy_response.split(marker)[0].strip()
+    return kozy_response
+
+def check_kozy_reply(kozy_response, analysis, complete=True):
+    """Validate a generated reply: "ok", or "reject" to use a fallback instead
+
+    A reply still being generated (complete=False) can also be "wait" while it
+    can't be judged yet (see reply_validator.py).
+    """
+    check = reply_validator.check([kozy_response], analysis, complete)[0]
+    if check.reasons:
+        print(f"LLM response rejected: '{kozy_response}'. Reason: {', '.join(check.reasons)}.")
+    return check.verdict
+
+def extract_kozy_reply(generated_text, prompt_input):
+    """The reply in a generated text (prompt plus continuation), cut at the first cutoff marker"""
+    # First see if we can find the final response after reasoning
+    kozy_marker = "Now, formulate your response as Kozy:"
+    if kozy_marker in generated_text:
+        response_start_index = generated_text.find(kozy_marker) + len(kozy_marker)
+        kozy_response = generated_text[response_start_index:].strip()
+    else:
+        # Fall back to original extraction method
+        response_start_index = generated_text.find(prompt_input) + len(prompt_input)
+        kozy_response = generated_text[response_start_index:].strip()
+
+    # Clean up any trailing text or repeated prompts
+    return cut_kozy_reply(kozy_response)
+
+def get_llm_fallback_response(message, chat_history, analysis):
+    """Reply to a message whose generated reply was rejected, picked by what the message is about"""
+    is_simple_greeting = analysis.is_greeting
+
+    # Handle simple greetings appropriately
+    if is_simple_greeting:
+        greeting_responses = [
+            f"Hi there! It's nice to hear from you. How are you feeling today? ✨",
+            f"Hello! I'm here and ready to chat. What's on your mind today?",
+            f"Hey! Thanks for reaching out. How are you doing right now? I'm here to listen.",
+            f"Hi! I'm glad you're here. How has your day been so far?"
+        ]
+        return [random.choice(greeting_responses)]
+    
+    # Enhanced topic detection with typo tolerance (new function)
+    def fuzzy_match(topic):
+        """Detect a fallback topic's keywords even with typos"""
+        # Exact matches come from the shared topic classifier
+        if analysis.has(topic):
+            return True
+        keywords = TOPIC_KEYWORDS[topic]
+        
+        # Check for close matches (handle common typos)
+        typo_mapping = {
+            'wokr': 'work', 'wrk': 'work', 'wark': 'work',
+            'bos': 'boss', 'boss': 'boss', 'manage': 'manager',
+            'stres': 'stress', 'stresed': 'stressed', 'stressd': 'stressed',
+            'hecti': 'hectic', 'hactice': 'hectic', 'hetic': 'hectic',
+            'overwelm': 'overwhelm', 'overwhelmd': 'overwhelmed',
+            'colleg': 'colleague', 'cowork': 'coworker', 'peer': 'peer',
+            'figt': 'fight', 'fite': 'fight', 'argu': 'argument'
+        }
+        
+        # Extract words from text
+        words = analysis.lower.split()
+        
+        # Check each word for potential typos
+        for word in words:
+            if word in typo_mapping and typo_mapping[word] in keywords:
+                return True
+            # Check for partial matches (if word is at least 4 chars)
+            if len(word) >= 4:
+                for keyword in keywords:
+                    # If 70% of the characters match, consider it a match
+                    if len(keyword) >= 4 and (word in keyword or keyword in word):
+                        return True
+        
+        return False
+    
+    # Check for hectic/busy day mentions using fuzzy matching
+    if fuzzy_match("hectic"):
+        hectic_responses = [
+            ["Oh wow, sounds like your day has been really hectic! Those kinds of days can be so draining.",
+             "When everything feels chaotic, it's like you can barely catch your breath between one thing and the next.",
+             "What's been the most challenging part of your day so far? Sometimes just talking about it helps a bit."],
+            ["Hectic days are so exhausting! I completely get that overwhelmed feeling when everything's happening at once.",
+             "It's like you're being pulled in ten different directions and can't fully focus on any one thing properly.",
+             "Have you had any chance to take even a tiny breather today? Sometimes even 5 minutes can help reset a bit."],
+            ["Those super busy days can really take it out of you! I'm sorry you're dealing with that chaos.",
+             "It's tough when you don't even have space to process one thing before the next thing demands your attention.",
+             "What typically helps you decompress after days like this? I'm here to listen if you just need to vent about it all."]
+        ]
+        return random.choice(hectic_responses)
+    
+    # Enhanced boss topic detection with better typo handling
+    if fuzzy_match("boss"):
+        boss_responses = [
+            ["Oh no, boss troubles? That can be so frustrating! I've heard from so many people who struggle with their managers.",
+             "Sometimes it feels like they just don't understand what we're dealing with day-to-day, right?",
+             "Tell me more about what's happening with your boss - I really want to understand what you're going through."],
+            ["Boss issues can be so draining! I totally get why that would be on your mind.",
+             "The dynamics with managers can really affect our whole mood and even how we feel about ourselves sometimes.",
+             "What's been happening lately with your boss? I'm all ears and no judgment here."],
+            ["Ugh, dealing with difficult bosses is seriously one of the hardest parts of work life! I'm sorry you're facing that.",
+             "It's like they have so much power over our daily experience and when it's not good, it's REALLY not good.",
+             "Want to vent about what's going on? Sometimes just getting it all out can help a little."]
+        ]
+        return random.choice(boss_responses)
+    
+    # Enhanced workload detection with typo tolerance
+    if fuzzy_match("work") and (fuzzy_match("workload") or fuzzy_match("time_pressure")):
+        workload_responses = [
+            ["Wow, sounds like you're completely swamped with work! That overwhelming feeling is the worst.",
+             "It's like being stuck in quicksand sometimes - the harder you try to catch up, the more exhausted you feel.",
+             "How long have things been this intense? Have you had any chance to take a breather lately?"],
+            ["Being overloaded at work is so stressful! I hate that feeling of never being able to catch up.",
+             "It's not just the work itself that's hard - it's that constant pressure in the back of your mind, even when you're supposed to be relaxing.",
+             "What's contributing most to the workload right now? Is it a particular project or just everything piling up at once?"],
+            ["Oh gosh, too much work is seriously the worst! Makes it hard to even think straight sometimes.",
+             "I find it so frustrating when there's just not enough hours in the day to get everything done properly.",
+             "Have you been able to talk to anyone at work about redistributing some of the load? Or is that not really an option?"]
+        ]
+        return random.choice(workload_responses)
+    
+    # Combined stress and not feeling well detection (improved for broader matching)
+    if fuzzy_match("stress") or fuzzy_match("unwell"):
+        stress_responses = [
+            ["I can hear that you're feeling really stressed right now. That's such a tough emotional state to be in.",
+             "Stress has this way of making everything feel heavier and more difficult than it normally would.",
+             "What do you think is contributing the most to your stress right now? Sometimes identifying the biggest factor can help a little."],
+            ["Being stressed and not feeling well is such a difficult combination to deal with. I'm sorry you're experiencing that.",
+             "Our bodies and minds are so connected - when one is struggling, the other usually feels it too.",
+             "Have you been able to do anything small for yourself today that might bring even a moment of relief?"],
+            ["Stress can be so physically and emotionally draining! It sounds like you're really going through it right now.",
+             "Sometimes when we're stressed, everything feels like it's piling on all at once and won't let up.",
+             "What's one small thing that typically helps you feel even slightly better when you're stressed like this?"]
+        ]
+        return random.choice(stress_responses)
+    
+    # Better peer conflict detection with contextual awareness
+    if fuzzy_match("peers") and fuzzy_match("conflict"):
+        conflict_responses = [
+            ["Oof, colleague drama is so stressful! Especially since you can't just avoid seeing them like you could with other people.",
+             "Those workplace relationships get complicated fast when there's tension - it affects everything!",
+             "Do you want to tell me what happened? Sometimes talking it through with someone outside the situation helps sort things out."],
+            ["Workplace conflicts are so awkward and draining! I'm sorry you're dealing with that right now.",
+             "It's like you're stuck in this weird space where you have to keep being professional while also having all these feelings.",
+             "What led to the conflict? I'm curious to hear your perspective on how things unfolded."],
+            ["Oh no, trouble with colleagues? That can make even walking into work feel like a huge challenge.",
+             "Those relationship dynamics at work can really mess with your peace of mind - it's hard to just leave it at the office sometimes.",
+             "Want to talk about what happened between you two? No judgment here, just a friendly ear."]
+        ]
+        return random.choice(conflict_responses)
+    
+    # Add general response for when someone is sharing something negative but topic isn't clear
+    if fuzzy_match("negative"):
+        general_negative_responses = [
+            ["I'm sorry to hear you're having a rough time. That really sucks, and I appreciate you sharing that with me.",
+             "Sometimes life throws a lot at us all at once, and it can feel overwhelming to deal with.",
+             "Would you like to tell me more about what's going on? I'm here to listen without judgment."],
+            ["It sounds like things have been pretty difficult for you lately. That's really hard to deal with.",
+             "When life gets tough, even small things can start to feel like big challenges.",
+             "What's been the hardest part to handle recently? Sometimes talking through it can help, even just a little."],
+            ["I'm sorry you're going through this tough time. It takes courage to acknowledge when things aren't going well.",
+             "Everyone struggles sometimes, and it's completely okay to not be okay.",
+             "Is there anything specific that's been weighing on you the most? I'm here to listen if you want to talk about it."]
+        ]
+        return random.choice(general_negative_responses)
+    
+    # For specific emotional or physical distress triggers, use specialized responses
+    # Special handling for physical pain mentions with more personal tone
+    if analysis.has("pain"):
+        pain_responses = [
+            ["I'm so sorry you're in pain right now - that's really tough to deal with on top of everything else.",
+             "Physical discomfort has this way of taking over your whole experience. It's hard to focus on anything else, isn't it?",
+             "Is there anything that's been helping with the pain, even a little bit? I really wish I could do more than just listen."],
+            ["Oh no, physical pain is so draining! I really feel for you - it's exhausting to deal with that.",
+             "Our bodies and minds are so connected - physical pain can really wear down our emotional reserves too.",
+             "How long have you been feeling this way? I'm here to listen if you want to talk more about what you're experiencing."],
+            ["Being in pain is such a lonely experience sometimes - I'm really glad you told me about it.",
+             "It's so hard when your body isn't feeling right. It affects literally everything else in life.",
+             "What does your pain feel like today? Sometimes putting it into words can help, even just a little."]
+        ]
+        return random.choice(pain_responses)
+    
+    # Enhanced handling for mental health crisis with more empathy and urgency
+    if analysis.crisis:
+        return get_crisis_response()
+    
+    # New: Handling for "not feeling well" with more personality
+    if analysis.has("unwell"):
+        unwell_responses = [
+            ["I'm sorry you're not feeling well today. That's really tough, especially when you have other things you want or need to do.",
+             "Sometimes just having someone acknowledge that you're struggling can help a tiny bit. So consider me officially in your corner!",
+             "What do you think might help you feel even a little better right now? Even small comforts can make a difference."],
+            ["Oh no, feeling unwell is the worst! I hate those days when you just can't seem to get comfortable or feel right.",
+             "Being sick or off-balance affects everything - your mood, your energy, your whole outlook on life!",
+             "Have you been able to give yourself any little breaks or comforts today? Sometimes that's the best we can do when we're not feeling great."],
+            ["Not feeling well? That's really rough - I'm sorry you're going through that right now.",
+             "It's frustrating when our bodies or minds aren't cooperating with what we want to do or how we want to feel.",
+             "What specifically doesn't feel good? Sometimes talking about it can help make it feel a little less overwhelming."]
+        ]
+        return random.choice(unwell_responses)
+    
+    # Fall back to rule-based for other cases
+    return get_rule_based_response(message, chat_history, analysis=analysis)
+
+class ReplyParts:
+    """Splits a generated reply into chat messages of 1-2 sentences and adds an emote to the last
+
+    Sentences are added one at a time, so a reply that is still being generated
+    can be sent message by message. The last finished message is held back until
+    the next one is finished or the reply ends, as the emote may go on it.
+    """
+
+    def __init__(self, analysis):
+        self.analysis = analysis
+        self.current_part = ""
+        self.part_sentence_count = 0
+        self.last_part = None
+        self.released = 0
+
+    def add(self, sentence):
+        """The messages that are final once `sentence` is added"""
+        ready = []
+        if sentence:
+            self.current_part += sentence + " "
+            self.part_sentence_count += 1
+            # Create a new part after 1-2 sentences or if length exceeds limit
+            if self.part_sentence_count >= random.randint(1, 2) or len(self.current_part) > 130:
+                if self.last_part is not None:
+                    ready.append(self.last_part)
+                self.last_part = self.current_part.strip()
+                self.current_part = ""
+                self.part_sentence_count = 0
+        self.released += len(ready)
+        return ready
+
+    def finish(self, kozy_response):
+        """The remaining messages of the reply, with the emote"""
+        sentence_parts = [self.last_part] if self.last_part is not None else []
+
+        # Add the final part if not empty
+        if self.current_part.strip():
+            sentence_parts.append(self.current_part.strip())
+
+        # Ensure at least one part exists
+        if not sentence_parts:
+             sentence_parts.append(kozy_response)
+
+        # Add appropriate emotes based on emotional content - MORE SUBTLE
+        emotion = 'caring'
+        last_part = sentence_parts[-1]
+
+        if self.analysis.has("negative", "pain", "unwell", "conflict", "stress"):
+            emotion = 'concerned'
+            emotes = ["(｡•́‿•̀｡)", "(´｡• ᵕ •｡`)", "♥"]
+        elif self.analysis.has("positive"):
+            emotion = 'happy'
+            emotes = ["✨", "☆", "(>ᴗ<)", "♪"]
+        else: # Default to caring/neutral emotes
+            emotes = ["✨", "☆", "♥", "( ´･ᴗ･` )", "~"]
+        
+        # Add emote to last part with lower chance (e.g., 40%) and ensure it fits naturally
+        if random.random() < 0.4 and last_part and last_part[-1].isalnum():
+             sentence_parts[-1] += f" {random.choice(emotes)}"
+        elif random.random() < 0.2 and last_part: # Even lower chance if ending with punctuation
+             sentence_parts[-1] += f" {random.choice(emotes)}"
+        self.released += len(sentence_parts)
+        return sentence_parts
+
+def get_kozy_response(message, chat_history, emotion_result=None, analysis=None):
+    """Generate better empathetic responses without prompt leakage"""
+    analysis = analysis or analyze_message(message)
+    emotion_result = start_kozy_turn(message, chat_history, emotion_result)
+    detected_emotion = emotion_result.emotion
+    
+    # If we couldn't load the model, use rule-based responses
+    generator = generator_model.get()
+    if generator is None:
+        return get_rule_based_response(message, chat_history, detected_emotion, analysis=analysis)
+    
+    try:
+        prompt, generation_session = prepare_kozy_prompt(generator, message, chat_history, emotion_result, analysis)
+        prompt_input = prompt.prompt_input
         
         # Generate response with parameters optimized for emotional support and better reasoning
-        result = generator(
-            conversation,
-            max_length=len(conversation.split()) + 180,  # Further increased max_length for advice + reasoning
-            num_return_sequences=1,
-            temperature=0.8,  # Slightly increased for more adaptability to new situations
-            top_k=50,
-            top_p=0.94,  # Increased slightly for more creative responses
-            do_sample=True,
-            repetition_penalty=1.2,  # Add repetition penalty to avoid circular reasoning
-            pad_token_id=50256
+        # (cached header/conversation tokens are not prefilled again). Several candidates are
+        # sampled in one batch, so a rejected sample doesn't have to mean a canned reply
+        result = generator.generate(
+            prompt.prefix, prompt.suffix,
+            session=generation_session,
+            input_ids=prompt.ids,
+            stop_markers=REPLY_CUTOFF_MARKERS,  # Stop once the replies are complete instead of sampling text that is cut
+            max_new_tokens=prompt.max_new_tokens,  # Room for advice + reasoning, reserved in the budget
+            num_return_sequences=REPLY_CANDIDATES,
+            **KOZY_SAMPLING
         )
         
-        generated_text = result[0]['generated_text']
-        
         # Enhanced extraction logic to handle reasoning structure
         try:
-            # First see if we can find the final response after reasoning
-            kozy_marker = "Now, formulate your response as Kozy:"
-            if kozy_marker in generated_text:
-                response_start_index = generated_text.find(kozy_marker) + len(kozy_marker)
-                kozy_response = generated_text[response_start_index:].strip()
-            else:
-                # Fall back to original extraction method
-                response_start_index = generated_text.find(prompt_input) + len(prompt_input)
-                kozy_response = generated_text[response_start_index:].strip()
-
-            # Clean up any trailing text or repeated prompts
-            cutoff_markers = ["Friend:", "\n\n", "\nFriend", "You are Kozy", "respond with empathy", "Listen carefully", "1. IDENTIFY", "2. RECALL", "3. CONSIDER", "4. PLAN", "Before responding"]
-            for marker in cutoff_markers:
-                if marker in kozy_response:
-                    kozy_response = kozy_response.split(marker)[0].strip()
-
-            # Further check for prompt leakage or very short/empty responses
-            prompt_keywords = ["empathy", "companion", "Kozy", "respond", "deeply", "caring", "authentic", "validate", "acknowledge"] # Expanded keywords
-            contains_prompt_leak = any(keyword in kozy_response.lower()[:70] for keyword in prompt_keywords)
-
-            # Add check for nonsensical or unsafe content
-            unsafe_keywords = ["fight back", "hit them", "attack", "kill", "hurt them"]
-            contains_unsafe_content = any(keyword in kozy_response.lower() for keyword in unsafe_keywords)
-            # Basic check for nonsensical phrases (can be expanded)
-            contains_nonsense = "feathers are feathers" in kozy_response.lower()
-
-            # Check for proper session context awareness and message appropriateness
-            current_session_references = False
-            inappropriate_response = False
-            
-            # Detect if this is a simple greeting or short message that doesn't warrant emotional validation
-            message_lower = message.lower().strip()
-            simple_greetings = ["hi", "hey", "hello", "yo", "sup", "hiya", "good morning", "good afternoon", "good evening"]
-            is_simple_greeting = message_lower in simple_greetings or message_lower.startswith(tuple(simple_greetings))
-            
-            # Check if response has inappropriate validation for simple messages
-            inappropriate_validations = [
-                "it makes complete sense that you'd feel that way",
-                "that sounds really difficult",
-                "i understand your feelings",
-                "your feelings are valid",
-                "that's a lot to handle",
-                "it sounds like you're carrying"
-            ]
-            
-            # Flag inappropriate validations for simple greetings
-            if is_simple_greeting and any(validation in kozy_response.lower() for validation in inappropriate_validations):
-                inappropriate_response = True
-                print(f"Inappropriate validation detected for greeting: '{kozy_response}'")
-                
-            # Check for irrelevant or generic responses to specific topics
-            important_topics = {
-                "boss": ["boss", "manager", "supervisor"],
-                "work": ["work", "job", "workload", "tasks", "assignment"],
-                "peers": ["peer", "peers", "colleague", "coworker", "coworkers"],
-                "conflict": ["fight", "conflict", "argument", "disagreement", "angry"]
-            }
-            
-            # Detect if message contains important topics
-            detected_topics = []
-            for topic, keywords in important_topics.items():
-                if any(keyword in message_lower for keyword in keywords):
-                    detected_topics.append(topic)
-            
-            # Evaluate if the response acknowledges the topics appropriately
-            missing_topic_acknowledgment = False
-            if detected_topics:
-                # Check if any important topics are acknowledged in the response
-                topic_acknowledged = False
-                for topic in detected_topics:
-                    topic_keywords = important_topics.get(topic, [])
-                    if any(keyword in kozy_response.lower() for keyword in topic_keywords):
-                        topic_acknowledged = True
-                        break
-                
-                # Also check for related terms that would indicate topic acknowledgment
-                if topic_acknowledged == False:
-                    if "boss" in detected_topics and any(term in kozy_response.lower() for term in ["manager", "supervisor", "workplace", "management", "superior"]):
-                        topic_acknowledged = True
-                    elif "work" in detected_topics and any(term in kozy_response.lower() for term in ["workload", "job", "task", "professional", "career", "workplace"]):
-                        topic_acknowledged = True
-                    elif "peers" in detected_topics and any(term in kozy_response.lower() for term in ["coworker", "colleague", "relationship", "team", "professional relationship"]):
-                        topic_acknowledged = True
-                    elif "conflict" in detected_topics and any(term in kozy_response.lower() for term in ["tension", "disagreement", "argument", "situation", "difficult interaction", "confrontation"]):
-                        topic_acknowledged = True
-                
-                # If no acknowledgment of important topics, mark response as potentially irrelevant
-                if not topic_acknowledged:
-                    print(f"Response doesn't acknowledge important topics {detected_topics}: '{kozy_response}'")
-                    missing_topic_acknowledgment = True
-            
-            if not kozy_response or len(kozy_response) < 15 or contains_prompt_leak or contains_unsafe_content or contains_nonsense or inappropriate_response or missing_topic_acknowledgment:
-                print(f"LLM response rejected: '{kozy_response}'. Reason: short/leak/unsafe/nonsense/inappropriate/missing topic. Falling back to rule-based.")
-                
-                # Handle simple greetings appropriately
-                if is_simple_greeting:
-                    greeting_responses = [
-                        f"Hi there! It's nice to hear from you. How are you feeling today? ✨",
-                        f"Hello! I'm here and ready to chat. What's on your mind today?",
-                        f"Hey! Thanks for reaching out. How are you doing right now? I'm here to listen.",
-                        f"Hi! I'm glad you're here. How has your day been so far?"
-                    ]
-                    return [random.choice(greeting_responses)]
-                
-                # Enhanced topic detection with typo tolerance (new function)
-                def fuzzy_match(text, keywords):
-                    """Detect keywords even with typos"""
-                    # Convert text to lowercase for comparison
-                    text_lower = text.lower()
-                    
-                    # Check for exact matches first
-                    for keyword in keywords:
-                        if keyword in text_lower:
-                            return True
-                    
-                    # Check for close matches (handle common typos)
-                    typo_mapping = {
-                        'wokr': 'work', 'wrk': 'work', 'wark': 'work',
-                        'bos': 'boss', 'boss': 'boss', 'manage': 'manager',
-                        'stres': 'stress', 'stresed': 'stressed', 'stressd': 'stressed',
-                        'hecti': 'hectic', 'hactice': 'hectic', 'hetic': 'hectic',
-                        'overwelm': 'overwhelm', 'overwhelmd': 'overwhelmed',
-                        'colleg': 'colleague', 'cowork': 'coworker', 'peer': 'peer',
-                        'figt': 'fight', 'fite': 'fight', 'argu': 'argument'
-                    }
-                    
-                    # Extract words from text
-                    words = text_lower.split()
-                    
-                    # Check each word for potential typos
-                    for word in words:
-                        if word in typo_mapping and typo_mapping[word] in keywords:
-                            return True
-                        # Check for partial matches (if word is at least 4 chars)
-                        if len(word) >= 4:
-                            for keyword in keywords:
-                                # If 70% of the characters match, consider it a match
-                                if len(keyword) >= 4 and (word in keyword or keyword in word):
-                                    return True
-                    
-                    return False
-                
-                # Check for hectic/busy day mentions using fuzzy matching
-                if fuzzy_match(message_lower, ["hectic", "busy", "crazy day", "wild day", "rough day", "tough day"]):
-                    hectic_responses = [
-                        ["Oh wow, sounds like your day has been really hectic! Those kinds of days can be so draining.",
-                         "When everything feels chaotic, it's like you can barely catch your breath between one thing and the next.",
-                         "What's been the most challenging part of your day so far? Sometimes just talking about it helps a bit."],
-                        ["Hectic days are so exhausting! I completely get that overwhelmed feeling when everything's happening at once.",
-                         "It's like you're being pulled in ten different directions and can't fully focus on any one thing properly.",
-                         "Have you had any chance to take even a tiny breather today? Sometimes even 5 minutes can help reset a bit."],
-                        ["Those super busy days can really take it out of you! I'm sorry you're dealing with that chaos.",
-                         "It's tough when you don't even have space to process one thing before the next thing demands your attention.",
-                         "What typically helps you decompress after days like this? I'm here to listen if you just need to vent about it all."]
-                    ]
-                    return random.choice(hectic_responses)
-                
-                # Enhanced boss topic detection with better typo handling
-                if fuzzy_match(message_lower, ["boss", "manager", "supervisor", "superior", "management"]):
-                    boss_responses = [
-                        ["Oh no, boss troubles? That can be so frustrating! I've heard from so many people who struggle with their managers.",
-                         "Sometimes it feels like they just don't understand what we're dealing with day-to-day, right?",
-                         "Tell me more about what's happening with your boss - I really want to understand what you're going through."],
-                        ["Boss issues can be so draining! I totally get why that would be on your mind.",
-                         "The dynamics with managers can really affect our whole mood and even how we feel about ourselves sometimes.",
-                         "What's been happening lately with your boss? I'm all ears and no judgment here."],
-                        ["Ugh, dealing with difficult bosses is seriously one of the hardest parts of work life! I'm sorry you're facing that.",
-                         "It's like they have so much power over our daily experience and when it's not good, it's REALLY not good.",
-                         "Want to vent about what's going on? Sometimes just getting it all out can help a little."]
-                    ]
-                    return random.choice(boss_responses)
-                
-                # Enhanced workload detection with typo tolerance
-                if (fuzzy_match(message_lower, ["work", "job", "task", "project", "deadline", "workload"]) and 
-                    (fuzzy_match(message_lower, ["too much", "so much", "lots", "overload", "overwhelm", "pile", "stress"]) or 
-                    fuzzy_match(message_lower, ["little time", "not enough time", "deadline", "behind", "catching up"]))):
-                    workload_responses = [
-                        ["Wow, sounds like you're completely swamped with work! That overwhelming feeling is the worst.",
-                         "It's like being stuck in quicksand sometimes - the harder you try to catch up, the more exhausted you feel.",
-                         "How long have things been this intense? Have you had any chance to take a breather lately?"],
-                        ["Being overloaded at work is so stressful! I hate that feeling of never being able to catch up.",
-                         "It's not just the work itself that's hard - it's that constant pressure in the back of your mind, even when you're supposed to be relaxing.",
-                         "What's contributing most to the workload right now? Is it a particular project or just everything piling up at once?"],
-                        ["Oh gosh, too much work is seriously the worst! Makes it hard to even think straight sometimes.",
-                         "I find it so frustrating when there's just not enough hours in the day to get everything done properly.",
-                         "Have you been able to talk to anyone at work about redistributing some of the load? Or is that not really an option?"]
-                    ]
-                    return random.choice(workload_responses)
-                
-                # Combined stress and not feeling well detection (improved for broader matching)
-                if fuzzy_match(message_lower, ["stress", "anxious", "worried", "overwhelm", "pressure", "tension"]) or (
-                   fuzzy_match(message_lower, ["not feeling", "feel bad", "feeling bad", "not well", "terrible", "awful"])):
-                    stress_responses = [
-                        ["I can hear that you're feeling really stressed right now. That's such a tough emotional state to be in.",
-                         "Stress has this way of making everything feel heavier and more difficult than it normally would.",
-                         "What do you think is contributing the most to your stress right now? Sometimes identifying the biggest factor can help a little."],
-                        ["Being stressed and not feeling well is such a difficult combination to deal with. I'm sorry you're experiencing that.",
-                         "Our bodies and minds are so connected - when one is struggling, the other usually feels it too.",
-                         "Have you been able to do anything small for yourself today that might bring even a moment of relief?"],
-                        ["Stress can be so physically and emotionally draining! It sounds like you're really going through it right now.",
-                         "Sometimes when we're stressed, everything feels like it's piling on all at once and won't let up.",
-                         "What's one small thing that typically helps you feel even slightly better when you're stressed like this?"]
-                    ]
-                    return random.choice(stress_responses)
-                
-                # Better peer conflict detection with contextual awareness
-                if (fuzzy_match(message_lower, ["peer", "colleague", "coworker", "workmate", "teammate"]) and 
-                    fuzzy_match(message_lower, ["fight", "argument", "conflict", "disagreement", "issue", "problem", "tension"])):
-                    conflict_responses = [
-                        ["Oof, colleague drama is so stressful! Especially since you can't just avoid seeing them like you could with other people.",
-                         "Those workplace relationships get complicated fast when there's tension - it affects everything!",
-                         "Do you want to tell me what happened? Sometimes talking it through with someone outside the situation helps sort things out."],
-                        ["Workplace conflicts are so awkward and draining! I'm sorry you're dealing with that right now.",
-                         "It's like you're stuck in this weird space where you have to keep being professional while also having all these feelings.",
-                         "What led to the conflict? I'm curious to hear your perspective on how things unfolded."],
-                        ["Oh no, trouble with colleagues? That can make even walking into work feel like a huge challenge.",
-                         "Those relationship dynamics at work can really mess with your peace of mind - it's hard to just leave it at the office sometimes.",
-                         "Want to talk about what happened between you two? No judgment here, just a friendly ear."]
-                    ]
-                    return random.choice(conflict_responses)
-                
-                # Add general response for when someone is sharing something negative but topic isn't clear
-                if fuzzy_match(message_lower, ["bad", "awful", "terrible", "worst", "horrible", "not good", "difficult", "rough"]):
-                    general_negative_responses = [
-                        ["I'm sorry to hear you're having a rough time. That really sucks, and I appreciate you sharing that with me.",
-                         "Sometimes life throws a lot at us all at once, and it can feel overwhelming to deal with.",
-                         "Would you like to tell me more about what's going on? I'm here to listen without judgment."],
-                        ["It sounds like things have been pretty difficult for you lately. That's really hard to deal with.",
-                         "When life gets tough, even small things can start to feel like big challenges.",
-                         "What's been the hardest part to handle recently? Sometimes talking through it can help, even just a little."],
-                        ["I'm sorry you're going through this tough time. It takes courage to acknowledge when things aren't going well.",
-                         "Everyone struggles sometimes, and it's completely okay to not be okay.",
-                         "Is there anything specific that's been weighing on you the most? I'm here to listen if you want to talk about it."]
-                    ]
-                    return random.choice(general_negative_responses)
-                
-                # For specific emotional or physical distress triggers, use specialized responses
-                message_lower = message.lower()
-                
-                # Special handling for physical pain mentions with more personal tone
-                if any(word in message_lower for word in ["pain", "paining", "hurt", "ache", "body", "physical"]):
-                    pain_responses = [
-                        ["I'm so sorry you're in pain right now - that's really tough to deal with on top of everything else.",
-                         "Physical discomfort has this way of taking over your whole experience. It's hard to focus on anything else, isn't it?",
-                         "Is there anything that's been helping with the pain, even a little bit? I really wish I could do more than just listen."],
-                        ["Oh no, physical pain is so draining! I really feel for you - it's exhausting to deal with that.",
-                         "Our bodies and minds are so connected - physical pain can really wear down our emotional reserves too.",
-                         "How long have you been feeling this way? I'm here to listen if you want to talk more about what you're experiencing."],
-                        ["Being in pain is such a lonely experience sometimes - I'm really glad you told me about it.",
-                         "It's so hard when your body isn't feeling right. It affects literally everything else in life.",
-                         "What does your pain feel like today? Sometimes putting it into words can help, even just a little."]
-                    ]
-                    return random.choice(pain_responses)
-                
-                # Enhanced handling for mental health crisis with more empathy and urgency
-                if any(phrase in message_lower for phrase in ["want to die", "kill myself", "end it all", "suicide", "not worth living"]):
-                    crisis_responses = [
-                        ["I'm really concerned about what you just shared, and I'm glad you felt you could tell me.",
-                         "Those feelings are incredibly difficult to bear alone, and it takes courage to speak about them.",
-                         "Would it be okay if we talked about some resources that might help? There are people trained specifically to help with these intense feelings.",
-                         "The National Suicide Prevention Lifeline is available 24/7 at 988 or 1-800-273-8255, and they really do care."],
-                        ["I'm giving you my full attention right now because what you're sharing matters deeply.",
-                         "Those dark thoughts can feel overwhelming, but please know you don't have to face them by yourself.",
-                         "Sometimes talking to a crisis counselor who's specially trained can make a real difference - would you consider reaching out to one?",
-                         "You can text HOME to 741741 to reach the Crisis Text Line anytime - they're really good at helping in moments like this."],
-                        ["Thank you for trusting me with something so personal and difficult. That shows real strength.",
-                         "These feelings are incredibly painful, but they don't define you or your future. Things really can get better with support.",
-                         "Would you be willing to talk to a professional who can help navigate these feelings? You deserve that kind of specialized support.",
-                         "The 988 Suicide & Crisis Lifeline has helped many people through moments just like this - they're just a call or text away."]
-                    ]
-                    return random.choice(crisis_responses)
-                
-                # New: Handling for "not feeling well" with more personality
-                if any(phrase in message_lower for phrase in ["not feeling well", "feel sick", "feeling bad", "not good", "terrible", "awful"]):
-                    unwell_responses = [
-                        ["I'm sorry you're not feeling well today. That's really tough, especially when you have other things you want or need to do.",
-                         "Sometimes just having someone acknowledge that you're struggling can help a tiny bit. So consider me officially in your corner!",
-                         "What do you think might help you feel even a little better right now? Even small comforts can make a difference."],
-                        ["Oh no, feeling unwell is the worst! I hate those days when you just can't seem to get comfortable or feel right.",
-                         "Being sick or off-balance affects everything - your mood, your energy, your whole outlook on life!",
-                         "Have you been able to give yourself any little breaks or comforts today? Sometimes that's the best we can do when we're not feeling great."],
-                        ["Not feeling well? That's really rough - I'm sorry you're going through that right now.",
-                         "It's frustrating when our bodies or minds aren't cooperating with what we want to do or how we want to feel.",
-                         "What specifically doesn't feel good? Sometimes talking about it can help make it feel a little less overwhelming."]
-                    ]
-                    return random.choice(unwell_responses)
-                
-                # Fall back to rule-based for other cases
-                return get_rule_based_response(message, chat_history)
+            candidates = [extract_kozy_reply(output['generated_text'], prompt_input) for output in result]
+            checks = reply_validator.check(candidates, analysis)
+            for check in checks:
+                if check.reasons:
+                    print(f"LLM response rejected: '{check.reply}'. Reason: {', '.join(check.reasons)}.")
+            best = reply_validator.choose(checks)
+            if best is None:
+                print(f"All {len(checks)} LLM responses rejected. Falling back to rule-based.")
+                return get_llm_fallback_response(message, chat_history, analysis)
+            kozy_response = best.reply
                 
             # Enhanced conversion to multi-part messages for more natural flow
+            parts = ReplyParts(analysis)
             sentence_parts = []
-            sentences = re.split(r'(?<=[.?!])\s+', kozy_response)
-            current_part = ""
-            
-            # Combine sentences more thoughtfully, aiming for 1-2 sentences per part
-            part_sentence_count = 0
-            for sentence in sentences:
-                if sentence:
-                    current_part += sentence + " "
-                    part_sentence_count += 1
-                    # Create a new part after 1-2 sentences or if length exceeds limit
-                    if part_sentence_count >= random.randint(1, 2) or len(current_part) > 130:
-                         sentence_parts.append(current_part.strip())
-                         current_part = ""
-                         part_sentence_count = 0
-
-            # Add the final part if not empty
-            if current_part.strip():
-                sentence_parts.append(current_part.strip())
-
-            # Ensure at least one part exists
-            if not sentence_parts:
-                 sentence_parts.append(kozy_response)
-
-            # Add appropriate emotes based on emotional content - MORE SUBTLE
-            if sentence_parts:
-                emotion = 'caring'
-                message_lower = message.lower()
-                last_part = sentence_parts[-1]
-
-                if any(word in message_lower for word in ["sad", "hurt", "pain", "upset", "not feeling", "bad", "fight", "conflict", "stress"]):
-                    emotion = 'concerned'
-                    emotes = ["(｡•́‿•̀｡)", "(´｡• ᵕ •｡`)", "♥"]
-                elif any(word in message_lower for word in ["happy", "good", "great", "wonderful", "excited", "amazing", "joy"]):
-                    emotion = 'happy'
-                    emotes = ["✨", "☆", "(>ᴗ<)", "♪"]
-                else: # Default to caring/neutral emotes
-                    emotes = ["✨", "☆", "♥", "( ´･ᴗ･` )", "~"]
-                
-                # Add emote to last part with lower chance (e.g., 40%) and ensure it fits naturally
-                if random.random() < 0.4 and last_part and last_part[-1].isalnum():
-                     sentence_parts[-1] += f" {random.choice(emotes)}"
-                elif random.random() < 0.2 and last_part: # Even lower chance if ending with punctuation
-                     sentence_parts[-1] += f" {random.choice(emotes)}"
-
+            for sentence in re.split(r'(?<=[.?!])\s+', kozy_response):
+                sentence_parts += parts.add(sentence)
+            sentence_parts += parts.finish(kozy_response)
 
             # Final safety check
-            if sentence_parts and any(keyword in sentence_parts[0].lower() for keyword in unsafe_keywords):
+            if sentence_parts and any(keyword in sentence_parts[0].lower() for keyword in UNSAFE_KEYWORDS):
                  print(f"LLM response part rejected post-split (unsafe): '{sentence_parts[0]}'. Falling back to rule-based.")
-                 return get_rule_based_response(message, chat_history)
+                 return get_rule_based_response(message, chat_history, analysis=analysis)
 
             return sentence_parts
                 
         except Exception as e:
             print(f"Error processing LLM response: {e}")
-            return get_rule_based_response(message, chat_history)
+            return get_rule_based_response(message, chat_history, analysis=analysis)
             
     except Exception as e:
         print(f"Error generating response: {e}")
-        return get_rule_based_response(message, chat_history)
+        return get_rule_based_response(message, chat_history, analysis=analysis)
+
+def stream_kozy_response(message, chat_history, emotion_result=None, analysis=None):
+    """get_kozy_response as an iterator over the reply's messages, each yielded once it is final
+
+    The turn is counted and the prompt built right away, while the session can
+    still be saved; generation starts when the iterator is first read.
+    """
+    analysis = analysis or analyze_message(message)
+    emotion_result = start_kozy_turn(message, chat_history, emotion_result)
+    
+    generator = generator_model.get()
+    if generator is None:
+        return iter(get_rule_based_response(message, chat_history, emotion_result.emotion, analysis=analysis) or [])
+    
+    try:
+        prompt, generation_session = prepare_kozy_prompt(generator, message, chat_history, emotion_result, analysis)
+    except Exception as e:
+        print(f"Error generating response: {e}")
+        return iter(get_rule_based_response(message, chat_history, analysis=analysis) or [])
+    return stream_kozy_parts(generator, prompt, generation_session, message, chat_history, analysis)
+
+def stream_kozy_parts(generator, prompt, generation_session, message, chat_history, analysis):
+    """Generate the reply to `prompt` and yield its messages as they are ready
+
+    A sentence is released once it is complete, can't be cut by a cutoff marker any
+    more and the reply so far passes check_kozy_reply. A reply rejected before
+    anything was released falls back like get_kozy_response; one rejected later
+    ends with the sentences already checked.
+    """
+    parts = ReplyParts(analysis)
+    generated = ""
+    sentences_added = 0
+    # The last few characters could still be the start of a cutoff marker
+    unsettled = max(len(marker) for marker in REPLY_CUTOFF_MARKERS) - 1
+    verdict = "wait"
+    try:
+        chunks = generator.stream(prompt.prefix, prompt.suffix, session=generation_session, input_ids=prompt.ids,
+                                  stop_markers=REPLY_CUTOFF_MARKERS, max_new_tokens=prompt.max_new_tokens,
+                                  **KOZY_SAMPLING)
+        # Closing the stream early (a rejection, or the client went away) cancels the generation
+        with contextlib.closing(chunks):
+            for chunk in chunks:
+                generated += chunk
+                kozy_response = generated.lstrip()
+                if any(marker in kozy_response for marker in REPLY_CUTOFF_MARKERS):
+                    break
+                settled = kozy_response[:max(0, len(kozy_response) - unsettled)]
+                sentences = re.split(r'(?<=[.?!])\s+', settled)[:-1]
+                if len(sentences) <= sentences_added:
+                    continue
+                verdict = check_kozy_reply(settled, analysis, complete=False)
+                if verdict == "reject":
+                    break
+                if verdict == "ok":
+                    for sentence in sentences[sentences_added:]:
+                        yield from parts.add(sentence)
+                    sentences_added = len(sentences)
+
+        if verdict != "reject":
+            kozy_response = cut_kozy_reply(generated.strip())
+            verdict = check_kozy_reply(kozy_response, analysis)
+        if verdict == "ok":
+            for sentence in re.split(r'(?<=[.?!])\s+', kozy_response)[sentences_added:]:
+                yield from parts.add(sentence)
+            yield from parts.finish(kozy_response)
+            return
+    except Exception as e:
+        print(f"Error generating response: {e}")
+        if not parts.released:
+            yield from get_rule_based_response(message, chat_history, analysis=analysis) or []
+            return
 
-def get_rule_based_response(message, chat_history=None, user_emotion=None):
+    if parts.released:
+        # Some of the reply is already on the user's screen; end it with the sentences that passed
+        yield from parts.finish(generated.strip())
+    else:
+        yield from get_llm_fallback_response(message, chat_history, analysis) or []
+
+def get_rule_based_response(message, chat_history=None, user_emotion=None, analysis=None):
     """Provide engaging, supportive responses with a mature, empathetic vibe"""
     # We don't need to re-import random here since we now have it globally
-    
-    # Convert message to lowercase for easier matching
-    message_lower = message.lower().strip()
+    analysis = analysis or analyze_message(message)
     
     # Handle greetings and short messages first
-    simple_greetings = ["hi", "hey", "hello", "yo", "sup", "hiya", "good morning", "good afternoon", "good evening"]
-    if message_lower in simple_greetings or message_lower.startswith(tuple(simple_greetings)):
+    if analysis.is_greeting:
         greeting_responses = [
             f"Hi there! It's nice to hear from you. How are you feeling today? ✨",
             f"Hello! I'm here and ready to chat. What's on your mind today?",
@@ -539,37 +683,22 @@ def get_rule_based_response(message, chat_history=None, user_emotion=None):
         ]
         return [random.choice(greeting_responses)]
     
-    # Improved topic detection for more specific responses
-    topic_matches = {
-        "boss": ["boss", "supervisor", "manager"],
-        "workload": ["too much work", "so much work", "overloaded", "workload", "too many tasks", "deadlines", "overwhelmed at work"],
-        "peer_conflict": ["fight with peer", "argument with colleague", "conflict with coworker", "disagreement with team", "colleague issue"],
-        "not_feeling_well": ["not feeling well", "feel sick", "not good", "feeling bad", "unwell", "ill"],
-        "stress": ["stressed", "stress", "anxiety", "anxious", "worried", "overwhelmed", "pressure"]
-    }
-    
-    # Detect primary topic
-    detected_topics = []
-    for topic, keywords in topic_matches.items():
-        if any(keyword in message_lower for keyword in keywords):
-            detected_topics.append(topic)
-    
-    # Enhanced topic-specific responses
-    if "boss" in detected_topics:
+    # Enhanced topic-specific responses, by the topics the classifier found
+    if analysis.has("boss"):
         return [
             "I understand you're dealing with difficulties related to your boss. That can definitely be stressful.",
             "Manager relationships can significantly impact our work experience and wellbeing. Your frustration sounds valid.",
             "Would you like to tell me more about the specific challenges you're facing with your boss? I'm here to listen and support you."
         ]
     
-    if "workload" in detected_topics:
+    if analysis.has("workload"):
         return [
             "It sounds like you're dealing with an overwhelming amount of work right now. That must be really draining.",
             "Having too many tasks and responsibilities can leave us feeling constantly behind and stressed.",
             "How has this heavy workload been affecting you? I'm here to listen if you'd like to talk more about it."
         ]
     
-    if "peer_conflict" in detected_topics:
+    if analysis.has("peers") and analysis.has("conflict"):
         return [
             "I'm sorry to hear about the conflict with your peers. Workplace relationships can be quite challenging.",
             "Arguments with colleagues are particularly difficult since you still need to work together afterward.",
@@ -579,17 +708,15 @@ def get_rule_based_response(message, chat_history=None, user_emotion=None):
     # For specific emotional or physical distress triggers, use specialized responses
     # ...existing code...
 
-def preprocess_user_message(message):
+def preprocess_user_message(message, analysis=None):
     """Check message for patterns that need special responses"""
-    message_lower = message.lower().strip()
-    
-    # Detect greetings and common conversation starters
-    simple_greetings = ["hi", "hey", "hello", "yo", "sup", "hiya", "good morning", "good afternoon", "good evening"]
+    analysis = analysis or analyze_message(message)
+    message_lower = analysis.stripped
     
     # For very short messages, determine the appropriate response type
     if len(message.split()) <= 2:
         # Handle common greetings naturally
-        if message_lower in simple_greetings or message_lower.startswith(tuple(simple_greetings)):
+        if analysis.is_greeting:
             greeting_responses = [
                 f"Hi there! It's nice to hear from you. How are you feeling today? ✨",
                 f"Hello! I'm here and ready to chat. What's on your mind today?",
@@ -605,6 +732,11 @@ def preprocess_user_message(message):
     # Not a special case
     return False, None
 
+def record_reply_latency(route, started):
+    """Record a reply whose messages all became visible at once (first text = complete reply)"""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    reply_latency.record(route, elapsed_ms, elapsed_ms)
+
 def get_session_history():
     """Get chat history from the current session"""
     if 'chat_history' not in session:
@@ -675,6 +807,30 @@ def save_chat_to_firebase(uid, user_message, kozy_response):
         print(f"Error saving to Firebase: {e}")
         return False
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 503 until every model has finished loading (or failed over to its fallback)"""
+    is_ready = model_registry.ready()
+    return jsonify({"ready": is_ready, "models": model_registry.status()}), 200 if is_ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose inference queue and batching metrics"""
+    return jsonify({
+        "emotion_batcher": get_emotion_batcher_stats(),
+        "emotion_cascade": get_cascade_stats(),
+        "emotion_cache": get_emotion_cache_stats(),
+        "session_states": session_states.stats(),
+        "knowledge": knowledge_base.stats(),
+        "topic_cache": topic_cache.stats(),
+        "prefix_cache": prefix_cache.stats(),
+        "session_kv_cache": session_kv_stats(),
+        "prompt_budget": prompt_budget_stats(),
+        "generation": generation_stats(),
+        "reply_latency": reply_latency.stats(),
+        "reply_validator": reply_validator.stats()
+    })
+
 @app.route('/')
 def index():
     """Landing page - asks for Firebase UID"""
@@ -721,9 +877,138 @@ def chat():
     
     return render_template('chat.html', chat_history=chat_history)
 
+def as_reply_parts(kozy_response):
+    """A reply as a list of message parts"""
+    return kozy_response if isinstance(kozy_response, list) else [str(kozy_response)]
+
+def compose_kozy_reply(user_message, chat_history, analysis, emotion_result, kb_state, llm=get_kozy_response):
+    """The reply to a non-crisis message, as a list of segments to send in order
+
+    A special-case reply, the knowledge base's personality reply or the generated
+    one from `llm`, sometimes followed by a FAQ. Every segment is a list of message
+    parts except the generated reply, which is whatever `llm` returns (an iterator
+    of parts from stream_kozy_response).
+    """
+    user_emotion = emotion_result.emotion
+    
+    # Check for special cases that need direct handling
+    is_special, special_response = preprocess_user_message(user_message, analysis)
+    if is_special:
+        return [[special_response]]  # Wrap in list for consistency
+    
+    # Try personality-driven response first with enhanced context awareness
+    try:
+        # Get app feature recommendation if appropriate, passing chat history for context
+        suggested_feature = knowledge_base.get_app_feature(
+            emotion_result, 
+            user_message,
+            chat_history,  # Pass chat history for context-aware suggestions
+            state=kb_state,
+            analysis=analysis
+        )
+        
+        # Get emotion-appropriate personality response with chat history context
+        personality_response = knowledge_base.get_personality_response(
+            user_message, 
+            emotion_result, 
+            suggested_feature,
+            chat_history,  # Pass chat history for personalized responses
+            state=kb_state
+        )
+        
+        # Check for message repetition pattern and avoid it (before generating a reply that
+        # would be replaced anyway)
+        repeating = False
+        if chat_history and len(chat_history) >= 4:
+            recent_kozy_msgs = []
+            for entry in chat_history[-4:]:
+                if isinstance(entry.get('kozy'), list) and len(entry['kozy']) > 0:
+                    recent_kozy_msgs.append(entry['kozy'][0])
+                elif isinstance(entry.get('kozy'), str):
+                    recent_kozy_msgs.append(entry['kozy'])
+            
+            # Check if we're repeating the same message pattern
+            repeating = len(recent_kozy_msgs) > 3 and recent_kozy_msgs[0] == recent_kozy_msgs[2] and recent_kozy_msgs[1] == recent_kozy_msgs[3]
+        
+        if repeating:
+            # We're in a repetition loop, force a different response
+            print("Detected response repetition pattern, generating alternative response")
+            
+            # Use different emotion template to break pattern
+            alternate_emotions = [e for e in ["happy", "sad", "neutral", "excited", "bored"] if e != user_emotion]
+            alt_emotion = random.choice(alternate_emotions)
+            kozy_response = knowledge_base.get_personality_response(
+                user_message, 
+                alt_emotion, 
+                None,  # No feature suggestion in this case
+                chat_history,
+                state=kb_state
+            )
+            
+            # If still seems repetitive, use a completely different approach
+            if isinstance(kozy_response, list) and len(kozy_response) > 0:
+                if any(msg == kozy_response[0] for msg in recent_kozy_msgs):
+                    kozy_response = [
+                        "I notice we might be going in circles a bit. Let's try a different approach.",
+                        "What's one thing you'd like to talk about that we haven't discussed yet? I'm here to listen to anything that's on your mind."
+                    ]
+            segments = [as_reply_parts(kozy_response)]
+        # If we have a good personality response, use it
+        elif personality_response and len(personality_response) > 0:
+            segments = [as_reply_parts(personality_response)]
+        else:
+            # Fall back to LLM or rule-based
+            segments = [llm(user_message, chat_history, emotion_result, analysis)]
+        
+        # Debug: Print out the response type and content
+        print(f"Response type: {type(segments[0])}")
+        print(f"Response content: {segments[0]}")
+        
+        # Check for relevant FAQs that match the topic, append if appropriate
+        # But only do this occasionally to avoid being repetitive
+        if random.random() < 0.25:  # 25% chance to add FAQ
+            relevant_faqs = knowledge_base.find_relevant_faq(
+                user_message, 
+                emotion_result, 
+                chat_history,
+                state=kb_state,
+                analysis=analysis
+            )
+            
+            if relevant_faqs:
+                faq = relevant_faqs[0]
+                # Insert the FAQ as the last message
+                segments.append([f"By the way, {faq['q']} {faq['a']}"])
+        
+        return segments
+        
+    except Exception as personality_error:
+        print(f"Personality response failed: {str(personality_error)}")
+        # Fall back to LLM response
+        return [llm(user_message, chat_history, emotion_result, analysis)]
+
+def checked_reply_parts(segments):
+    """The message parts of a composed reply in order, after the final safety check
+
+    Only the first part is checked for immediate safety issues; if it fails, the
+    safe substitute is sent instead of the reply.
+    """
+    first = True
+    for segment in segments:
+        for part in segment:
+            if first and any(keyword in str(part).lower() for keyword in UNSAFE_KEYWORDS):
+                print(f"Final response rejected (unsafe): '{part}'. Substituting safe response.")
+                if hasattr(segment, "close"):
+                    segment.close()
+                yield from UNSAFE_REPLY_SUBSTITUTE
+                return
+            first = False
+            yield part
+
 @app.route('/send_message', methods=['POST'])
 def send_message():
     """Handle sending a new message with improved response selection and safety checks"""
+    started = time.perf_counter()
     if 'uid' not in session:
         return jsonify({"error": "Not logged in"}), 401
     
@@ -736,10 +1021,30 @@ def send_message():
     # Get current chat history and tracking info
     chat_history = get_session_history()
     tracking = initialize_user_tracking()
+    kb_state = session_states.get(session['uid'], session.get('firebase_session_key'))
+    # Lowercasing, tokens, keyword hits and the crisis screen, computed once for every consumer below
+    analysis = analyze_message(user_message)
     
     try:
-        # Detect emotion in the user's message
-        user_emotion = detect_emotion(user_message, chat_history)
+        # Crisis messages are answered straight away, before emotion inference, queues or generation
+        if analysis.crisis:
+            kozy_response = get_crisis_response()
+            session['pending_messages'] = kozy_response[1:]
+            chat_history.append({"user": user_message, "kozy": kozy_response, "timestamp": datetime.now().strftime("%H:%M:%S"), "emotion": None})
+            save_chat_to_firebase(session['uid'], user_message, kozy_response[0])
+            session['chat_history'] = chat_history
+            record_reply_latency("send_message", started)
+            return jsonify({
+                "response": kozy_response[0],
+                "has_more": len(kozy_response) > 1,
+                "emotion": None,
+                "crisis": True,
+                "resources": CRISIS_RESOURCES
+            })
+
+        # Detect emotion in the user's message (once per turn; the result is passed along)
+        emotion_result = analyze_emotion(user_message, chat_history)
+        user_emotion = emotion_result.emotion
         
         # Update tracking data with new emotion
         if user_emotion != "neutral":
@@ -747,114 +1052,9 @@ def send_message():
             if len(tracking['detected_emotions']) > 5:
                 tracking['detected_emotions'] = tracking['detected_emotions'][-5:]
         
-        # Check for special cases that need direct handling
-        is_special, special_response = preprocess_user_message(user_message)
-        if is_special:
-            kozy_response = [special_response]  # Wrap in list for consistency
-        else:
-            # Try personality-driven response first with enhanced context awareness
-            try:
-                # Get app feature recommendation if appropriate, passing chat history for context
-                suggested_feature = knowledge_base.get_app_feature(
-                    user_emotion, 
-                    user_message,
-                    chat_history  # Pass chat history for context-aware suggestions
-                )
-                
-                # Get emotion-appropriate personality response with chat history context
-                personality_response = knowledge_base.get_personality_response(
-                    user_message, 
-                    user_emotion, 
-                    suggested_feature,
-                    chat_history  # Pass chat history for personalized responses
-                )
-                
-                # If we have a good personality response, use it
-                if personality_response and len(personality_response) > 0:
-                    kozy_response = personality_response
-                else:
-                    # Fall back to LLM or rule-based
-                    kozy_response = get_kozy_response(user_message, chat_history)
-                
-                # Debug: Print out the response type and content
-                print(f"Response type: {type(kozy_response)}")
-                print(f"Response content: {kozy_response}")
-                
-                # Check for message repetition pattern and avoid it
-                if chat_history and len(chat_history) >= 4:
-                    recent_kozy_msgs = []
-                    for entry in chat_history[-4:]:
-                        if isinstance(entry.get('kozy'), list) and len(entry['kozy']) > 0:
-                            recent_kozy_msgs.append(entry['kozy'][0])
-                        elif isinstance(entry.get('kozy'), str):
-                            recent_kozy_msgs.append(entry['kozy'])
-                    
-                    # Check if we're repeating the same message pattern
-                    if len(recent_kozy_msgs) > 3 and recent_kozy_msgs[0] == recent_kozy_msgs[2] and recent_kozy_msgs[1] == recent_kozy_msgs[3]:
-                        # We're in a repetition loop, force a different response
-                        print("Detected response repetition pattern, generating alternative response")
-                        
-                        # Use different emotion template to break pattern
-                        alternate_emotions = [e for e in ["happy", "sad", "neutral", "excited", "bored"] if e != user_emotion]
-                        alt_emotion = random.choice(alternate_emotions)
-                        kozy_response = knowledge_base.get_personality_response(
-                            user_message, 
-                            alt_emotion, 
-                            None,  # No feature suggestion in this case
-                            chat_history
-                        )
-                        
-                        # If still seems repetitive, use a completely different approach
-                        if isinstance(kozy_response, list) and len(kozy_response) > 0:
-                            if any(msg == kozy_response[0] for msg in recent_kozy_msgs):
-                                kozy_response = [
-                                    "I notice we might be going in circles a bit. Let's try a different approach.",
-                                    "What's one thing you'd like to talk about that we haven't discussed yet? I'm here to listen to anything that's on your mind."
-                                ]
-                
-                # Check for relevant FAQs that match the topic, append if appropriate
-                # But only do this occasionally to avoid being repetitive
-                if random.random() < 0.25:  # 25% chance to add FAQ
-                    relevant_faqs = knowledge_base.find_relevant_faq(
-                        user_message, 
-                        user_emotion, 
-                        chat_history
-                    )
-                    
-                    if relevant_faqs:
-                        faq = relevant_faqs[0]
-                        faq_msg = f"By the way, {faq['q']} {faq['a']}"
-                        
-                        if isinstance(kozy_response, list):
-                            # Insert the FAQ as the last message
-                            kozy_response.append(faq_msg)
-                        else:
-                            kozy_response = [kozy_response, faq_msg]
-                
-            except Exception as personality_error:
-                print(f"Personality response failed: {str(personality_error)}")
-                # Fall back to LLM response
-                kozy_response = get_kozy_response(user_message, chat_history)
-            
-            # Ensure we have a list response
-            if not isinstance(kozy_response, list):
-                kozy_response = [str(kozy_response)]
-        
-        # --- Final Safety Check ---
-        unsafe_keywords = ["fight back", "hit them", "attack", "kill", "hurt them"] 
-        contains_unsafe_content = False
-        if kozy_response and isinstance(kozy_response, list):
-             # Check only the first message part for immediate safety issues
-             if any(keyword in str(kozy_response[0]).lower() for keyword in unsafe_keywords):
-                 contains_unsafe_content = True
-        
-        if contains_unsafe_content:
-            print(f"Final response rejected (unsafe): '{kozy_response[0]}'. Substituting safe response.")
-            # Substitute with a safe, concerned response
-            kozy_response = [
-                "I sense a lot of strong emotions right now, and I want to make sure we talk safely.",
-                "Violence isn't the answer. Can we talk more about what led to this feeling? I'm here to support you. ♥"
-                ]
+        # Pick the reply, then the final safety check on its first message
+        segments = compose_kozy_reply(user_message, chat_history, analysis, emotion_result, kb_state)
+        kozy_response = list(checked_reply_parts(as_reply_parts(segment) for segment in segments))
 
         # Add timestamp to each message for better tracking
         current_time = datetime.now().strftime("%H:%M:%S")
@@ -869,11 +1069,14 @@ def send_message():
             
             # Store the full list for better context
             full_kozy_response_for_history = kozy_response
-            chat_history.append({"user": user_message, "kozy": full_kozy_response_for_history, "timestamp": current_time, "emotion": user_emotion})
+            chat_history.append({"user": user_message, "kozy": full_kozy_response_for_history, "timestamp": current_time, "emotion": user_emotion,
+                                 "emotion_tier": emotion_result.tier})
             save_chat_to_firebase(session['uid'], user_message, first_message)  # Save first message to Firebase
 
             session['chat_history'] = chat_history # Update session history
 
+            # The first message is visible once the whole reply is ready
+            record_reply_latency("send_message", started)
             return jsonify({
                 "response": first_message,
                 "has_more": len(remaining_messages) > 0,
@@ -882,9 +1085,10 @@ def send_message():
         else:
             # Fallback response
             fallback = "I'm processing that. Tell me more about how you feel~"
-            chat_history.append({"user": user_message, "kozy": fallback, "emotion": user_emotion})
+            chat_history.append({"user": user_message, "kozy": fallback, "emotion": user_emotion, "emotion_tier": emotion_result.tier})
             session['chat_history'] = chat_history
             save_chat_to_firebase(session['uid'], user_message, fallback)
+            record_reply_latency("send_message", started)
             return jsonify({"response": fallback, "has_more": False, "emotion": user_emotion})
             
     except Exception as e:
@@ -894,8 +1098,132 @@ def send_message():
         chat_history.append({"user": user_message, "kozy": error_response})
         session['chat_history'] = chat_history
         save_chat_to_firebase(session['uid'], user_message, error_response)
+        record_reply_latency("send_message", started)
         return jsonify({"response": error_response, "has_more": False})
 
+def sse_event(event, data):
+    """One Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/stream_message', methods=['POST'])
+def stream_message():
+    """send_message, with the reply sent as Server-Sent Events while it is generated
+
+    Each message part is a `message` event ({"text", "emotion"}) sent as soon as it
+    is final; a `done` event ends the reply. Generated replies stream part by part
+    (stream_kozy_response), crisis, template and FAQ messages go through the same
+    events. The session cookie goes out with the response headers, so everything
+    that changes the session happens before the stream starts; the `done` event
+    carries the reply's history entries, signed, for the page to post to /commit_turn.
+    """
+    started = time.perf_counter()
+    if 'uid' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    
+    data = request.get_json()
+    user_message = data.get('message', '').strip()
+    
+    if not user_message:
+        return jsonify({"error": "Empty message"}), 400
+    
+    # save_chat_to_firebase would otherwise start a session during the stream, where it can't be kept
+    if not session.get('firebase_session_key'):
+        create_chat_session(session['uid'])
+    uid, session_key = session['uid'], session['firebase_session_key']
+    chat_history = get_session_history()
+    history_length = len(chat_history)
+    tracking = initialize_user_tracking()
+    kb_state = session_states.get(uid, session_key)
+    analysis = analyze_message(user_message)
+    # Nothing is left for /get_next_message; every part of this reply is streamed
+    session['pending_messages'] = []
+    
+    error_response = "I'm having a moment processing that! But I'm still here for you. Could you share more about how you're feeling? ✨"
+    user_emotion = emotion_tier = None
+    done = {}
+    try:
+        # Crisis messages are answered straight away, before emotion inference, queues or generation
+        if analysis.crisis:
+            segments = [get_crisis_response()]
+            done = {"crisis": True, "resources": CRISIS_RESOURCES}
+        else:
+            # Detect emotion in the user's message (once per turn; the result is passed along)
+            emotion_result = analyze_emotion(user_message, chat_history)
+            user_emotion, emotion_tier = emotion_result.emotion, emotion_result.tier
+            if user_emotion != "neutral":
+                tracking['detected_emotions'].append(user_emotion)
+                if len(tracking['detected_emotions']) > 5:
+                    tracking['detected_emotions'] = tracking['detected_emotions'][-5:]
+            segments = compose_kozy_reply(user_message, chat_history, analysis, emotion_result, kb_state,
+                                          llm=stream_kozy_response)
+    except Exception as e:
+        print(f"Error generating response: {str(e)}")
+        segments = [[error_response]]
+    
+    def committable_turn(sent):
+        """The history entries for what was sent, signed for /commit_turn"""
+        # The same history entries as send_message and get_next_message
+        entries = [{"user": user_message, "kozy": sent, "timestamp": datetime.now().strftime("%H:%M:%S"), "emotion": user_emotion,
+                    "emotion_tier": emotion_tier}]
+        entries += [{"user": "", "kozy": part, "emotion": user_emotion} for part in sent[1:]]
+        return turn_serializer.dumps({"uid": uid, "session_key": session_key, "history_length": history_length,
+                                      "entries": entries})
+    
+    def events():
+        sent = []
+        first_text_ms = None
+        try:
+            for part in checked_reply_parts(segments):
+                if first_text_ms is None:
+                    first_text_ms = (time.perf_counter() - started) * 1000
+                sent.append(part)
+                yield sse_event("message", {"text": part, "emotion": user_emotion})
+                save_chat_to_firebase(uid, user_message if len(sent) == 1 else "", part)
+            if not sent:
+                # Fallback response
+                sent.append("I'm processing that. Tell me more about how you feel~")
+                first_text_ms = (time.perf_counter() - started) * 1000
+                yield sse_event("message", {"text": sent[0], "emotion": user_emotion})
+                save_chat_to_firebase(uid, user_message, sent[0])
+            complete_ms = (time.perf_counter() - started) * 1000
+            reply_latency.record("stream_message", first_text_ms, complete_ms)
+            yield sse_event("done", dict(done, emotion=user_emotion, parts=len(sent), turn=committable_turn(sent),
+                                         first_text_ms=first_text_ms, complete_ms=complete_ms))
+        except Exception as e:
+            print(f"Error generating response: {str(e)}")
+            if not sent:
+                sent.append(error_response)
+                yield sse_event("message", {"text": sent[0], "emotion": user_emotion})
+                save_chat_to_firebase(uid, user_message, sent[0])
+            yield sse_event("done", dict(done, emotion=user_emotion, parts=len(sent), turn=committable_turn(sent)))
+    
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/commit_turn', methods=['POST'])
+def commit_turn():
+    """Add a reply streamed by /stream_message to the session's chat history
+
+    The turn is the signed value of the stream's `done` event. It is only added on
+    top of the history it answered, so a turn is committed at most once and never
+    after a newer one.
+    """
+    if 'uid' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    
+    try:
+        turn = turn_serializer.loads(request.get_json().get('turn', ''), max_age=STREAMED_TURN_MAX_AGE)
+    except BadSignature:
+        return jsonify({"error": "Invalid turn"}), 400
+    
+    chat_history = get_session_history()
+    if (turn['uid'] != session['uid'] or turn['session_key'] != session.get('firebase_session_key')
+            or turn['history_length'] != len(chat_history)):
+        return jsonify({"error": "Stale turn"}), 409
+    
+    session['chat_history'] = chat_history + turn['entries']
+    return jsonify({"committed": True})
+
 @app.route('/get_next_message', methods=['GET'])
 def get_next_message():
     """Return the next message in the queue with a simulated typing delay"""
@@ -0,0 +1,72 @@
+"""Fallback rate and reply time with one and several reply candidates
+
+Answers a set of messages through get_kozy_response with the same seeds for
+each number of candidates, and records how often no candidate passed the
+reply validator (so the canned fallback was sent), how often a candidate
+other than the first was sent, and the time per reply. The candidates are
+sampled as one batch sharing the prompt's prefill, so several of them should
+cost much less than that many generate calls.
+
+Needs transformers, torch and the gpt2 weights. Run from the repository root:
+    python benchmarks/candidates_benchmark.py --candidates 1 4
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGES = [
+    "I feel like I can't keep up with anything at work anymore",
+    "my boss keeps piling on deadlines",
+    "hey, I actually had a really nice weekend",
+    "I'm so anxious about the review on Friday",
+    "I had an argument with a colleague and now the team is tense"
+]
+HISTORY = [{"user": "work has been rough lately", "kozy": ["That sounds draining. What's been the hardest part?"]}]
+
+def main():
+    parser = argparse.ArgumentParser(description="Reply candidates benchmark")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[1, 4], help="Candidates per reply to compare")
+    parser.add_argument("--samples", type=int, default=4, help="Seeds per message")
+    args = parser.parse_args()
+
+    os.environ.setdefault("KOZY_MODEL_LOADING", "eager")
+    with contextlib.redirect_stdout(sys.stderr):
+        import random
+        import app
+        from emotion_result import EmotionResult
+        from transformers import set_seed
+
+    report = {}
+    with app.app.test_request_context(), contextlib.redirect_stdout(sys.stderr):
+        for candidates in args.candidates:
+            app.REPLY_CANDIDATES = candidates
+            before = app.reply_validator.stats()
+            timings = []
+            for message in MESSAGES:
+                analysis = app.analyze_message(message)
+                for seed in range(args.samples):
+                    random.seed(seed)
+                    set_seed(seed)
+                    start = time.perf_counter()
+                    app.get_kozy_response(message, HISTORY, EmotionResult("sad", intensity=0.7), analysis)
+                    timings.append((time.perf_counter() - start) * 1000)
+            after = app.reply_validator.stats()
+            replies = after["replies"] - before["replies"]
+            report[candidates] = {
+                "replies": replies,
+                "fallback_rate": ((after["no_candidate_passed"] - before["no_candidate_passed"]) / replies
+                                  if replies else 0.0),
+                "saved_by_later_candidate": after["saved_by_later_candidate"] - before["saved_by_later_candidate"],
+                "mean_ms": statistics.mean(timings),
+                "rejected": {reason: count - before["rejected"][reason] for reason, count in after["rejected"].items()}
+            }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Complexity-regression check for the per-turn routing functions
+
+Drives find_relevant_faq, get_app_feature, get_personality_response,
+preprocess_user_message and get_rule_based_response with chat histories of
+10, 100, 1,000 and 10,000 turns. For each history length a conversation
+state is brought up to date once, then the median cost of further calls (one
+new message per call, as in a live conversation) is measured. A line fitted
+to log(cost) against log(history length) gives each function's scaling
+exponent: about 0 means flat, about 1 means linear.
+
+--catalog-scale does the same against FAQ and feature catalogs scaled up by
+synthetic factors (at a fixed history length), where linear growth in the
+FAQ search is expected.
+
+Exits non-zero if any exponent is above --max-exponent (super-linear by
+default). Run from the repository root:
+    python benchmarks/complexity_benchmark.py
+    python benchmarks/complexity_benchmark.py --catalog-scale 1 10 100
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+MESSAGES = [
+    "my name is Sam and work has been rough", "my boss keeps piling on deadlines and I have too much work",
+    "I had an argument with colleague today and the whole team is tense",
+    "I feel lonely since my friend moved away, I just want to talk",
+    "I need to relax, the stress is too much", "I'm not feeling well and my body aches",
+    "how do I handle conflict with my partner without another fight",
+    "I want to take better care of my health", "the bus was late again today", "hi", "ok"
+]
+EMOTIONS = ["sad", "fear", "angry", "happy", "bored", "neutral"]
+
+def make_history(turns, rng):
+    return [{"user": rng.choice(MESSAGES), "kozy": ["I'm here for you."], "timestamp": str(turn),
+             "emotion": rng.choice(EMOTIONS)} for turn in range(turns)]
+
+def routing_calls(app):
+    """name -> call(message, emotion, chat_history, state, analysis)"""
+    kb = app.knowledge_base
+    return {
+        "find_relevant_faq": lambda m, e, h, s, a: kb.find_relevant_faq(m, e, h, state=s, analysis=a),
+        "get_app_feature": lambda m, e, h, s, a: kb.get_app_feature(e, m, h, state=s, analysis=a),
+        "get_personality_response": lambda m, e, h, s, a: kb.get_personality_response(m, e, None, h, state=s),
+        "preprocess_user_message": lambda m, e, h, s, a: app.preprocess_user_message(m, a),
+        "get_rule_based_response": lambda m, e, h, s, a: app.get_rule_based_response(m, h, e, analysis=a)
+    }
+
+def time_calls(app, call, history_length, calls, rng):
+    """Median microseconds per call once a conversation of history_length turns is under way"""
+    from session_state import SessionState
+
+    chat_history = make_history(history_length, rng)
+    state = SessionState()
+    # The first call folds the existing history into the state; that is paid once per session
+    message = rng.choice(MESSAGES)
+    call(message, "sad", chat_history, state, app.analyze_message(message))
+
+    timings = []
+    for turn in range(calls):
+        message = rng.choice(MESSAGES)
+        emotion = rng.choice(EMOTIONS)
+        analysis = app.analyze_message(message)
+        start = time.perf_counter()
+        call(message, emotion, chat_history, state, analysis)
+        timings.append((time.perf_counter() - start) * 1e6)
+        chat_history.append({"user": message, "kozy": ["ok"], "timestamp": f"{history_length}-{turn}", "emotion": emotion})
+    return statistics.median(timings)
+
+def scaling_exponent(sizes, costs):
+    """Slope of log(cost) against log(size)"""
+    return float(np.polyfit(np.log(sizes), np.log(costs), 1)[0])
+
+def scaled_content(factor):
+    """The knowledge source with every FAQ category and feature category `factor` times as large"""
+    from knowledge_bundle import KNOWLEDGE_SOURCE_PATH, KnowledgeContent
+
+    with open(KNOWLEDGE_SOURCE_PATH, encoding="utf-8") as f:
+        data = json.load(f)
+    for faqs in data["faqs"].values():
+        originals = list(faqs)
+        faqs.extend({"q": f"{faq['q']} (variant {i})", "a": faq["a"]} for i in range(1, factor) for faq in originals)
+    for features in data["app_features"].values():
+        originals = list(features)
+        features.extend(dict(feature, name=f"{feature['name']} {i}") for i in range(1, factor) for feature in originals)
+    return KnowledgeContent(data)
+
+def check(results, sizes, max_exponent, label):
+    report = {}
+    for name, costs in results.items():
+        exponent = scaling_exponent(sizes, costs)
+        report[name] = {
+            f"us_per_call_by_{label}": dict(zip(map(str, sizes), costs)),
+            "exponent": exponent,
+            "super_linear": exponent > max_exponent
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-call cost scaling of the routing functions")
+    parser.add_argument("--history", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--catalog-scale", type=int, nargs="+", help="Also scale the FAQ/feature catalogs by these factors")
+    parser.add_argument("--catalog-history", type=int, default=100, help="History length for the catalog runs")
+    parser.add_argument("--calls", type=int, default=300, help="Timed calls per point")
+    parser.add_argument("--max-exponent", type=float, default=1.1)
+    args = parser.parse_args()
+
+    # Routing only: never load the models, and keep their load messages off stdout
+    os.environ.setdefault("KOZY_MODEL_LOADING", "lazy")
+    with contextlib.redirect_stdout(sys.stderr):
+        import app
+    calls = routing_calls(app)
+
+    report = {}
+    with app.app.test_request_context(), contextlib.redirect_stdout(sys.stderr):
+        results = {name: [time_calls(app, call, length, args.calls, random.Random(length))
+                          for length in args.history] for name, call in calls.items()}
+        report["history"] = check(results, args.history, args.max_exponent, "history")
+
+        if args.catalog_scale:
+            original = app.knowledge_base.content
+            results = {name: [] for name in calls}
+            sizes = []
+            try:
+                for factor in args.catalog_scale:
+                    content = scaled_content(factor)
+                    app.knowledge_base.install(content)
+                    sizes.append(len(content.faq_index) + len(content.feature_table))
+                    for name, call in calls.items():
+                        results[name].append(time_calls(app, call, args.catalog_history, args.calls, random.Random(factor)))
+            finally:
+                app.knowledge_base.install(original)
+            report["catalog"] = check(results, sizes, args.max_exponent, "catalog_size")
+
+    failures = [f"{scope}.{name}" for scope, functions in report.items()
+                for name, result in functions.items() if result["super_linear"]]
+    report["max_exponent"] = args.max_exponent
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
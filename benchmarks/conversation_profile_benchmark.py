@@ -0,0 +1,61 @@
+"""Per-turn cost of KnowledgeBase personalization as a conversation grows
+
+Plays a conversation turn by turn and times get_app_feature +
+get_personality_response at several history lengths, with a persistent
+SessionState (incremental ConversationProfile) and without one (the whole
+history is rescanned every turn). The incremental numbers should stay flat.
+
+Run from the repository root:
+    python benchmarks/conversation_profile_benchmark.py
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import KnowledgeBase
+from session_state import SessionState
+
+MESSAGES = [
+    "my name is Sam and work has been rough", "my boss keeps calling me at night",
+    "I feel lonely since my friend moved away", "I need to relax, the stress is too much",
+    "I had a nice walk today", "I want to take better care of my health"
+]
+
+def play(knowledge_base, turns, checkpoints, stateful, rng):
+    """Time one conversation; returns {checkpoint: median ms per turn around it}"""
+    state = SessionState() if stateful else None
+    chat_history = []
+    timings = {}
+    for turn in range(1, turns + 1):
+        message = rng.choice(MESSAGES)
+        start = time.perf_counter()
+        feature = knowledge_base.get_app_feature("sad", message, chat_history, state=state)
+        knowledge_base.get_personality_response(message, "sad", feature, chat_history, state=state)
+        elapsed = (time.perf_counter() - start) * 1000
+        for checkpoint in checkpoints:
+            if checkpoint - 10 < turn <= checkpoint:
+                timings.setdefault(checkpoint, []).append(elapsed)
+        chat_history.append({"user": message, "kozy": ["ok"], "timestamp": str(turn), "emotion": "sad"})
+    return {str(checkpoint): statistics.median(values) for checkpoint, values in timings.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-turn personalization cost vs conversation length")
+    parser.add_argument("--checkpoints", type=int, nargs="+", default=[10, 100, 500, 2000])
+    args = parser.parse_args()
+
+    knowledge_base = KnowledgeBase()
+    turns = max(args.checkpoints)
+    report = {
+        "incremental_ms_per_turn": play(knowledge_base, turns, args.checkpoints, True, random.Random(1)),
+        "rescan_ms_per_turn": play(knowledge_base, turns, args.checkpoints, False, random.Random(1))
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Latency and sanity benchmark for the crisis screening fast path
+
+Times screen_crisis on short, typical and very long messages and checks a
+small set of crisis / non-crisis phrasings (including typos and obfuscation).
+Exits non-zero if any check fails or p99 latency goes over --max-ms.
+
+Run from the repository root:
+    python benchmarks/crisis_benchmark.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crisis_screener import screen_crisis
+
+CRISIS_MESSAGES = [
+    "I want to die", "i wanna diiiie", "I want to kill myself", "k1ll mys3lf", "kill my self",
+    "thinking about suicde", "I feel suicidial", "im going to end it all", "I want to ennd my life",
+    "i dont want to live anymore", "Sometimes I want to hurt myslef", "self-harm again", "kms",
+    "im gonna kms", "I just want to kms", "I'm going to kill myself laughing... no, I mean it, I want to die"
+]
+
+SAFE_MESSAGES = [
+    "I could kill for a pizza", "this movie is to die for", "my boss is killing me",
+    "I want to dye my hair", "I hurt my knee", "the meeting will end at 5", "self care sunday",
+    "I killed it at the gym", "I want to diet", "I ran 10 kms today", "we drove 300 kms to see grandma",
+    "only 5 kms left, kms is a long way", "going to kill myself laughing", "I was killing myself laughing",
+    "I want to die of embarrassment"
+]
+
+LATENCY_MESSAGES = {
+    "short": "ok",
+    "typical": "I had a long day at work and my boss was really annoying, I just want to go home and sleep",
+    "long": " ".join(["today was a lot and I am tired of everything going wrong at work"] * 150)
+}
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Crisis screener latency benchmark")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--max-ms", type=float, default=1.0, help="p99 budget for the typical message")
+    args = parser.parse_args()
+
+    missed = [message for message in CRISIS_MESSAGES if not screen_crisis(message)]
+    false_alarms = [message for message in SAFE_MESSAGES if screen_crisis(message)]
+
+    latency = {}
+    for name, message in LATENCY_MESSAGES.items():
+        iterations = args.iterations if name != "long" else max(10, args.iterations // 100)
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            screen_crisis(message)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        latency[name] = {
+            "words": len(message.split()),
+            "p50_ms": percentile(timings, 0.50),
+            "p99_ms": percentile(timings, 0.99)
+        }
+
+    report = {"missed": missed, "false_alarms": false_alarms, "latency": latency}
+    print(json.dumps(report, indent=2))
+
+    failed = missed or false_alarms or latency["typical"]["p99_ms"] > args.max_ms
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Generated tokens and generation time with and without early stopping
+
+Samples get_kozy_response replies for a set of prompts three ways, with the
+same seed each time: without stopping criteria (always max_new_tokens),
+stopping at the reply cutoff markers only, and stopping at the markers or at
+the first sentence end past KOZY_STOP_SENTENCE_CHARS. Since the sampled
+tokens are the same up to the stop, the markers-only replies must come out
+identical to the full ones after the usual cutoff; the benchmark checks that.
+
+Needs transformers, torch and the gpt2 weights. Run from the repository root:
+    python benchmarks/early_stop_benchmark.py
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGES = [
+    "I feel like I can't keep up with anything at work anymore",
+    "my boss keeps piling on deadlines",
+    "hey, I actually had a really nice weekend",
+    "I'm so anxious about the review on Friday",
+    "I had an argument with a colleague and now the team is tense"
+]
+HISTORY = [{"user": "work has been rough lately", "kozy": ["That sounds draining. What's been the hardest part?"]}]
+
+def reply(app, generated_text):
+    """The reply as get_kozy_response extracts it"""
+    marker = "Now, formulate your response as Kozy:"
+    text = generated_text[generated_text.find(marker) + len(marker):].strip()
+    for cutoff in app.REPLY_CUTOFF_MARKERS:
+        if cutoff in text:
+            text = text.split(cutoff)[0].strip()
+    return text
+
+def main():
+    parser = argparse.ArgumentParser(description="Early-stopping benchmark for reply generation")
+    parser.add_argument("--samples", type=int, default=4, help="Seeds per prompt")
+    args = parser.parse_args()
+
+    os.environ.setdefault("KOZY_MODEL_LOADING", "lazy")
+    with contextlib.redirect_stdout(sys.stderr):
+        import app
+        import generation
+        from emotion_result import EmotionResult
+        from transformers import set_seed
+        generator = app.load_generator()
+
+    sampling = {"temperature": 0.8, "top_k": 50, "top_p": 0.94, "do_sample": True, "repetition_penalty": 1.2,
+                "pad_token_id": 50256}
+    modes = {
+        "no_stop": {},
+        "markers": {"stop_markers": app.REPLY_CUTOFF_MARKERS, "min_chars": 0},
+        "markers_and_sentence": {"stop_markers": app.REPLY_CUTOFF_MARKERS, "min_chars": generation.STOP_SENTENCE_CHARS}
+    }
+    results = {mode: {"tokens": [], "ms": [], "reply_chars": []} for mode in modes}
+    replies = {mode: [] for mode in modes}
+    with app.app.test_request_context(), contextlib.redirect_stdout(sys.stderr):
+        for message in MESSAGES:
+            prompt = app.build_kozy_prompt(generator.budget, message, HISTORY, EmotionResult("sad", intensity=0.7),
+                                           app.analyze_message(message))
+            for seed in range(args.samples):
+                for mode, options in modes.items():
+                    set_seed(seed)
+                    start = time.perf_counter()
+                    output = generator.generate(prompt.prefix, prompt.suffix, input_ids=prompt.ids,
+                                                stop_markers=options.get("stop_markers"),
+                                                stop_min_chars=options.get("min_chars", 0),
+                                                max_new_tokens=prompt.max_new_tokens, **sampling)
+                    results[mode]["ms"].append((time.perf_counter() - start) * 1000)
+                    text = output[0]["generated_text"]
+                    results[mode]["tokens"].append(len(generator.tokenizer.encode(text[len(prompt.text):])))
+                    replies[mode].append(reply(app, text))
+                    results[mode]["reply_chars"].append(len(replies[mode][-1]))
+
+    report = {mode: {name: statistics.mean(values) for name, values in measured.items()}
+              for mode, measured in results.items()}
+    report["markers_replies_identical"] = replies["markers"] == replies["no_stop"]
+    for mode in ("markers", "markers_and_sentence"):
+        report[mode]["speedup"] = report["no_stop"]["ms"] / report[mode]["ms"]
+    report["generation"] = generation.generation_stats()
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
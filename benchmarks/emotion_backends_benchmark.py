@@ -0,0 +1,112 @@
+"""Parity and latency/memory comparison for the emotion inference backends
+
+Each backend runs in its own subprocess so resident memory is measured in
+isolation. Labels from every backend are compared against the fp32 pipeline
+on the fixture corpus; the script exits non-zero when agreement drops below
+--min-agreement.
+
+Run from the repository root:
+    python benchmarks/emotion_backends_benchmark.py
+    python benchmarks/emotion_backends_benchmark.py --backends pipeline int8
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from model_registry import resident_memory_mb
+
+DEFAULT_CORPUS = os.path.join(ROOT, "benchmarks", "fixtures", "emotion_corpus.txt")
+
+def load_corpus(path):
+    """Read one message per line"""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def run_backend(name, corpus, batch_size, repeats):
+    """Load one backend and time it on the corpus (runs inside the worker subprocess)"""
+    from emotion_backends import load_backend
+
+    baseline_mb = resident_memory_mb()
+    start = time.perf_counter()
+    backend = load_backend(name)
+    load_seconds = time.perf_counter() - start
+    backend.classify(corpus[:1])  # warm-up
+
+    single_ms = []
+    for _ in range(repeats):
+        for text in corpus:
+            start = time.perf_counter()
+            backend.classify([text])
+            single_ms.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    labels = []
+    for offset in range(0, len(corpus), batch_size):
+        labels.extend(scores[0]["label"] for scores in backend.classify(corpus[offset:offset + batch_size]))
+    batched_seconds = time.perf_counter() - start
+
+    loaded_mb = resident_memory_mb()
+    single_ms.sort()
+    return {
+        "backend": name,
+        "load_seconds": load_seconds,
+        "p50_ms": statistics.median(single_ms),
+        "p95_ms": single_ms[max(0, int(len(single_ms) * 0.95) - 1)],
+        "batched_msgs_per_sec": len(corpus) / batched_seconds if batched_seconds else None,
+        "model_rss_mb": loaded_mb - baseline_mb if loaded_mb and baseline_mb else None,
+        "labels": labels
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Emotion backend parity and latency/memory comparison")
+    parser.add_argument("--backends", nargs="+", default=["pipeline", "onnx", "int8"])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-agreement", type=float, default=0.95,
+                        help="Required label agreement with the pipeline backend")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+
+    if args.worker:
+        print(json.dumps(run_backend(args.worker, corpus, args.batch_size, args.repeats)))
+        return
+
+    results = {}
+    for name in dict.fromkeys(["pipeline"] + args.backends):
+        command = [sys.executable, os.path.abspath(__file__), "--worker", name, "--corpus", args.corpus,
+                   "--batch-size", str(args.batch_size), "--repeats", str(args.repeats)]
+        completed = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+        if completed.returncode != 0:
+            print(f"{name}: failed to run\n{completed.stderr.strip()}", file=sys.stderr)
+            continue
+        results[name] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    if "pipeline" not in results:
+        sys.exit("The pipeline backend is needed as the parity reference")
+
+    reference = results["pipeline"]["labels"]
+    failed = False
+    report = []
+    for name, result in results.items():
+        labels = result.pop("labels")
+        agreement = sum(a == b for a, b in zip(labels, reference)) / len(reference)
+        result["agreement_with_pipeline"] = agreement
+        if agreement < args.min_agreement:
+            failed = True
+        report.append(result)
+
+    print(json.dumps({"corpus_size": len(corpus), "results": report}, indent=2))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Benchmark and profiling suite for emotion_detector
+
+Measures end-to-end analyze_emotion/detect_emotion throughput and latency on
+synthetic and fixture corpora (short, long and negation-heavy messages, with
+several history lengths), plus per-tier timings for the crisis screen,
+keyword matcher, linear tier and transformer. It also checks that an emotion
+carried over from the history fades once the emotional message is out of the
+lookback window, and exits non-zero if it does not. Results are JSON so runs
+from different commits can be compared:
+
+    python benchmarks/emotion_benchmark.py --stub-model --out before.json
+    python benchmarks/emotion_benchmark.py --stub-model --compare before.json
+
+--stub-model swaps the transformer for an instant fake backend so the
+pure-Python paths can be measured on their own.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURE_CORPUS = os.path.join(ROOT, "benchmarks", "fixtures", "emotion_corpus.txt")
+HISTORY_LENGTHS = [0, 3, 20, 100]
+
+FILLER = ["today", "work", "the", "and", "my", "friend", "was", "it", "really", "just", "about",
+          "because", "then", "we", "I", "think", "maybe", "again", "after", "that"]
+EMOTION_WORDS = ["happy", "sad", "angry", "excited", "scared", "bored", "lonely", "furious",
+                 "worried", "thrilled", "can't wait", "fed up", "nothing to do", "upset"]
+NEGATORS = ["not", "never", "don't", "isn't", "no", "nobody", "nothing"]
+MODIFIERS = ["very", "so", "kind of", "a bit", "really", "extremely", "barely"]
+
+class StubBackend:
+    """Instant fake emotion backend: always fairly sure the message is neutral"""
+    name = "stub"
+
+    def classify(self, texts):
+        return [[{"label": "neutral", "score": 0.9}, {"label": "joy", "score": 0.1}] for _ in texts]
+
+def synthetic_corpus(kind, size, rng):
+    """Generate messages of one shape: short, long or negation-heavy"""
+    messages = []
+    for _ in range(size):
+        if kind == "short":
+            words = rng.sample(FILLER, rng.randint(0, 2)) + [rng.choice(EMOTION_WORDS + FILLER)]
+        elif kind == "long":
+            words = [rng.choice(FILLER + EMOTION_WORDS + MODIFIERS) for _ in range(rng.randint(200, 400))]
+        else:
+            words = []
+            for _ in range(rng.randint(5, 15)):
+                words += [rng.choice(NEGATORS), rng.choice(MODIFIERS), rng.choice(EMOTION_WORDS)]
+                words.append(rng.choice([",", ".", "and", "but"]))
+        messages.append(" ".join(words))
+    return messages
+
+def fixture_corpus():
+    with open(FIXTURE_CORPUS, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def synthetic_history(length, rng):
+    """Chat history entries like send_message stores them (a few legacy ones without 'emotion')"""
+    history = []
+    for i in range(length):
+        entry = {"user": " ".join(rng.sample(FILLER, 4) + [rng.choice(EMOTION_WORDS)]), "kozy": "I hear you."}
+        if i % 7:
+            entry["emotion"] = rng.choice(["sad", "neutral", "happy", "fear"])
+        history.append(entry)
+    return history
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def time_calls(function, arguments):
+    """Run function over every argument tuple and summarise latency and throughput"""
+    timings = []
+    start_all = time.perf_counter()
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - start_all
+
+    timings.sort()
+    return {
+        "calls": len(timings),
+        "msgs_per_sec": len(timings) / elapsed if elapsed else None,
+        "p50_ms": percentile(timings, 0.50) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000
+    }
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / 1024.0 if sys.platform != "darwin" else usage / (1024.0 * 1024.0)
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT).stdout.strip() or None
+    except OSError:
+        return None
+
+HISTORY_FADE_MESSAGES = ["I am so sad today", "ok", "the weather is mild", "what time is it",
+                         "lets talk about football", "nice"]
+# Turns after the emotional one that may still inherit its emotion (analyze_emotion looks back 3 messages)
+HISTORY_FADE_TURNS = 3
+
+def history_fade_check():
+    """Play one emotional message and several neutral ones, storing history entries the way
+    send_message does; return the (message, emotion, tier) turns that kept the emotion too long"""
+    import emotion_detector
+
+    history = []
+    lingering = []
+    for turn, message in enumerate(HISTORY_FADE_MESSAGES):
+        result = emotion_detector.analyze_emotion(message, history)
+        if turn > HISTORY_FADE_TURNS and result.emotion != "neutral":
+            lingering.append([message, result.emotion, result.tier])
+        history.append({"user": message, "kozy": ["I hear you."], "emotion": result.emotion, "emotion_tier": result.tier})
+    return lingering
+
+def run_suite(size, seed):
+    """Run every benchmark and return the JSON-ready results"""
+    import emotion_detector
+    from crisis_screener import screen_crisis
+
+    rng = random.Random(seed)
+    corpora = {kind: synthetic_corpus(kind, size, rng) for kind in ("short", "long", "negation")}
+    corpora["fixture"] = fixture_corpus()
+    histories = {length: synthetic_history(length, rng) for length in HISTORY_LENGTHS}
+
+    results = {"end_to_end": {}, "history": {}, "tiers": {}}
+
+    # End-to-end analyze_emotion, cold (empty cache) and warm (every message seen before)
+    for name, corpus in corpora.items():
+        emotion_detector.emotion_cache.clear()
+        cold = time_calls(emotion_detector.analyze_emotion, [(text,) for text in corpus])
+        warm = time_calls(emotion_detector.analyze_emotion, [(text,) for text in corpus])
+        results["end_to_end"][name] = {"cold": cold, "warm": warm}
+
+    # History lookback cost for messages with no emotion of their own
+    neutral_messages = [(" ".join(rng.sample(FILLER, 5)),) for _ in range(size)]
+    for length, history in histories.items():
+        emotion_detector.emotion_cache.clear()
+        results["history"][str(length)] = time_calls(emotion_detector.analyze_emotion,
+                                                     [(text, history) for (text,) in neutral_messages])
+
+    # Individual tiers on the mixed synthetic corpus
+    mixed = [(text,) for kind in ("short", "long", "negation") for text in corpora[kind]]
+    results["tiers"]["crisis_screen"] = time_calls(screen_crisis, mixed)
+    results["tiers"]["keywords"] = time_calls(emotion_detector.detect_emotion_keywords, mixed)
+    results["tiers"]["keyword_match_only"] = time_calls(emotion_detector.match_keywords, mixed)
+    linear_emotion_model = emotion_detector.get_linear_emotion_model()
+    if linear_emotion_model:
+        results["tiers"]["linear"] = time_calls(linear_emotion_model.predict, mixed)
+    if emotion_detector.get_emotion_backend():
+        results["tiers"]["transformer"] = time_calls(emotion_detector.detect_emotion_model, mixed[:200])
+
+    results["history_fade_lingering"] = history_fade_check()
+    results["emotion_cache"] = emotion_detector.get_emotion_cache_stats()
+    results["emotion_batcher"] = emotion_detector.get_emotion_batcher_stats()
+    return results
+
+def compare(current, previous, path=""):
+    """Yield (metric path, previous, current, ratio) for every latency/throughput number"""
+    for key, value in current.items():
+        here = f"{path}.{key}" if path else key
+        before = previous.get(key) if isinstance(previous, dict) else None
+        if isinstance(value, dict):
+            yield from compare(value, before or {}, here)
+        elif key.endswith("_ms") or key == "msgs_per_sec":
+            if isinstance(before, (int, float)) and before and isinstance(value, (int, float)):
+                yield here, before, value, value / before
+
+def main():
+    parser = argparse.ArgumentParser(description="emotion_detector benchmark suite")
+    parser.add_argument("--size", type=int, default=300, help="Messages per synthetic corpus")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--stub-model", action="store_true", help="Replace the transformer with an instant fake")
+    parser.add_argument("--out", help="Write the JSON results to this file as well as stdout")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    parser.add_argument("--max-slowdown", type=float, default=None,
+                        help="With --compare, exit non-zero if any p95 gets this many times slower")
+    args = parser.parse_args()
+
+    if args.stub_model:
+        import emotion_backends
+        emotion_backends.BACKENDS[StubBackend.name] = StubBackend
+        os.environ["KOZY_EMOTION_BACKEND"] = StubBackend.name
+
+    # Model loading prints status lines; keep stdout clean for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        start = time.perf_counter()
+        import emotion_detector  # noqa: F401 - timed to catch anything heavy creeping back into import
+        from model_registry import model_registry
+        import_seconds = time.perf_counter() - start
+        model_registry.load_all()
+        results = run_suite(args.size, args.seed)
+
+    report = {
+        "revision": git_revision(),
+        "stub_model": args.stub_model,
+        "import_seconds": import_seconds,
+        "models": model_registry.status(),
+        "results": results,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+
+    failed = bool(results["history_fade_lingering"])
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressed = False
+        print(f"\nCompared with {args.compare} (revision {previous.get('revision')}):", file=sys.stderr)
+        for metric, before, after, ratio in compare(report["results"], previous.get("results", {})):
+            print(f"  {metric:55s} {before:10.3f} -> {after:10.3f}  x{ratio:.2f}", file=sys.stderr)
+            if args.max_slowdown and metric.endswith("p95_ms") and ratio > args.max_slowdown:
+                regressed = True
+        failed = failed or regressed
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
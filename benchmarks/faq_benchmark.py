@@ -0,0 +1,97 @@
+"""Scaling benchmark for inverted-index FAQ retrieval
+
+Builds a KnowledgeBase, adds a synthetic FAQ library of the requested sizes
+and times index construction plus FaqIndex.search / find_relevant_faq per
+message. Exits non-zero if search p99 at the largest size goes over --max-ms.
+
+Run from the repository root:
+    python benchmarks/faq_benchmark.py
+    python benchmarks/faq_benchmark.py --sizes 1000 50000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from faq_index import tokenize
+from knowledge_base import KnowledgeBase
+from topic_classifier import TOPIC_KEYWORDS
+
+MESSAGES = [
+    "I'm so stressed about work, my boss keeps piling on deadlines",
+    "my friend and I had a fight and I don't know how to handle the conflict",
+    "I feel anxious and worried all the time lately and I can't sleep",
+    "I'm bored, there is nothing to do this weekend and I have so much free time",
+    "I got a promotion and want to celebrate with my team",
+    "my workload is overwhelming and the project deadline is tomorrow"
+]
+
+def synthetic_faqs(size, category_topics, rng):
+    """Random FAQ questions drawn from the categories' topic keywords plus a pool of filler words"""
+    vocabulary = [word for topics in category_topics.values() for topic in topics
+                  for keyword in TOPIC_KEYWORDS[topic] for word in keyword.split()]
+    filler = [f"topic{i}" for i in range(5000)]
+    categories = list(category_topics)
+    library = {}
+    for i in range(size):
+        words = rng.sample(vocabulary, 2) + rng.sample(filler, rng.randint(2, 6))
+        library.setdefault(rng.choice(categories), []).append({"q": f"How to {' '.join(words)} {i}?", "a": "..."})
+    return library
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def time_ms(function, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        function(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {"p50_ms": percentile(timings, 0.50), "p99_ms": percentile(timings, 0.99)}
+
+def main():
+    parser = argparse.ArgumentParser(description="FAQ retrieval scaling benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 30000])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--max-ms", type=float, default=1.0, help="search p99 budget at the largest size")
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    category_topics = KnowledgeBase().content.category_topics
+    categories = list(category_topics)
+    message_tokens = [tokenize(message) for message in MESSAGES]
+
+    results = []
+    for size in args.sizes:
+        library = synthetic_faqs(size, category_topics, rng)
+        knowledge_base = KnowledgeBase()
+
+        start = time.perf_counter()
+        for category, faqs in library.items():
+            for faq in faqs:
+                knowledge_base.faq_index.add(category, faq)
+        build_seconds = time.perf_counter() - start
+
+        def search(i):
+            knowledge_base.faq_index.search(message_tokens[i % len(MESSAGES)], categories, "fear", k=5)
+
+        def find(i):
+            knowledge_base.find_relevant_faq(MESSAGES[i % len(MESSAGES)], "sad")
+
+        results.append({
+            "faqs": len(knowledge_base.faq_index),
+            "build_seconds": build_seconds,
+            "search_top5": time_ms(search, args.iterations),
+            "find_relevant_faq": time_ms(find, args.iterations)
+        })
+
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if results and results[-1]["search_top5"]["p99_ms"] > args.max_ms else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Recall and latency of semantic vs keyword FAQ retrieval
+
+Runs the labelled paraphrases in fixtures/faq_queries.jsonl (messages that
+mean an FAQ without sharing its words) through the keyword scorer and the
+embedding index, and reports recall@1 / recall@k plus per-message latency
+(encoding and search separately for the semantic path).
+
+--synthetic-rows times the index search alone on a random matrix of that many
+rows, float32 and int8, which needs neither the encoder nor a built index.
+
+Run from the repository root (build the index first for the semantic numbers):
+    python faq_embeddings.py build
+    python benchmarks/faq_semantic_benchmark.py
+    python benchmarks/faq_semantic_benchmark.py --synthetic-rows 50000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from faq_embeddings import DEFAULT_INDEX_PATH, SemanticFaqIndex, SentenceEncoder
+from faq_index import tokenize
+from knowledge_base import KnowledgeBase
+
+QUERIES_PATH = os.path.join(ROOT, "benchmarks", "fixtures", "faq_queries.jsonl")
+
+def load_queries(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarise(hits_at_1, hits_at_k, timings_ms):
+    timings_ms = sorted(timings_ms)
+    return {
+        "recall_at_1": statistics.mean(hits_at_1),
+        "recall_at_k": statistics.mean(hits_at_k),
+        "p50_ms": statistics.median(timings_ms),
+        "p95_ms": timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * 0.95))]
+    }
+
+def keyword_results(knowledge_base, queries, k):
+    """The keyword scorer over every category, with its usual score >= 2 cut-off"""
+    categories = list(knowledge_base.faqs)
+    hits_at_1, hits_at_k, timings = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        top = knowledge_base.faq_index.search(tokenize(query["message"]), categories, k=k)
+        timings.append((time.perf_counter() - start) * 1000)
+        questions = [faq["q"] for score, faq in top if score >= 2]
+        hits_at_1.append(questions[:1] == [query["q"]])
+        hits_at_k.append(query["q"] in questions)
+    return summarise(hits_at_1, hits_at_k, timings)
+
+def semantic_results(index, encoder, queries, k, threshold):
+    hits_at_1, hits_at_k, encode_ms, search_ms = [], [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        vector = encoder.encode([query["message"]])[0]
+        encode_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        top = index.search(vector, k=k, threshold=threshold)
+        search_ms.append((time.perf_counter() - start) * 1000)
+
+        questions = [index.entries[row][1] for _, row in top]
+        hits_at_1.append(questions[:1] == [query["q"]])
+        hits_at_k.append(query["q"] in questions)
+
+    result = summarise(hits_at_1, hits_at_k, [e + s for e, s in zip(encode_ms, search_ms)])
+    result["encode_p50_ms"] = statistics.median(encode_ms)
+    result["search_p50_ms"] = statistics.median(search_ms)
+    return result
+
+def synthetic_search(rows, dim, iterations):
+    """Search latency on random unit vectors, stored as float32 and as int8"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((rows, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[rng.integers(0, rows, iterations)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for dtype in ("float32", "int8"):
+            path = os.path.join(directory, dtype)
+            if dtype == "int8":
+                scales = np.abs(vectors).max(axis=1) / 127.0
+                np.save(path + ".npy", np.round(vectors / scales[:, None]).astype(np.int8))
+                np.save(path + ".scales.npy", scales.astype(np.float32))
+            else:
+                np.save(path + ".npy", vectors)
+            with open(path + ".json", "w") as f:
+                json.dump({"model": "synthetic", "dtype": dtype, "dim": dim,
+                           "entries": [{"category": "synthetic", "q": str(i)} for i in range(rows)]}, f)
+
+            index = SemanticFaqIndex(path)
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                index.search(query, k=5)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            results[dtype] = {
+                "rows": rows,
+                "file_mb": os.path.getsize(path + ".npy") / (1024 * 1024),
+                "p50_ms": statistics.median(timings),
+                "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Semantic vs keyword FAQ retrieval benchmark")
+    parser.add_argument("--queries", default=QUERIES_PATH)
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="Embedding index path without extension")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.45)
+    parser.add_argument("--synthetic-rows", type=int, help="Also time search on a random index of this many rows")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    knowledge_base = KnowledgeBase()
+    report = {"queries": len(queries), "keyword": keyword_results(knowledge_base, queries, args.k), "semantic": None}
+
+    try:
+        index = SemanticFaqIndex(args.index)
+        encoder = SentenceEncoder(index.model_name)
+        report["semantic"] = semantic_results(index, encoder, queries, args.k, args.threshold)
+    except Exception as e:
+        print(f"Skipping semantic retrieval: {e}", file=sys.stderr)
+
+    if args.synthetic_rows:
+        report["synthetic_search"] = synthetic_search(args.synthetic_rows, args.dim, args.iterations)
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
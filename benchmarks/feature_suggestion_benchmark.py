@@ -0,0 +1,87 @@
+"""Feature suggestion cost as the app feature catalog grows
+
+Builds synthetic catalogs (the real categories padded with weighted features
+that have cooldowns) and times get_app_feature with a suggestion on every
+message, so every call goes through the ranking table. Per-call latency should
+stay flat from a handful of features to many hundreds.
+
+Run from the repository root:
+    python benchmarks/feature_suggestion_benchmark.py
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import KnowledgeBase
+from knowledge_bundle import KNOWLEDGE_SOURCE_PATH, KnowledgeContent, validate_content
+from message_analysis import analyze_message
+from session_state import SessionState
+
+MESSAGES = [
+    "I feel so alone, I just want someone to talk to",
+    "work stress is too much, I need to relax and calm down",
+    "I want to understand my emotions better",
+    "the bus was late again today"
+]
+EMOTIONS = ["sad", "fear", "angry", "happy", "bored", "neutral"]
+
+def synthetic_catalog(base, features_per_category, rng):
+    data = json.loads(json.dumps(base))
+    data["feature_suggestions"] = {"every_n_messages": 1, "max_seen": 8}
+    for category, features in data["app_features"].items():
+        for i in range(len(features), features_per_category):
+            features.append({"name": f"{category} extra {i}", "feature": f"{category}_{i}",
+                             "description": "Synthetic feature", "weight": round(rng.uniform(0.1, 3.0), 2),
+                             "cooldown": rng.choice([0, 0, 10, 50])})
+    assert not validate_content(data)
+    return data
+
+def main():
+    parser = argparse.ArgumentParser(description="Feature suggestion scaling benchmark")
+    parser.add_argument("--per-category", type=int, nargs="+", default=[2, 25, 100, 250])
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(KNOWLEDGE_SOURCE_PATH, encoding="utf-8") as f:
+        base = json.load(f)
+    rng = random.Random(7)
+    analyses = [analyze_message(message) for message in MESSAGES]
+    knowledge_base = KnowledgeBase()
+
+    results = []
+    for per_category in args.per_category:
+        data = synthetic_catalog(base, per_category, rng)
+        start = time.perf_counter()
+        content = KnowledgeContent(data)
+        build_seconds = time.perf_counter() - start
+        knowledge_base.install(content)
+
+        states = [SessionState() for _ in range(100)]
+        timings = []
+        suggested = 0
+        for i in range(args.calls):
+            analysis = analyses[i % len(analyses)]
+            start = time.perf_counter()
+            feature = knowledge_base.get_app_feature(EMOTIONS[i % len(EMOTIONS)], analysis.text,
+                                                     state=states[i % len(states)], analysis=analysis)
+            timings.append((time.perf_counter() - start) * 1e6)
+            suggested += feature is not None
+        timings.sort()
+        results.append({
+            "features": len(content.feature_table),
+            "rankings_precomputed": len(content.feature_table.rankings),
+            "content_build_seconds": build_seconds,
+            "suggestion_rate": suggested / args.calls,
+            "p50_us": timings[len(timings) // 2],
+            "p99_us": timings[int(len(timings) * 0.99)]
+        })
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Hot-reload check for the knowledge content bundle
+
+Worker threads keep asking the KnowledgeBase for personality responses and
+FAQs while the main thread rebuilds the bundle (with a new version and new
+templates) several times. Checks that:
+
+  - no request fails or is answered from content older than the version
+    that was current when it started
+  - every rebuild is picked up by the bundle watcher
+  - request latency stays flat while bundles are swapped
+
+Exits non-zero on any failure. Run from the repository root:
+    python benchmarks/knowledge_reload_stress.py
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import KnowledgeBase
+from knowledge_bundle import KNOWLEDGE_SOURCE_PATH, KnowledgeContent, validate_content, write_bundle
+
+def versioned_content(base, version):
+    """The source content with every template and FAQ answer tagged with its version"""
+    data = json.loads(json.dumps(base))
+    data["version"] = version
+    data["emotion_responses"] = {emotion: [f"[v{version}] {template}" for template in templates]
+                                 for emotion, templates in data["emotion_responses"].items()}
+    for faqs in data["faqs"].values():
+        for faq in faqs:
+            faq["a"] = f"[v{version}] {faq['a']}"
+    assert not validate_content(data)
+    return KnowledgeContent(data)
+
+def main():
+    parser = argparse.ArgumentParser(description="Knowledge bundle hot-reload stress check")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rebuilds", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.02, help="Bundle watcher poll interval")
+    args = parser.parse_args()
+
+    with open(KNOWLEDGE_SOURCE_PATH, encoding="utf-8") as f:
+        base = json.load(f)
+    bundle_path = os.path.join(tempfile.mkdtemp(prefix="kozy-knowledge-"), "knowledge.bundle")
+    write_bundle(versioned_content(base, 0), bundle_path)
+
+    knowledge_base = KnowledgeBase(bundle_path=bundle_path)
+    knowledge_base.watch_bundle(args.interval)
+
+    stop = threading.Event()
+    errors = []
+    stale = []
+    seen_versions = set()
+    latencies = {"steady": [], "swapping": []}
+    swapping = threading.Event()
+
+    def worker():
+        message = "I feel stressed about work and my boss, how do I handle it?"
+        while not stop.is_set():
+            try:
+                start = time.perf_counter()
+                version = knowledge_base.content.version
+                response = knowledge_base.get_personality_response(message, "sad")
+                faqs = knowledge_base.find_relevant_faq(message, "sad")
+                elapsed = (time.perf_counter() - start) * 1000
+                latencies["swapping" if swapping.is_set() else "steady"].append(elapsed)
+                answer_versions = [int(text[2:text.index("]")]) for text in response[:1] + [faq["a"] for faq in faqs]]
+                if min(answer_versions) < version:
+                    stale.append((version, answer_versions))
+                seen_versions.update(answer_versions)
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(0.2)
+    reload_seconds = []
+    for version in range(1, args.rebuilds + 1):
+        swapping.set()
+        start = time.perf_counter()
+        write_bundle(versioned_content(base, version), bundle_path)
+        while knowledge_base.content.version != version and time.perf_counter() - start < 5:
+            time.sleep(0.001)
+        reload_seconds.append(time.perf_counter() - start)
+        swapping.clear()
+        time.sleep(0.05)
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    def p99(values):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * 0.99))] if values else None
+
+    report = {
+        "requests": len(latencies["steady"]) + len(latencies["swapping"]),
+        "errors": errors[:5],
+        "stale_answers": stale[:5],
+        "final_version": knowledge_base.content.version,
+        "reloads": knowledge_base.reloads,
+        "versions_served": len(seen_versions),
+        "max_seconds_to_pick_up_rebuild": max(reload_seconds),
+        "steady_p99_ms": p99(latencies["steady"]),
+        "during_swap_p99_ms": p99(latencies["swapping"])
+    }
+    print(json.dumps(report, indent=2))
+
+    failed = errors or stale or knowledge_base.content.version != args.rebuilds or knowledge_base.reloads != args.rebuilds
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Per-turn cost of keyword routing in /send_message
+
+Times the pure-Python part of a turn, everything except emotion inference and
+generation: the crisis screen, preprocess_user_message, get_app_feature,
+get_personality_response, find_relevant_faq and get_rule_based_response. When
+the checkout has MessageAnalysis, the message is analysed once and handed to
+every step; otherwise each step scans the message itself as before.
+
+To compare against an older version, check it out next to this one and point
+--repo at it:
+    git worktree add /tmp/kozy-before <commit>
+    python benchmarks/message_analysis_benchmark.py --repo /tmp/kozy-before
+    python benchmarks/message_analysis_benchmark.py
+"""
+import argparse
+import contextlib
+import inspect
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+MESSAGES = [
+    "hi", "hey there", "ok",
+    "my boss keeps piling on deadlines and I have too much work to do",
+    "I had an argument with colleague today and now the whole team is tense",
+    "I feel lonely and nobody wants to talk to me since my friend moved away",
+    "I'm not feeling well, I think I'm getting sick and my body aches",
+    "honestly I'm so stressed and anxious about everything, I can't relax or calm down",
+    "I got the promotion! I'm so proud and happy, we should celebrate",
+    "nothing to do today, so bored, everything feels dull and monotonous",
+    "how do I handle conflict with my partner without another fight?",
+    "the bus was late again and it rained the whole way home"
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-turn keyword routing cost")
+    parser.add_argument("--repo", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="Checkout to benchmark (default: this one)")
+    parser.add_argument("--turns", type=int, default=5000)
+    args = parser.parse_args()
+
+    # Routing only: never load the models, and keep their load messages off stdout
+    os.environ.setdefault("KOZY_MODEL_LOADING", "lazy")
+    sys.path.insert(0, os.path.abspath(args.repo))
+    with contextlib.redirect_stdout(sys.stderr):
+        import app
+        from session_state import SessionState
+    shared = hasattr(app, "analyze_message")
+
+    def extra(function, analysis):
+        return {"analysis": analysis} if "analysis" in inspect.signature(function).parameters else {}
+
+    rng = random.Random(1)
+    state = SessionState()
+    chat_history = []
+    timings = []
+    with app.app.test_request_context(), contextlib.redirect_stdout(sys.stderr):
+        for turn in range(args.turns):
+            message = rng.choice(MESSAGES)
+            start = time.perf_counter()
+            if shared:
+                analysis = app.analyze_message(message)
+                crisis = analysis.crisis
+            else:
+                analysis = None
+                crisis = app.screen_crisis(message)
+            if not crisis:
+                app.preprocess_user_message(message, **extra(app.preprocess_user_message, analysis))
+                kb = app.knowledge_base
+                feature = kb.get_app_feature("sad", message, chat_history, state=state, **extra(kb.get_app_feature, analysis))
+                kb.get_personality_response(message, "sad", feature, chat_history, state=state)
+                kb.find_relevant_faq(message, "sad", chat_history, state=state, **extra(kb.find_relevant_faq, analysis))
+                app.get_rule_based_response(message, chat_history, "sad", **extra(app.get_rule_based_response, analysis))
+            timings.append((time.perf_counter() - start) * 1e6)
+            chat_history.append({"user": message, "kozy": ["ok"], "timestamp": str(turn), "emotion": "sad"})
+
+    timings.sort()
+    print(json.dumps({
+        "repo": os.path.abspath(args.repo),
+        "shared_analysis": shared,
+        "turns": args.turns,
+        "us_per_turn_mean": statistics.mean(timings),
+        "us_per_turn_p50": timings[len(timings) // 2],
+        "us_per_turn_p99": timings[int(len(timings) * 0.99)]
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
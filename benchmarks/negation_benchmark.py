@@ -0,0 +1,73 @@
+"""Pathological-input benchmark for keyword emotion detection
+
+Feeds detect_emotion_keywords very long messages full of negators and emotion
+words and checks that latency grows linearly with message length.
+
+Run from the repository root:
+    python benchmarks/negation_benchmark.py
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from emotion_detector import detect_emotion_keywords
+
+# Message shapes that used to make the negation regexes backtrack
+PATTERNS = {
+    "repeated_negators": "not never no nobody nothing ",
+    "negated_emotions": "not happy never sad don't worry isn't boring ",
+    "negator_then_rant": None,  # built separately: one "not" then a long rant
+    "clause_heavy": "not happy, really sad. never angry; so bored! ",
+}
+
+def build_message(pattern, word_count):
+    """Build a message of roughly `word_count` words from a pattern"""
+    if pattern == "negator_then_rant":
+        return "not " + " ".join(["the", "day", "was", "long"] * (word_count // 4)) + " happy"
+    chunk = PATTERNS[pattern]
+    repeats = max(1, word_count // len(chunk.split()))
+    return chunk * repeats
+
+def time_call(message, repeats):
+    """Return the best-of-N wall time of one detect_emotion_keywords call"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        detect_emotion_keywords(message)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Negation scoping latency benchmark")
+    parser.add_argument("--words", type=int, default=10000, help="Largest message size in words")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed calls per size (best is kept)")
+    parser.add_argument("--max-ms", type=float, default=250.0, help="Latency budget for the largest message")
+    parser.add_argument("--max-growth", type=float, default=3.0,
+                        help="Allowed slowdown per word between the smallest and largest size")
+    args = parser.parse_args()
+
+    sizes = [args.words // 10, args.words // 2, args.words]
+    failed = False
+
+    for pattern in PATTERNS:
+        timings = []
+        for size in sizes:
+            message = build_message(pattern, size)
+            timings.append(time_call(message, args.repeats))
+
+        per_word = [t / size for t, size in zip(timings, sizes)]
+        growth = per_word[-1] / per_word[0] if per_word[0] else 1.0
+        largest_ms = timings[-1] * 1000
+        ok = largest_ms <= args.max_ms and growth <= args.max_growth
+        failed = failed or not ok
+
+        print(f"{pattern:20s} " + "  ".join(f"{size:>6d}w {t * 1000:8.2f}ms" for size, t in zip(sizes, timings))
+              + f"  growth/word x{growth:.2f}  {'OK' if ok else 'FAIL'}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Time to first token with and without the prompt-prefix KV cache
+
+Builds real get_kozy_response prompts (several emotions, intensities and
+conversation lengths) and measures how long GPT-2 takes to produce the first
+token when the whole prompt is prefilled through the pipeline, and when the
+header comes from the prefix cache and only the rest is prefilled. Every
+style variant is generated once before timing, so the cached numbers are the
+steady state. A greedy continuation is also generated both ways to check that
+the cache does not change the output.
+
+Needs transformers, torch and the gpt2 weights. Run from the repository root:
+    python benchmarks/prefix_cache_benchmark.py
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HISTORY = [
+    {"user": "work has been rough lately", "kozy": ["That sounds draining. What's been the hardest part?"]},
+    {"user": "my boss keeps piling on deadlines", "kozy": ["That's a lot of pressure to be under."]},
+    {"user": "and I had an argument with a colleague", "kozy": ["Oof, that makes the days even harder."]}
+]
+MESSAGES = [
+    "I feel like I can't keep up with anything at work anymore",
+    "hey, I actually had a really nice weekend",
+    "I'm so anxious about the review on Friday"
+]
+STYLES = [("sad", 0.9), ("happy", 0.5), ("fear", 0.2), ("neutral", 0.5)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt-prefix KV cache time-to-first-token benchmark")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--check-tokens", type=int, default=20, help="Greedy tokens compared between the two paths")
+    args = parser.parse_args()
+
+    os.environ.setdefault("KOZY_MODEL_LOADING", "lazy")
+    with contextlib.redirect_stdout(sys.stderr):
+        import app
+        from emotion_result import EmotionResult
+        generator = app.load_generator()
+
+    prompts = []
+    with app.app.test_request_context():
+        for emotion, intensity in STYLES:
+            for history_length in (0, len(HISTORY)):
+                for message in MESSAGES:
+                    emotion_result = EmotionResult(emotion, intensity=intensity)
+                    prompt = app.build_kozy_prompt(generator.budget, message, HISTORY[:history_length], emotion_result,
+                                                   app.analyze_message(message))
+                    prompts.append((prompt.prefix, prompt.suffix))
+
+    greedy = {"do_sample": False, "pad_token_id": 50256}
+    timings = {"full_prefill_ms": [], "cached_prefix_ms": []}
+    same_output = True
+    with contextlib.redirect_stdout(sys.stderr):
+        for prefix, suffix in prompts:
+            generator.prefix_state(prefix)
+        for _ in range(args.repeats):
+            for prefix, suffix in prompts:
+                start = time.perf_counter()
+                generator(prefix + suffix, max_new_tokens=1, **greedy)
+                timings["full_prefill_ms"].append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                generator.generate(prefix, suffix, max_new_tokens=1, **greedy)
+                timings["cached_prefix_ms"].append((time.perf_counter() - start) * 1000)
+
+        for prefix, suffix in prompts[::4]:
+            full = generator(prefix + suffix, max_new_tokens=args.check_tokens, **greedy)[0]["generated_text"]
+            cached = generator.generate(prefix, suffix, max_new_tokens=args.check_tokens, **greedy)[0]["generated_text"]
+            same_output = same_output and full == cached
+
+    tokenizer = generator.tokenizer
+    report = {
+        "prompts": len(prompts),
+        "style_variants": len(STYLES),
+        "prompt_tokens_mean": statistics.mean(len(tokenizer.encode(p + s)) for p, s in prompts),
+        "prefix_tokens_mean": statistics.mean(len(tokenizer.encode(p)) for p, _ in prompts),
+        "same_greedy_output": same_output,
+        "prefix_cache": app.prefix_cache.stats()
+    }
+    for name, values in timings.items():
+        values.sort()
+        report[name] = {"p50": values[len(values) // 2], "p90": values[int(len(values) * 0.9)]}
+    report["ttft_speedup_p50"] = report["full_prefill_ms"]["p50"] / report["cached_prefix_ms"]["p50"]
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Per-turn prefill with and without the per-session KV cache
+
+Plays a multi-turn conversation through get_kozy_response's prompt builder and,
+for every turn, measures the time to the first token and the number of prompt
+tokens that had to be prefilled: once with only the header prefix cache (the
+history window slides and every turn re-encodes the conversation), and once
+with a GenerationSession (the window is anchored and only the new turns are
+prefilled). A greedy continuation of each session prompt is also compared
+against the plain pipeline to check that the cache does not change the output.
+
+Needs transformers, torch and the gpt2 weights. Run from the repository root:
+    python benchmarks/session_kv_benchmark.py --turns 20
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGES = [
+    "work has been rough lately",
+    "my boss keeps piling on deadlines",
+    "and I had an argument with a colleague today",
+    "I don't really know how to talk to them about it",
+    "maybe I just need a break this weekend",
+    "thanks, that actually helps a bit"
+]
+REPLY = ["That sounds like a lot to carry.", "What would help most right now?"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-session KV cache prefill benchmark")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--check-tokens", type=int, default=20, help="Greedy tokens compared with the plain pipeline")
+    args = parser.parse_args()
+
+    os.environ.setdefault("KOZY_MODEL_LOADING", "lazy")
+    with contextlib.redirect_stdout(sys.stderr):
+        import app
+        import generation
+        from emotion_result import EmotionResult
+        generator = app.load_generator()
+
+    greedy = {"do_sample": False, "pad_token_id": 50256}
+    emotion_result = EmotionResult("sad", intensity=0.7)
+    session = generation.GenerationSession()
+    chat_history = []
+    turns = []
+    same_output = True
+    with app.app.test_request_context(), contextlib.redirect_stdout(sys.stderr):
+        for turn in range(args.turns):
+            message = MESSAGES[turn % len(MESSAGES)]
+            analysis = app.analyze_message(message)
+            row = {}
+
+            prompt = app.build_kozy_prompt(generator.budget, message, chat_history, emotion_result, analysis)
+            before = generation.session_kv_stats()
+            start = time.perf_counter()
+            generator.generate(prompt.prefix, prompt.suffix, input_ids=prompt.ids, max_new_tokens=1, **greedy)
+            row["sliding_ttft_ms"] = (time.perf_counter() - start) * 1000
+            after = generation.session_kv_stats()
+            row["sliding_prefill_tokens"] = (after["prompt_tokens"] - before["prompt_tokens"]) - (after["reused_tokens"] - before["reused_tokens"])
+
+            history_start = session.window_start(len(chat_history), app.RECENT_EXCHANGES, app.MAX_ANCHORED_EXCHANGES)
+            prompt = app.build_kozy_prompt(generator.budget, message, chat_history, emotion_result, analysis,
+                                           history_start=history_start)
+            if prompt.stats["history_dropped"]:
+                session.restart_window(len(chat_history) - prompt.stats["history_kept"] // 2)
+            before = generation.session_kv_stats()
+            start = time.perf_counter()
+            generator.generate(prompt.prefix, prompt.suffix, session=session, input_ids=prompt.ids, max_new_tokens=1, **greedy)
+            row["session_ttft_ms"] = (time.perf_counter() - start) * 1000
+            after = generation.session_kv_stats()
+            row["session_prefill_tokens"] = (after["prompt_tokens"] - before["prompt_tokens"]) - (after["reused_tokens"] - before["reused_tokens"])
+            row["prompt_tokens"] = after["prompt_tokens"] - before["prompt_tokens"]
+
+            if turn % 5 == 4:
+                # Check on a copy so the session's own state is not advanced twice
+                check = generation.GenerationSession()
+                check.token_ids, check.past_key_values = session.token_ids, session.past_key_values
+                cached = generator.generate(prompt.prefix, prompt.suffix, session=check, input_ids=prompt.ids,
+                                            max_new_tokens=args.check_tokens, **greedy)
+                full = generator(prompt.text, max_new_tokens=args.check_tokens, **greedy)
+                same_output = same_output and cached[0]["generated_text"] == full[0]["generated_text"]
+
+            turns.append(row)
+            chat_history.append({"user": message, "kozy": REPLY})
+
+    report = {"turns": len(turns), "same_greedy_output": same_output, "per_turn": turns}
+    for name in ("sliding_prefill_tokens", "session_prefill_tokens", "sliding_ttft_ms", "session_ttft_ms"):
+        report[f"{name}_mean"] = statistics.mean(row[name] for row in turns)
+    report["prefill_token_reduction"] = report["sliding_prefill_tokens_mean"] / max(1, report["session_prefill_tokens_mean"])
+    report["session_kv_cache"] = generation.session_kv_stats()
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
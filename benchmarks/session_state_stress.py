@@ -0,0 +1,118 @@
+"""Concurrency stress check for per-session KnowledgeBase state
+
+Many threads drive get_app_feature / find_relevant_faq for many users at once
+(several threads per user, so the same session is hit concurrently too) and
+then check that:
+
+  - every user's feature_suggestion_count equals the number of calls made
+    for that user (no lost updates, no cross-talk between users)
+  - every user was offered the same first feature, i.e. one user's
+    suggestions never suppressed another's
+  - the store never holds more than --max-sessions records, and idle
+    sessions expire after the TTL
+
+Exits non-zero on any failure. Run from the repository root:
+    python benchmarks/session_state_stress.py
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import KnowledgeBase
+from session_state import SessionStateStore
+
+MESSAGES = [
+    "I'm so stressed about work, my boss keeps piling on deadlines",
+    "I feel lonely and nobody wants to talk to me",
+    "my friend and I had a fight and I don't know how to handle the conflict",
+    "I can't calm down, I need to relax after this week"
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-session KnowledgeBase state stress check")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--threads-per-user", type=int, default=3)
+    parser.add_argument("--calls", type=int, default=20, help="Calls per thread")
+    parser.add_argument("--max-sessions", type=int, default=80)
+    args = parser.parse_args()
+
+    knowledge_base = KnowledgeBase()
+    store = SessionStateStore(max_sessions=args.max_sessions, ttl_seconds=None)
+    # Every user has a session of their own that the store is not allowed to evict mid-run
+    pinned = SessionStateStore(max_sessions=args.users, ttl_seconds=None)
+
+    first_features = {}
+    first_lock = threading.Lock()
+    errors = []
+    start_barrier = threading.Barrier(args.users * args.threads_per_user)
+
+    def worker(uid):
+        try:
+            start_barrier.wait()
+            for call in range(args.calls):
+                state = pinned.get(uid, "s1")
+                # Same message for every feature call, so every user should be offered the same first feature.
+                # The session lock (re-entrant) is held until it is recorded, so a later turn's feature
+                # from another thread of the same user cannot be recorded first
+                with state.lock:
+                    feature = knowledge_base.get_app_feature("sad", MESSAGES[0], state=state)
+                    if feature:
+                        with first_lock:
+                            first_features.setdefault(uid, feature["name"])
+                knowledge_base.find_relevant_faq(MESSAGES[call % len(MESSAGES)], "sad", state=state)
+                # Churn through the bounded store as well
+                store.get(uid, f"churn-{call}")
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=worker, args=(f"user-{u}",))
+               for u in range(args.users) for _ in range(args.threads_per_user)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    expected_count = args.threads_per_user * args.calls
+    counts = {f"user-{u}": pinned.get(f"user-{u}", "s1").feature_suggestion_count for u in range(args.users)}
+    wrong_counts = {uid: count for uid, count in counts.items() if count != expected_count}
+    distinct_first = sorted(set(first_features.values()))
+
+    # Idle sessions expire after the TTL
+    expiring = SessionStateStore(max_sessions=10, ttl_seconds=0.05)
+    expiring.get("idle")
+    time.sleep(0.1)
+    expiring.get("active")
+
+    report = {
+        "threads": len(threads),
+        "calls": len(threads) * args.calls * 2,
+        "seconds": elapsed,
+        "calls_per_sec": len(threads) * args.calls * 2 / elapsed,
+        "errors": errors[:5],
+        "wrong_counts": dict(list(wrong_counts.items())[:5]),
+        "distinct_first_features": distinct_first,
+        "store": store.stats(),
+        "expired_after_ttl": expiring.stats()["expirations"],
+        "peak_traced_mb": peak_bytes / (1024 * 1024),
+        "state_example": pinned.get("user-0", "s1").as_dict()
+    }
+    print(json.dumps(report, indent=2))
+
+    failed = (errors or wrong_counts or len(distinct_first) > 1 or len(store) > args.max_sessions
+              or report["expired_after_ttl"] != 1)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Time to first visible text with and without streaming
+
+Answers a set of messages two ways, with the same seed each time: through
+get_kozy_response, where the first message can only be shown once the whole
+reply is generated and split, and through stream_kozy_response, where the
+first message is shown as soon as its sentences are complete and checked. For
+both it records the time to the first message and to the complete reply, and
+checks that the two produce the same messages.
+
+Needs transformers, torch and the gpt2 weights. Run from the repository root:
+    python benchmarks/streaming_benchmark.py
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGES = [
+    "I feel like I can't keep up with anything at work anymore",
+    "my boss keeps piling on deadlines",
+    "hey, I actually had a really nice weekend",
+    "I'm so anxious about the review on Friday",
+    "I had an argument with a colleague and now the team is tense"
+]
+HISTORY = [{"user": "work has been rough lately", "kozy": ["That sounds draining. What's been the hardest part?"]}]
+
+def percentiles(values):
+    values = sorted(values)
+    return {"p50": values[len(values) // 2], "p90": values[int(len(values) * 0.9)]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming time-to-first-visible-text benchmark")
+    parser.add_argument("--samples", type=int, default=4, help="Seeds per message")
+    args = parser.parse_args()
+
+    os.environ.setdefault("KOZY_MODEL_LOADING", "eager")
+    with contextlib.redirect_stdout(sys.stderr):
+        import random
+        import app
+        from emotion_result import EmotionResult
+        from transformers import set_seed
+
+    timings = {mode: {"first_text_ms": [], "complete_ms": []} for mode in ("whole_reply", "streamed")}
+    same_messages = 0
+    with app.app.test_request_context(), contextlib.redirect_stdout(sys.stderr):
+        for message in MESSAGES:
+            analysis = app.analyze_message(message)
+            for seed in range(args.samples):
+                emotion_result = EmotionResult("sad", intensity=0.7)
+
+                random.seed(seed)
+                set_seed(seed)
+                start = time.perf_counter()
+                whole = app.get_kozy_response(message, HISTORY, emotion_result, analysis)
+                elapsed = (time.perf_counter() - start) * 1000
+                timings["whole_reply"]["first_text_ms"].append(elapsed)
+                timings["whole_reply"]["complete_ms"].append(elapsed)
+
+                random.seed(seed)
+                set_seed(seed)
+                start = time.perf_counter()
+                streamed = []
+                for part in app.stream_kozy_response(message, HISTORY, emotion_result, analysis):
+                    if not streamed:
+                        timings["streamed"]["first_text_ms"].append((time.perf_counter() - start) * 1000)
+                    streamed.append(part)
+                timings["streamed"]["complete_ms"].append((time.perf_counter() - start) * 1000)
+                same_messages += streamed == whole
+
+    report = {mode: {name: percentiles(values) for name, values in measured.items()}
+              for mode, measured in timings.items()}
+    report["replies"] = len(MESSAGES) * args.samples
+    report["same_messages"] = same_messages
+    report["first_text_speedup_p50"] = (report["whole_reply"]["first_text_ms"]["p50"] /
+                                        report["streamed"]["first_text_ms"]["p50"])
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Sanity checks and latency for the shared topic classifier
+
+Checks a small set of messages that must or must not get a topic (word
+stemming edge cases such as "business", which is not "busy") or an FAQ
+category (faq_category_topics in content/knowledge.json), and times the
+classifier per message and batched, without the topic cache. Exits non-zero
+if any check fails.
+
+Run from the repository root:
+    python benchmarks/topic_benchmark.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import KnowledgeBase
+from topic_classifier import get_topic_classifier
+
+# (message, topic, whether the message has the topic)
+TOPIC_CASES = [
+    ("my business is doing well", "hectic", False),
+    ("we met with two businesses about the contract", "hectic", False),
+    ("it's been such a busy day", "hectic", True),
+    ("I'm so stressed about everything", "stress", True),
+    ("that was a stressful meeting", "stress", True),
+    ("I will call you later", "unwell", False),
+    ("I feel sick today", "unwell", True)
+]
+
+# (message, FAQ category, whether the message is about it)
+FAQ_CATEGORY_CASES = [
+    ("my boss keeps piling on deadlines", "work", True),
+    ("I had an argument with my colleague and the team is tense", "relationships", True),
+    ("I feel exhausted and drained lately", "mental health", True),
+    ("nothing to do today, so bored", "boredom", True),
+    ("I got the promotion and want to celebrate", "success", True),
+    ("I feel lonely since my friend moved away", "mental health", False),
+    ("the bus was late again and it rained the whole way home", "work", False)
+]
+
+LATENCY_MESSAGES = [
+    "my boss keeps piling on deadlines and I have too much work to do",
+    "I had an argument with a colleague today and now the whole team is tense",
+    "hi", "I feel lonely since my friend moved away"
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Topic classifier checks and latency")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    classifier = get_topic_classifier()
+    failed_cases = []
+    for message, topic, expected in TOPIC_CASES:
+        topics = classifier.classify([message])[0]
+        if (topic in topics) != expected:
+            failed_cases.append({"message": message, "topic": topic, "expected": expected, "topics": list(topics)})
+
+    category_topics = KnowledgeBase().content.category_topics
+    for message, category, expected in FAQ_CATEGORY_CASES:
+        topics = classifier.classify([message])[0]
+        if any(topic in topics for topic in category_topics[category]) != expected:
+            failed_cases.append({"message": message, "faq_category": category, "expected": expected,
+                                 "topics": list(topics)})
+
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        classifier.classify([LATENCY_MESSAGES[i % len(LATENCY_MESSAGES)]])
+    single_us = (time.perf_counter() - start) * 1e6 / args.iterations
+    batch = LATENCY_MESSAGES * 16
+    start = time.perf_counter()
+    for _ in range(max(1, args.iterations // len(batch))):
+        classifier.classify(batch)
+    batched_us = (time.perf_counter() - start) * 1e6 / (max(1, args.iterations // len(batch)) * len(batch))
+
+    report = {"failed_cases": failed_cases, "us_per_message_single": single_us, "us_per_message_batched": batched_us}
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed_cases else 0)
+
+if __name__ == '__main__':
+    main()
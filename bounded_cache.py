@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with hit/miss counters
+
+    With `ttl_seconds`, entries not used for that long are treated as missing
+    and dropped. get_or_create runs its factory outside the lock, so a slow
+    factory (a model prefill) doesn't block lookups of other keys; callers
+    asking for a key that is already being created wait for that result.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=None):
+        self.max_size = max(1, int(max_size))
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._last_used = {}
+        self._lock = threading.Lock()
+        # key -> Future of a factory() call still running
+        self._in_flight = {}
+        # Bumped by clear(), so values created before it are not stored after it
+        self._generation = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _expired(self, key, now):
+        return self.ttl_seconds is not None and now - self._last_used[key] > self.ttl_seconds
+
+    def _drop_expired(self, now):
+        """Remove expired entries from the least recently used end (caller holds the lock)"""
+        while self._items:
+            oldest = next(iter(self._items))
+            if not self._expired(oldest, now):
+                break
+            del self._items[oldest]
+            del self._last_used[oldest]
+            self._stats["expirations"] += 1
+
+    def _store(self, key, value, now):
+        """Insert or refresh an entry and evict down to max_size (caller holds the lock)"""
+        self._items[key] = value
+        self._items.move_to_end(key)
+        self._last_used[key] = now
+        while len(self._items) > self.max_size:
+            evicted, _ = self._items.popitem(last=False)
+            del self._last_used[evicted]
+            self._stats["evictions"] += 1
+
+    def get(self, key, default=None):
+        """Return the cached value (marking it recently used) or `default`"""
+        now = time.monotonic()
+        with self._lock:
+            self._drop_expired(now)
+            if key in self._items:
+                self._items.move_to_end(key)
+                self._last_used[key] = now
+                self._stats["hits"] += 1
+                return self._items[key]
+            self._stats["misses"] += 1
+            return default
+
+    def get_or_create(self, key, factory):
+        """Return the cached value, or store and return factory() if there is none
+
+        factory() runs without the lock held; concurrent callers for the same
+        key wait for the first caller's result (or exception) instead of
+        calling factory() again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._drop_expired(now)
+            if key in self._items:
+                self._items.move_to_end(key)
+                self._last_used[key] = now
+                self._stats["hits"] += 1
+                return self._items[key]
+            self._stats["misses"] += 1
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+                generation = self._generation
+        if not owner:
+            return future.result()
+        try:
+            value = factory()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            if generation == self._generation:
+                self._store(key, value, time.monotonic())
+        future.set_result(value)
+        return value
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry when full"""
+        now = time.monotonic()
+        with self._lock:
+            self._drop_expired(now)
+            self._store(key, value, now)
+
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self._lock:
+            self._items.clear()
+            self._last_used.clear()
+            self._generation += 1
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Return size and hit/miss counters"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["size"] = len(self._items)
+        snapshot["max_size"] = self.max_size
+        snapshot["ttl_seconds"] = self.ttl_seconds
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        return snapshot
@@ -0,0 +1,127 @@
+"""Incrementally maintained summary of one conversation
+
+A ConversationProfile remembers what KnowledgeBase used to re-derive from the
+whole chat history on every turn: the user's name, how often each topic came
+up, which feature-related topics appeared in the last few messages, and the
+emotions recorded so far. `update(chat_history)` folds in only the entries it
+has not seen yet, so each turn costs O(1) however long the conversation is.
+If the history no longer lines up with what was folded in (a new session, or
+a profile that was evicted and recreated), it is rebuilt from scratch.
+"""
+import re
+from collections import deque
+
+from topic_classifier import classify_topics
+
+NAME_PATTERN = re.compile(r"(my name is|i am|i'm|call me) (\w+)")
+
+# Topics that make a personality follow-up more specific once they recur, and the
+# topic classifier labels that count towards each
+PROFILE_TOPICS = {
+    "work": ("work", "boss", "peers"),
+    "relationships": ("relationships",),
+    "self-care": ("self_care",),
+    "emotions": ("emotions",)
+}
+
+# Classifier topics that point at an app feature category when they recur in recent messages
+FEATURE_TOPICS = ("connection", "relaxation", "self_reflection")
+
+RECENT_MESSAGES = 5
+EMOTION_TRAJECTORY_LENGTH = 10
+
+class ConversationProfile:
+    """Name, topic counters and emotion trajectory for one conversation"""
+    __slots__ = ("messages_seen", "last_entry", "user_name", "topic_counts",
+                 "recent_feature_topics", "emotion_trajectory", "emotion_counts")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.messages_seen = 0
+        self.last_entry = None
+        self.user_name = None
+        self.topic_counts = {}
+        self.recent_feature_topics = deque(maxlen=RECENT_MESSAGES)
+        self.emotion_trajectory = deque(maxlen=EMOTION_TRAJECTORY_LENGTH)
+        self.emotion_counts = {}
+
+    @staticmethod
+    def _entry_key(entry):
+        return (entry.get("timestamp"), entry.get("user"))
+
+    def update(self, chat_history):
+        """Fold in history entries added since the last update"""
+        chat_history = chat_history or []
+        if (len(chat_history) < self.messages_seen or
+                (self.messages_seen and self._entry_key(chat_history[self.messages_seen - 1]) != self.last_entry)):
+            self.reset()
+
+        new_entries = chat_history[self.messages_seen:]
+        # New messages (the whole history after a rebuild) are classified in one batch
+        topics = classify_topics([entry.get("user") or "" for entry in new_entries]) if new_entries else []
+        for entry, entry_topics in zip(new_entries, topics):
+            self.add_entry(entry, entry_topics)
+        return self
+
+    def add_entry(self, entry, topics=None):
+        """Fold in one chat history entry; `topics` are its message's classifier topics if known"""
+        self.messages_seen += 1
+        self.last_entry = self._entry_key(entry)
+
+        user_msg = (entry.get("user") or "").lower()
+        if topics is None:
+            topics = classify_topics([user_msg])[0] if user_msg else ()
+        if user_msg:
+            # The earliest name the user gave wins
+            if self.user_name is None:
+                name_matches = NAME_PATTERN.findall(user_msg)
+                if name_matches:
+                    potential_name = name_matches[0][1].capitalize()
+                    if len(potential_name) > 2:  # Avoid short words that aren't names
+                        self.user_name = potential_name
+
+            for topic, labels in PROFILE_TOPICS.items():
+                if any(label in topics for label in labels):
+                    self.topic_counts[topic] = self.topic_counts.get(topic, 0) + 1
+
+        # Entries without a user message still take up a slot in the recent window
+        self.recent_feature_topics.append([topic for topic in FEATURE_TOPICS if topic in topics])
+
+        emotion = entry.get("emotion")
+        if emotion:
+            self.emotion_trajectory.append(emotion)
+            self.emotion_counts[emotion] = self.emotion_counts.get(emotion, 0) + 1
+
+    @property
+    def conversation_depth(self):
+        return self.messages_seen
+
+    def recurring_topics(self):
+        """Topics mentioned in more than one message, in the order they first came up"""
+        return [topic for topic, count in self.topic_counts.items() if count > 1]
+
+    def recurring_feature_topics(self):
+        """Feature topics mentioned in at least two of the last few messages"""
+        counts = {}
+        for topics in self.recent_feature_topics:
+            for topic in topics:
+                counts[topic] = counts.get(topic, 0) + 1
+        return {topic for topic, count in counts.items() if count >= 2}
+
+    def dominant_emotion(self):
+        """Most frequent non-neutral emotion so far, or None"""
+        emotional = {emotion: count for emotion, count in self.emotion_counts.items() if emotion != "neutral"}
+        return max(emotional, key=emotional.get) if emotional else None
+
+    def as_dict(self):
+        return {
+            "messages_seen": self.messages_seen,
+            "user_name": self.user_name,
+            "topic_counts": dict(self.topic_counts),
+            "recurring_topics": self.recurring_topics(),
+            "recurring_feature_topics": sorted(self.recurring_feature_topics()),
+            "emotion_trajectory": list(self.emotion_trajectory),
+            "dominant_emotion": self.dominant_emotion()
+        }
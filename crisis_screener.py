@@ -0,0 +1,162 @@
+"""Crisis phrase screening that runs before any model work
+
+One precompiled screener replaces the separate crisis keyword lists that used
+to live in emotion_detector, knowledge_base and app. Messages are normalized
+(case, accents, zero-width characters, l33t digits, stretched letters) and
+matched token by token against a phrase table, with a one-edit typo allowance
+for longer words ("suicde", "myslef"). Idioms that contain a crisis phrase
+("killing myself laughing") are skipped, and shorthand that is also an
+ordinary word ("kms", kilometres) only counts on its own or after
+first-person context.
+"""
+import re
+import unicodedata
+
+CRISIS_PHRASES = [
+    "suicide", "suicidal", "kill myself", "killing myself", "end my life", "ending my life",
+    "take my own life", "take my life", "want to die", "wanna die", "wish i was dead",
+    "wish i were dead", "better off dead", "hurt myself", "hurting myself", "harm myself",
+    "harming myself", "self harm", "self harming", "cut myself", "cutting myself",
+    "end it all", "not worth living", "no reason to live", "don't want to live",
+    "dont want to live", "don't want to be alive", "unalive myself"
+]
+
+# Everyday idioms that start with a crisis phrase; a match that is the start of one is skipped
+IDIOM_EXCLUSIONS = [
+    "kill myself laughing", "killing myself laughing", "hurt myself laughing",
+    "want to die of embarrassment", "want to die laughing"
+]
+
+# Shorthand that is also an ordinary word ("10 kms today"): a crisis phrase only when it is the
+# whole message or follows one of FIRST_PERSON_CONTEXT ("im gonna kms")
+FIRST_PERSON_SHORTHAND = ["kms"]
+FIRST_PERSON_CONTEXT = {"i", "im", "i'm", "ima", "gonna", "wanna", "to", "will", "might", "just", "literally",
+                        "should", "could", "finna"}
+
+CRISIS_RESOURCES = [
+    {"title": "Crisis Support", "description": "24/7 support for those experiencing a mental health crisis", "link": "https://988lifeline.org/"},
+    {"title": "Emergency Resources", "description": "If you're in immediate danger, please call 911 or your local emergency number", "link": None},
+    {"title": "Crisis Text Line", "description": "Text HOME to 741741 to connect with a Crisis Counselor", "link": "https://www.crisistextline.org/"}
+]
+
+# Words shorter than this must match exactly ("die" should not match "dye")
+MIN_TYPO_LENGTH = 5
+
+_ZERO_WIDTH = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff"))
+_LEET = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"})
+_TOKEN_PATTERN = re.compile(r"[a-z0-9@$']+")
+_STRETCHED = re.compile(r"(.)\1{2,}")
+_DOUBLED = re.compile(r"(.)\1+")
+
+def normalize_tokens(text):
+    """Lowercase, strip accents and obfuscation, and split into word tokens"""
+    text = unicodedata.normalize("NFKD", text.translate(_ZERO_WIDTH))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower().replace("\u2019", "'")
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text):
+        # Digits inside words are l33t substitutions ("k1ll"); plain numbers are left alone
+        if not token.isdigit():
+            token = token.translate(_LEET)
+        # "diiiie" -> "diie", close enough for the typo allowance to finish the job
+        tokens.append(_STRETCHED.sub(r"\1\1", token))
+    return tokens
+
+def _deletes(word):
+    """All strings one deletion away from word"""
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+def _within_one_edit(a, b):
+    """True if a and b differ by at most one insertion, deletion, substitution or transposition"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        return len(diffs) == 2 and diffs[1] == diffs[0] + 1 and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]
+    shorter, longer = (a, b) if len(a) < len(b) else (b, a)
+    return any(longer[:i] + longer[i + 1:] == shorter for i in range(len(longer)))
+
+class CrisisScreener:
+    """Precompiled, typo-tolerant crisis phrase matcher"""
+
+    def __init__(self, phrases=CRISIS_PHRASES, idioms=IDIOM_EXCLUSIONS, shorthand=FIRST_PERSON_SHORTHAND):
+        self.vocabulary = set()
+        self.phrases = self._table(phrases)
+        self.idioms = self._table(idioms)
+        self.shorthand = set(shorthand)
+
+        # Deletion index for one-edit typo lookups (SymSpell style)
+        self.typo_index = {}
+        for word in self.vocabulary:
+            if len(word) >= MIN_TYPO_LENGTH:
+                for key in _deletes(word) | {word}:
+                    self.typo_index.setdefault(key, set()).add(word)
+
+    def _table(self, phrases):
+        """First token -> (tokens, phrase) for every spelling variant of the phrases"""
+        table = {}
+        for phrase in phrases:
+            for variant in self._variants(phrase):
+                phrase_tokens = tuple(normalize_tokens(variant))
+                self.vocabulary.update(phrase_tokens)
+                table.setdefault(phrase_tokens[0], []).append((phrase_tokens, phrase))
+        return table
+
+    @staticmethod
+    def _matches(table, tokens, position):
+        """The phrase of `table` that the tokens at position start with, or None"""
+        for phrase_tokens, phrase in table.get(tokens[position], ()):
+            if tuple(tokens[position:position + len(phrase_tokens)]) == phrase_tokens:
+                return phrase
+        return None
+
+    @staticmethod
+    def _variants(phrase):
+        """Spelling variants that are common enough to list instead of leaving to the typo allowance"""
+        variants = {phrase}
+        if "myself" in phrase:
+            variants.add(phrase.replace("myself", "my self"))
+        if "want to" in phrase:
+            variants.add(phrase.replace("want to", "wanna"))
+        return variants
+
+    def _canonical(self, token):
+        """Map a message token onto the crisis vocabulary, allowing one typo for longer words"""
+        if token in self.vocabulary:
+            return token
+        # "ennd" / "diie": doubled letters on short words the typo allowance skips
+        collapsed = _DOUBLED.sub(r"\1", token)
+        if collapsed in self.vocabulary:
+            return collapsed
+        if len(token) < MIN_TYPO_LENGTH - 1:
+            return token
+        candidates = set()
+        for key in _deletes(token) | {token}:
+            candidates.update(self.typo_index.get(key, ()))
+        for word in candidates:
+            if _within_one_edit(token, word):
+                return word
+        return token
+
+    def screen(self, text):
+        """Return the crisis phrase found in the message, or None"""
+        tokens = [self._canonical(token) for token in normalize_tokens(text)]
+        for position, token in enumerate(tokens):
+            if token in self.shorthand:
+                if len(tokens) == 1 or (position > 0 and tokens[position - 1] in FIRST_PERSON_CONTEXT):
+                    return token
+                continue
+            phrase = self._matches(self.phrases, tokens, position)
+            if phrase is not None and self._matches(self.idioms, tokens, position) is None:
+                return phrase
+        return None
+
+# Built once at import; screening a message is one pass over its tokens
+crisis_screener = CrisisScreener()
+
+def screen_crisis(text):
+    """Return the matched crisis phrase for a message, or None if it looks safe"""
+    return crisis_screener.screen(text)
@@ -0,0 +1,130 @@
+"""Inference backends for the emotion classifier
+
+Every backend exposes `classify(texts)`, which returns, for each text, the
+full list of {"label", "score"} dicts (the same shape as a transformers
+text-classification pipeline called with top_k=None). Pick one with the
+KOZY_EMOTION_BACKEND environment variable:
+
+    pipeline  fp32 transformers pipeline (default)
+    onnx      ONNX Runtime session over an exported copy of the model
+    int8      torch model with dynamically quantized int8 Linear layers
+"""
+import os
+
+EMOTION_MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+DEFAULT_ONNX_PATH = os.path.join(MODELS_DIR, "emotion-distilroberta.onnx")
+MAX_LENGTH = 512
+
+def _label_scores(probabilities, id2label):
+    """Turn one row of class probabilities into pipeline-style label dicts"""
+    return sorted(({"label": id2label[i], "score": float(p)} for i, p in enumerate(probabilities)),
+                  key=lambda item: item["score"], reverse=True)
+
+class PipelineBackend:
+    """The fp32 Hugging Face pipeline we have always used"""
+    name = "pipeline"
+
+    def __init__(self, model_name=EMOTION_MODEL_NAME):
+        from transformers import pipeline
+        self.classifier = pipeline("text-classification", model=model_name)
+
+    def classify(self, texts):
+        return self.classifier(texts, batch_size=len(texts), truncation=True, top_k=None)
+
+class TorchInt8Backend:
+    """Dynamically quantized int8 torch model (Linear layers only)"""
+    name = "int8"
+
+    def __init__(self, model_name=EMOTION_MODEL_NAME):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        self.id2label = model.config.id2label
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def classify(self, texts):
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=MAX_LENGTH, return_tensors="pt")
+        with self.torch.inference_mode():
+            probabilities = self.model(**inputs).logits.softmax(dim=-1).numpy()
+        return [_label_scores(row, self.id2label) for row in probabilities]
+
+class OnnxBackend:
+    """ONNX Runtime session over an exported copy of the model
+
+    The model is exported to `onnx_path` on first use if the file does not exist.
+    """
+    name = "onnx"
+
+    def __init__(self, model_name=EMOTION_MODEL_NAME, onnx_path=None):
+        import onnxruntime
+        from transformers import AutoConfig, AutoTokenizer
+
+        onnx_path = onnx_path or os.environ.get("KOZY_EMOTION_ONNX_PATH", DEFAULT_ONNX_PATH)
+        if not os.path.exists(onnx_path):
+            export_onnx(model_name, onnx_path)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.id2label = AutoConfig.from_pretrained(model_name).id2label
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def classify(self, texts):
+        import numpy as np
+
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=MAX_LENGTH, return_tensors="np")
+        feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+        logits = self.session.run(None, feed)[0]
+        shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        probabilities = shifted / shifted.sum(axis=-1, keepdims=True)
+        return [_label_scores(row, self.id2label) for row in probabilities]
+
+def export_onnx(model_name=EMOTION_MODEL_NAME, onnx_path=DEFAULT_ONNX_PATH):
+    """Export the classifier to ONNX with dynamic batch and sequence axes"""
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+    sample = tokenizer(["export sample"], return_tensors="pt")
+
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"]),
+        onnx_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"}
+        },
+        opset_version=14
+    )
+    print(f"Exported emotion model to {onnx_path}")
+    return onnx_path
+
+BACKENDS = {
+    PipelineBackend.name: PipelineBackend,
+    OnnxBackend.name: OnnxBackend,
+    TorchInt8Backend.name: TorchInt8Backend
+}
+
+def load_backend(name=None):
+    """Build the configured backend (KOZY_EMOTION_BACKEND, default "pipeline")"""
+    name = name or os.environ.get("KOZY_EMOTION_BACKEND", PipelineBackend.name)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown emotion backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name]()
+
+if __name__ == '__main__':
+    # Offline step: python emotion_backends.py [onnx_path]
+    import sys
+    export_onnx(onnx_path=sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ONNX_PATH)
@@ -1,14 +1,76 @@
+import hashlib
+import os
 import re
-from transformers import pipeline
+import threading
 import random
 
-# Try to load the emotion classifier model
-try:
-    emotion_classifier = pipeline("text-classification", model="j-hartmann/emotion-english-distilroberta-base")
-    print("Emotion detection model loaded successfully")
-except Exception as e:
-    print(f"Error loading emotion detection model: {e}")
-    emotion_classifier = None
+from bounded_cache import LRUCache
+from crisis_screener import CRISIS_RESOURCES, screen_crisis
+from emotion_backends import load_backend
+from emotion_result import EmotionResult
+from inference_batcher import MicroBatcher
+from model_registry import model_registry
+
+# The emotion classifier (backend chosen by KOZY_EMOTION_BACKEND) loads on first
+# use or in the background at app startup, never at import
+emotion_model = model_registry.register("emotion", load_backend,
+                                        warmup=lambda backend: backend.classify(["Warming up the emotion model"]))
+
+def get_emotion_backend():
+    """Return the loaded emotion backend, or None if it could not be loaded"""
+    return emotion_model.get()
+
+# Micro-batching settings for the emotion classifier (requests from concurrent
+# users are grouped into one padded forward pass)
+EMOTION_BATCH_SIZE = int(os.environ.get("KOZY_EMOTION_BATCH_SIZE", "8"))
+EMOTION_BATCH_WAIT_MS = float(os.environ.get("KOZY_EMOTION_BATCH_WAIT_MS", "5"))
+EMOTION_BATCH_TIMEOUT = float(os.environ.get("KOZY_EMOTION_BATCH_TIMEOUT", "10"))
+
+def _classify_batch(texts):
+    """Run the emotion classifier once over a batch of messages, keeping every label's score"""
+    return get_emotion_backend().classify(texts)
+
+emotion_batcher = MicroBatcher(_classify_batch, EMOTION_BATCH_SIZE, EMOTION_BATCH_WAIT_MS,
+                               name="emotion-batcher")
+
+def get_emotion_batcher_stats():
+    """Return queue depth and batch-size metrics for the emotion classifier"""
+    return emotion_batcher.stats()
+
+# Map model output to our emotion categories
+MODEL_TO_OUR_CATEGORIES = {
+    "joy": "happy",
+    "sadness": "sad",
+    "anger": "angry",
+    "surprise": "excited",  # Approximation
+    "fear": "fear",
+    "disgust": "angry",     # Approximation
+    "neutral": None         # No strong emotion detected
+}
+
+# "transformer" always asks the transformer first; "cascade" lets the cheap linear
+# tier answer and only escalates to the transformer when it is unsure
+EMOTION_MODE = os.environ.get("KOZY_EMOTION_MODE", "transformer")
+CASCADE_MARGIN = float(os.environ.get("KOZY_CASCADE_MARGIN", "0.35"))
+
+def _load_linear_emotion_model():
+    from linear_emotion import LinearEmotionModel, DEFAULT_MODEL_PATH
+    return LinearEmotionModel.load(os.environ.get("KOZY_LINEAR_EMOTION_MODEL", DEFAULT_MODEL_PATH))
+
+linear_model = model_registry.register("linear_emotion", _load_linear_emotion_model,
+                                       warmup=lambda model: model.predict("Warming up")) if EMOTION_MODE == "cascade" else None
+
+def get_linear_emotion_model():
+    """Return the linear tier in cascade mode once it has loaded, otherwise None (transformer only)"""
+    return linear_model.get() if linear_model else None
+
+_cascade_lock = threading.Lock()
+_cascade_stats = {"linear": 0, "escalated": 0}
+
+def get_cascade_stats():
+    """Return how many messages each cascade tier answered"""
+    with _cascade_lock:
+        return dict(_cascade_stats) if linear_model else None
 
 # Emotion keywords dictionary
 EMOTION_KEYWORDS = {
@@ -43,33 +105,120 @@ CONTEXTUAL_MODIFIERS = {
                     "not very", "not too", "hardly", "barely", "scarcely", "only"]
 }
 
-def detect_emotion_keywords(text):
-    """Detect emotions based on keyword matches"""
-    text_lower = text.lower()
+# Token pattern shared by the keyword matcher (keeps contractions like "can't" whole
+# and emits clause punctuation as its own token so negation scope can stop there)
+_TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*|[.!?;,]")
+CLAUSE_BREAKS = {".", "!", "?", ";", ","}
+
+# How many words after a negator ("not", "never", ...) it can still negate
+NEGATION_WINDOW = 3
+
+def _build_keyword_matcher():
+    """Index every emotion keyword and contextual modifier by its first token"""
+    matcher = {}
+    vocabulary = set()
+    
+    def add_phrase(phrase, kind, label):
+        phrase_tokens = tuple(_TOKEN_PATTERN.findall(phrase.lower()))
+        vocabulary.update(phrase_tokens)
+        matcher.setdefault(phrase_tokens[0], []).append((phrase_tokens, kind, label, phrase))
     
-    # Count keyword matches for each emotion
-    emotion_scores = {}
     for emotion, keywords in EMOTION_KEYWORDS.items():
-        count = 0
         for keyword in keywords:
-            # Check for exact word matches (with word boundaries)
-            matches = re.findall(r'\b' + re.escape(keyword) + r'\b', text_lower)
-            count += len(matches)
-        
-        # Only include emotions with matches
+            add_phrase(keyword, "emotion", emotion)
+    
+    for kind, phrases in CONTEXTUAL_MODIFIERS.items():
+        for phrase in phrases:
+            add_phrase(phrase, kind, kind)
+    
+    return matcher, vocabulary
+
+# Built once at import so each message only costs one pass over its tokens
+KEYWORD_MATCHER, KEYWORD_VOCABULARY = _build_keyword_matcher()
+
+def tokenize(text):
+    """Lowercase and split a message into word tokens"""
+    tokens = _TOKEN_PATTERN.findall(text.lower().replace("\u2019", "'"))
+    # "love's" should still hit "love", but "can't" must stay whole
+    return [token if "'" not in token or token in KEYWORD_VOCABULARY else token.split("'", 1)[0]
+            for token in tokens]
+
+def match_keywords(text):
+    """Scan a message once and collect emotion keyword and modifier hits
+    
+    Returns a dict with the message tokens, the (start, end, keyword) token
+    spans per emotion, and the (start, end, phrase) spans for each contextual
+    modifier.
+    """
+    tokens = tokenize(text)
+    matches = {
+        "tokens": tokens,
+        "emotions": {emotion: [] for emotion in EMOTION_KEYWORDS},
+        "negation": [],
+        "intensifiers": [],
+        "diminishers": []
+    }
+    
+    for position, token in enumerate(tokens):
+        for phrase_tokens, kind, label, phrase in KEYWORD_MATCHER.get(token, ()):
+            end = position + len(phrase_tokens)
+            if len(phrase_tokens) > 1 and tuple(tokens[position:end]) != phrase_tokens:
+                continue
+            if kind == "emotion":
+                matches["emotions"][label].append((position, end, phrase))
+            else:
+                matches[kind].append((position, end, phrase))
+    
+    # Only keep emotions that were actually mentioned
+    matches["emotions"] = {emotion: hits for emotion, hits in matches["emotions"].items() if hits}
+    return matches
+
+def negated_positions(tokens, negation_hits, window=NEGATION_WINDOW):
+    """Mark which token positions fall inside a negation's scope
+    
+    A negator covers the next `window` words and stops at clause punctuation,
+    so this is a single pass over the tokens no matter how many negators appear.
+    """
+    scope_starts = {end for _, end, _ in negation_hits}
+    negated = [False] * len(tokens)
+    remaining = 0
+    
+    for position, token in enumerate(tokens):
+        if position in scope_starts:
+            remaining = window
+        if token in CLAUSE_BREAKS:
+            remaining = 0
+        elif remaining:
+            negated[position] = True
+            remaining -= 1
+    
+    return negated
+
+def score_keyword_matches(matches, negation_window=NEGATION_WINDOW):
+    """Count the non-negated keyword hits for each emotion in match_keywords() output"""
+    negated = negated_positions(matches["tokens"], matches["negation"], negation_window)
+    
+    # Count keyword matches for each emotion, skipping negated ones ("not happy")
+    emotion_scores = {}
+    for emotion, hits in matches["emotions"].items():
+        count = sum(1 for start, _, _ in hits if not negated[start])
         if count > 0:
             emotion_scores[emotion] = count
+    return emotion_scores
+
+def modifier_intensity(matches):
+    """Estimate how strongly a feeling is expressed (0-1) from intensifiers, diminishers and '!'"""
+    # "not very" is a diminisher, so its "very" should not also count as an intensifier
+    diminished = {position for start, end, _ in matches["diminishers"] for position in range(start, end)}
+    intensifiers = sum(1 for start, _, _ in matches["intensifiers"] if start not in diminished)
+    exclamations = min(3, matches["tokens"].count("!"))
     
-    # Check for negations that might flip emotion detection
-    for negation in CONTEXTUAL_MODIFIERS["negation"]:
-        if re.search(r'\b' + re.escape(negation) + r'\b', text_lower):
-            # If negation found near emotion words, adjust scoring
-            for emotion in list(emotion_scores.keys()):
-                for keyword in EMOTION_KEYWORDS[emotion]:
-                    if re.search(r'\b' + re.escape(negation) + r'.*?\b' + re.escape(keyword) + r'\b', text_lower) or \
-                       re.search(r'\b' + re.escape(keyword) + r'.*?\b' + re.escape(negation) + r'\b', text_lower):
-                        # Reduce score for negated emotions
-                        emotion_scores[emotion] = max(0, emotion_scores[emotion] - 1)
+    intensity = 0.5 + 0.2 * intensifiers - 0.2 * len(matches["diminishers"]) + 0.1 * exclamations
+    return max(0.0, min(1.0, intensity))
+
+def detect_emotion_keywords(text, negation_window=NEGATION_WINDOW):
+    """Detect emotions based on keyword matches"""
+    emotion_scores = score_keyword_matches(match_keywords(text), negation_window)
     
     # If no clear emotion found, return None
     if not emotion_scores:
@@ -79,64 +228,142 @@ def detect_emotion_keywords(text):
     return max(emotion_scores.items(), key=lambda x: x[1])[0]
 
 def detect_emotion_model(text):
-    """Detect emotion using pretrained model"""
-    if not emotion_classifier:
+    """Detect emotion using pretrained model
+    
+    Returns an EmotionResult with the model's whole label distribution mapped
+    onto our categories, or None if the model is unavailable.
+    """
+    if get_emotion_backend() is None:
         return None
         
     try:
-        # The model returns a list of dict with label and score
-        result = emotion_classifier(text)
-        
-        # Map model output to our emotion categories
-        model_to_our_categories = {
-            "joy": "happy",
-            "sadness": "sad",
-            "anger": "angry",
-            "surprise": "excited",  # Approximation
-            "fear": "fear",
-            "disgust": "angry",     # Approximation
-            "neutral": None         # No strong emotion detected
-        }
+        # Queued behind other users' messages; the model returns every label with its score
+        predictions = emotion_batcher(text, timeout=EMOTION_BATCH_TIMEOUT)
         
-        if result and len(result) > 0:
-            predicted_label = result[0]['label']
-            return model_to_our_categories.get(predicted_label, None)
+        if predictions:
+            scores = {}
+            for prediction in predictions:
+                category = MODEL_TO_OUR_CATEGORIES.get(prediction['label']) or "neutral"
+                scores[category] = scores.get(category, 0.0) + prediction['score']
+            
+            predicted_label = max(predictions, key=lambda p: p['score'])['label']
+            emotion = MODEL_TO_OUR_CATEGORIES.get(predicted_label) or "neutral"
+            return EmotionResult(emotion, scores.items(), tier="transformer")
             
     except Exception as e:
         print(f"Error in emotion model detection: {e}")
         
     return None
 
-def detect_emotion(text, chat_history=None):
-    """Combined emotion detection using both keywords and model"""
-    # Try the model-based detection first (more accurate)
-    model_emotion = detect_emotion_model(text)
+def detect_emotion_cascade(text, linear_emotion_model):
+    """Answer with the linear tier when it is confident, otherwise ask the transformer"""
+    label, margin, probabilities = linear_emotion_model.predict(text)
+    confident = margin >= CASCADE_MARGIN
+    
+    with _cascade_lock:
+        _cascade_stats["linear" if confident else "escalated"] += 1
+    
+    if confident:
+        scores = zip(linear_emotion_model.labels, probabilities.tolist())
+        return EmotionResult(label, scores, tier="linear")
+    return detect_emotion_model(text)
+
+# Per-message classification results, keyed on a hash of the normalized text
+EMOTION_CACHE_SIZE = int(os.environ.get("KOZY_EMOTION_CACHE_SIZE", "4096"))
+emotion_cache = LRUCache(EMOTION_CACHE_SIZE)
+
+def get_emotion_cache_stats():
+    """Return hit/miss counters for the emotion result cache"""
+    return emotion_cache.stats()
+
+def normalize_message(text):
+    """Lowercase and collapse whitespace so trivially different messages share a cache entry"""
+    return " ".join(text.lower().split())
+
+def classify_message(text):
+    """Classify one message with the model and keywords, reusing cached results
     
-    # Fall back to keyword detection if model fails or returns None
-    keyword_emotion = detect_emotion_keywords(text)
+    Returns an EmotionResult whose emotion is "neutral" when neither the model
+    nor the keywords found one. Only results the model (or the linear tier)
+    answered for are cached.
+    """
+    normalized = normalize_message(text)
+    key = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+    
+    result = emotion_cache.get(key)
+    if result is not None:
+        return result
+    
+    # Try the model-based detection first (more accurate), via the cheap tier in cascade mode.
+    # The models get the message as written: the transformer is case-sensitive
+    linear_emotion_model = get_linear_emotion_model()
+    if linear_emotion_model:
+        model_result = detect_emotion_cascade(text, linear_emotion_model)
+    else:
+        model_result = detect_emotion_model(text)
+    
+    # Keyword detection is the fallback label, and its modifier hits give the intensity
+    matches = match_keywords(normalized)
+    keyword_scores = score_keyword_matches(matches)
+    intensity = modifier_intensity(matches)
     
     # Combine results, prioritizing model detection
-    detected_emotion = model_emotion if model_emotion else keyword_emotion
+    if model_result and model_result.emotion != "neutral":
+        result = model_result.replace(intensity=intensity)
+    elif keyword_scores:
+        total = sum(keyword_scores.values())
+        keyword_emotion = max(keyword_scores.items(), key=lambda x: x[1])[0]
+        result = EmotionResult(keyword_emotion, [(emotion, count / total) for emotion, count in keyword_scores.items()],
+                               intensity, tier="keywords")
+    elif model_result:
+        result = model_result.replace(intensity=intensity)
+    else:
+        result = EmotionResult("neutral", intensity=intensity)
+    
+    # Without a model answer (not loaded yet, failed or timed out) the label is keywords only;
+    # it is not cached, so the next time the message is seen the model gets another try
+    if model_result is not None:
+        emotion_cache.put(key, result)
+    return result
+
+def analyze_emotion(text, chat_history=None):
+    """Combined emotion detection using both keywords and model
+    
+    This is the one emotion call per turn; its EmotionResult is passed on to
+    everything else that needs the user's emotion.
+    """
+    result = classify_message(text)
     
     # If still no clear emotion, check context from previous messages
-    if not detected_emotion and chat_history:
-        # Look for emotion patterns in the last few messages
+    if result.emotion == "neutral" and chat_history:
+        # Look for emotion patterns in the last few messages, using the emotion stored
+        # with each entry when it has one instead of classifying the text again. A label
+        # the history tier carried over is not the message's own: the message was neutral,
+        # and reusing the label would keep one emotional message alive indefinitely
         recent_emotions = []
         for entry in chat_history[-3:]:  # Check last 3 messages
             if 'user' in entry and entry['user']:
-                msg_emotion = detect_emotion_keywords(entry['user'])
+                if 'emotion' in entry:
+                    own = entry['emotion'] if entry.get('emotion_tier') != "history" else None
+                    msg_emotion = own if own != "neutral" else None
+                else:
+                    msg_emotion = detect_emotion_keywords(entry['user'])
                 if msg_emotion:
                     recent_emotions.append(msg_emotion)
         
         # If consistent emotion found in history, use it as a hint
         if recent_emotions and all(emotion == recent_emotions[0] for emotion in recent_emotions):
-            detected_emotion = recent_emotions[0]
+            result = result.replace(emotion=recent_emotions[0], tier="history")
     
-    # If still no emotion detected, default to neutral
-    return detected_emotion or "neutral"
+    # If still no emotion detected, the result is neutral
+    return result
+
+def detect_emotion(text, chat_history=None):
+    """Return just the emotion label for a message"""
+    return analyze_emotion(text, chat_history).emotion
 
 def get_emotion_response_style(emotion, intensity=None):
-    """Return response style guidelines based on detected emotion"""
+    """Return response style guidelines based on detected emotion and its intensity (0-1)"""
     
     # Define response styles for each emotion
     response_styles = {
@@ -184,7 +411,17 @@ def get_emotion_response_style(emotion, intensity=None):
         }
     }
     
-    return response_styles.get(emotion, response_styles["neutral"])
+    style = response_styles.get(emotion, response_styles["neutral"])
+    
+    # Adjust the guidance when the feeling is expressed especially strongly or lightly
+    if intensity is not None and emotion in response_styles and emotion != "neutral":
+        style = dict(style)
+        if intensity >= EmotionResult.STRONG:
+            style["approach"] += ", taking extra care because they are feeling this strongly"
+        elif intensity < EmotionResult.MILD:
+            style["tone"] = "light, " + style["tone"]
+    
+    return style
 
 def get_relevant_resources(emotion, message_text):
     """Return relevant resources based on emotion and message content"""
@@ -204,13 +441,8 @@ def get_relevant_resources(emotion, message_text):
     }
     
     # Check if there's a crisis situation that needs specialized resources
-    crisis_keywords = ["suicide", "kill myself", "end my life", "want to die", "hurt myself"]
-    if any(keyword in message_text.lower() for keyword in crisis_keywords):
-        return [
-            {"title": "Crisis Support", "description": "24/7 support for those experiencing a mental health crisis", "link": "https://988lifeline.org/"},
-            {"title": "Emergency Resources", "description": "If you're in immediate danger, please call 911 or your local emergency number", "link": None},
-            {"title": "Crisis Text Line", "description": "Text HOME to 741741 to connect with a Crisis Counselor", "link": "https://www.crisistextline.org/"}
-        ]
+    if screen_crisis(message_text):
+        return list(CRISIS_RESOURCES)
     
     # Return resources based on emotion if available
     return resources.get(emotion, []) if emotion in resources else []
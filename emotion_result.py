@@ -0,0 +1,57 @@
+class EmotionResult:
+    """Emotion classification for one message, computed once per turn
+
+    `emotion` is our category label ("sad", "neutral", ...), `scores` the full
+    label distribution as (label, score) pairs sorted best first, `intensity`
+    a 0-1 strength estimate from intensifiers/diminishers, and `tier` names
+    what produced the label ("transformer", "linear", "keywords", "history"
+    or "default").
+    """
+    __slots__ = ("emotion", "scores", "intensity", "tier")
+
+    MILD = 0.35
+    STRONG = 0.7
+
+    def __init__(self, emotion, scores=(), intensity=0.5, tier="default"):
+        self.emotion = emotion
+        self.scores = tuple(sorted(scores, key=lambda pair: pair[1], reverse=True))
+        self.intensity = intensity
+        self.tier = tier
+
+    @property
+    def level(self):
+        """Bucket the intensity into mild / moderate / strong"""
+        if self.intensity >= self.STRONG:
+            return "strong"
+        if self.intensity < self.MILD:
+            return "mild"
+        return "moderate"
+
+    def top(self, k=3):
+        """Return the k most likely (label, score) pairs"""
+        return self.scores[:k]
+
+    def replace(self, **changes):
+        """Return a copy with some fields changed"""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return EmotionResult(**fields)
+
+    def as_dict(self):
+        """JSON-friendly form for responses and logs"""
+        return {
+            "emotion": self.emotion,
+            "scores": [list(pair) for pair in self.scores],
+            "intensity": self.intensity,
+            "level": self.level,
+            "tier": self.tier
+        }
+
+    def __repr__(self):
+        return f"EmotionResult({self.emotion!r}, intensity={self.intensity:.2f}, tier={self.tier!r})"
+
+def emotion_label(emotion):
+    """Accept either an EmotionResult or a plain label and return the label"""
+    if isinstance(emotion, EmotionResult):
+        return emotion.emotion
+    return emotion
@@ -0,0 +1,159 @@
+"""Inverted index behind KnowledgeBase FAQ retrieval
+
+The index is built once, when the knowledge bundle is compiled (see
+knowledge_bundle.py), and shipped inside it. Looking up a message only touches
+the index entries for the message's own words, so the cost does not grow with
+the number of FAQs.
+
+Matching keeps the old substring behaviour for word endings: an FAQ word also
+matches longer words that start with it ("stress" matches "stressed",
+"overwhelm" matches "overwhelming").
+"""
+import math
+import re
+
+_WORD_PATTERN = re.compile(r"\b\w+\b")
+
+# Only words longer than three characters count towards FAQ relevance
+MIN_WORD_LENGTH = 4
+
+def tokenize(text):
+    """Lowercase word tokens"""
+    return _WORD_PATTERN.findall(text.lower())
+
+def _prefixes(token, min_length):
+    """token[:n] for every n from min_length up to the whole token"""
+    return (token[:n] for n in range(min_length, len(token) + 1))
+
+class FaqIndex:
+    """Token -> FAQ posting lists with document frequencies for IDF weighting
+
+    Each matched question word is worth 2 * (1 + ln(N / df)) points, so a single
+    match still scores at least 2 (the old relevance threshold) while rarer,
+    more specific words rank higher. Emotion boost words add a point each, as
+    before.
+
+    FAQs can be added at any time; the posting lists are compiled into NumPy
+    arrays on the next search so scoring a large library is a handful of
+    vectorised adds rather than a Python loop per posting.
+    """
+
+    def __init__(self, faqs=None, boost_words=None):
+        self.boost_words = {emotion: set(words) for emotion, words in (boost_words or {}).items()}
+        self.entries = []        # (category, faq, key)
+        self.postings = {}       # question word -> [entry id]
+        self.categories = {}     # category -> category id
+        self.category_sizes = {} # category -> number of FAQs
+        self.key_entries = {}    # key -> [entry id]
+        self.boosts = {}         # emotion -> {entry id: boost}
+        self._compiled = None
+        for category, category_faqs in (faqs or {}).items():
+            for faq in category_faqs:
+                self.add(category, faq)
+
+    @staticmethod
+    def faq_key(faq):
+        """Key used to remember which FAQs were already suggested"""
+        return faq["q"][:30]
+
+    def add(self, category, faq):
+        """Index one FAQ under a category"""
+        entry_id = len(self.entries)
+        key = self.faq_key(faq)
+        self.entries.append((category, faq, key))
+        self.categories.setdefault(category, len(self.categories))
+        self.category_sizes[category] = self.category_sizes.get(category, 0) + 1
+        self.key_entries.setdefault(key, []).append(entry_id)
+
+        words = tokenize(faq["q"])
+        for word in set(words):
+            if len(word) >= MIN_WORD_LENGTH:
+                self.postings.setdefault(word, []).append(entry_id)
+
+        for emotion, boost_words in self.boost_words.items():
+            boost = sum(word in boost_words for word in words)
+            if boost:
+                self.boosts.setdefault(emotion, {})[entry_id] = boost
+        self._compiled = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _compile(self):
+        """Freeze the posting lists, categories and boosts into arrays"""
+        import numpy as np
+
+        size = len(self.entries)
+        postings = {word: np.array(ids, dtype=np.int32) for word, ids in self.postings.items()}
+        weights = {word: 2.0 * (1.0 + math.log(size / len(ids))) for word, ids in self.postings.items()}
+        category_ids = np.array([self.categories[category] for category, _, _ in self.entries], dtype=np.int32)
+        boosts = {}
+        for emotion, entry_boosts in self.boosts.items():
+            boost = np.zeros(size)
+            boost[list(entry_boosts)] = list(entry_boosts.values())
+            boosts[emotion] = (boost, np.flatnonzero(boost >= 2))
+        self._compiled = (postings, weights, category_ids, boosts)
+        return self._compiled
+
+    def compile(self):
+        """Build the search arrays now rather than on the first search"""
+        return self._compiled or self._compile()
+
+    def has_unseen(self, categories, seen_keys):
+        """True if any FAQ in the categories has a key outside seen_keys"""
+        seen = {entry_id for key in seen_keys for entry_id in self.key_entries.get(key, ())}
+        counts = {}
+        for entry_id in seen:
+            category = self.entries[entry_id][0]
+            counts[category] = counts.get(category, 0) + 1
+        return any(self.category_sizes.get(category, 0) > counts.get(category, 0) for category in set(categories))
+
+    def search(self, tokens, categories, emotion=None, exclude_keys=(), k=1):
+        """Top-k (score, faq) pairs from the given categories, best first"""
+        import numpy as np
+
+        category_ids = [self.categories[category] for category in categories if category in self.categories]
+        if not category_ids or not self.entries:
+            return []
+        postings, weights, entry_categories, boosts = self.compile()
+
+        # Question words this message contains (a message word may extend a question word)
+        matched_words = set()
+        for token in set(tokens):
+            for prefix in _prefixes(token, MIN_WORD_LENGTH):
+                if prefix in postings:
+                    matched_words.add(prefix)
+
+        # Sum the weights of every posting touched; FAQs sharing no word with the message are never visited
+        if matched_words:
+            matched_words = list(matched_words)
+            lists = [postings[word] for word in matched_words]
+            entry_ids, positions = np.unique(np.concatenate(lists), return_inverse=True)
+            scores = np.bincount(positions, weights=np.repeat([weights[word] for word in matched_words],
+                                                              [len(ids) for ids in lists]))
+        else:
+            entry_ids, scores = np.zeros(0, dtype=np.int32), np.zeros(0)
+
+        # Boost words add to matched FAQs, and can qualify an FAQ on their own at 2+ points
+        if emotion in boosts:
+            boost, boost_only = boosts[emotion]
+            scores = scores + boost[entry_ids]
+            extra = np.setdiff1d(boost_only, entry_ids, assume_unique=True)
+            entry_ids = np.concatenate((entry_ids, extra))
+            scores = np.concatenate((scores, boost[extra]))
+
+        allowed = np.zeros(len(self.categories), dtype=bool)
+        allowed[category_ids] = True
+        keep = allowed[entry_categories[entry_ids]]
+        if exclude_keys:
+            excluded = [entry_id for key in exclude_keys for entry_id in self.key_entries.get(key, ())]
+            keep &= ~np.isin(entry_ids, excluded)
+        entry_ids, scores = entry_ids[keep], scores[keep]
+
+        if len(entry_ids) > k:
+            kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+            top = scores >= kth
+            entry_ids, scores = entry_ids[top], scores[top]
+        # Ties go to the earlier FAQ, as the old stable sort did
+        order = np.lexsort((entry_ids, -scores))[:k]
+        return [(float(scores[i]), self.entries[entry_ids[i]][1]) for i in order]
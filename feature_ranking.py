@@ -0,0 +1,114 @@
+"""Precomputed ranking tables for app feature suggestions
+
+The feature catalog is compiled once, with the rest of the knowledge bundle,
+into a FeatureTable:
+
+  - every feature gets an id (its bit in a session's seen-bitset), a weight and
+    a cooldown in turns
+  - feature categories that can be "active" topics each get a bit; a message
+    topic and a recurring conversation topic are separate bits
+  - for every (emotion, active topic mask) the table holds the category order
+    to suggest from: topics in the current message first, then topics that
+    recur in the conversation, then the emotion's default categories
+
+Inside a category, features are ordered by weight (catalog order breaks ties).
+A suggestion looks up the category order and takes the first feature that is
+not in the seen-bitset and not cooling down. Sessions see at most `max_seen`
+features before the bitset is cleared, so the lookup stops after a bounded
+number of steps no matter how large the catalog is.
+"""
+import hashlib
+import itertools
+
+DEFAULT_CATEGORIES = ["self_reflection", "connection"]
+DEFAULT_SETTINGS = {
+    # Suggest a feature on every n-th message
+    "every_n_messages": 5,
+    # Once this many features were suggested in a session, start over (and skip a turn)
+    "max_seen": 8
+}
+EMERGENCY_CATEGORY = "emergency"
+
+# Up to this many (emotion, mask) rankings are computed when the table is built; with more
+# topics than that allows, each lookup ranks the categories itself
+MAX_PRECOMPUTED_RANKINGS = 65536
+
+class FeatureTable:
+    """The feature catalog compiled into (emotion, topic mask) -> category order
+
+    Read-only once built, so request threads share it without locking.
+    """
+
+    def __init__(self, app_features, categories_by_emotion, settings=None):
+        settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.every_n_messages = int(settings["every_n_messages"])
+        self.max_seen = int(settings["max_seen"])
+        self.app_features = app_features
+
+        self.features = []        # feature id -> feature dict
+        self.weights = []         # feature id -> weight
+        self.cooldowns = []       # feature id -> turns before it may be suggested again
+        self.category_features = {}  # category -> feature ids, heaviest first
+        for category, features in app_features.items():
+            ids = []
+            for feature in features:
+                ids.append(len(self.features))
+                self.features.append(feature)
+                self.weights.append(float(feature.get("weight", 1.0)))
+                self.cooldowns.append(int(feature.get("cooldown", 0)))
+            self.category_features[category] = sorted(ids, key=lambda fid: -self.weights[fid])
+
+        # Same catalog (same categories, names, order) -> same ids, so seen-bitsets survive a content reload
+        keys = "\n".join(f"{category}_{feature['name']}" for category, features in app_features.items() for feature in features)
+        self.catalog_id = hashlib.sha1(keys.encode("utf-8")).hexdigest()[:12]
+
+        self.topics = [category for category in app_features if category != EMERGENCY_CATEGORY]
+        self.topic_bits = {topic: 1 << i for i, topic in enumerate(self.topics)}
+        self.categories_by_emotion = {emotion: list(categories) for emotion, categories in categories_by_emotion.items()}
+
+        self.rankings = {}
+        masks = 1 << (2 * len(self.topics))
+        emotions = list(self.categories_by_emotion) + [None]
+        if masks * len(emotions) <= MAX_PRECOMPUTED_RANKINGS:
+            for emotion, mask in itertools.product(emotions, range(masks)):
+                self.rankings[(emotion, mask)] = self._rank(emotion, mask)
+
+    def __len__(self):
+        return len(self.features)
+
+    def topic_mask(self, message_topics=(), recurring_topics=()):
+        """Active topic mask: message topics in the low bits, recurring topics above them"""
+        mask = 0
+        for topic in message_topics:
+            mask |= self.topic_bits.get(topic, 0)
+        for topic in recurring_topics:
+            mask |= self.topic_bits.get(topic, 0) << len(self.topics)
+        return mask
+
+    def _rank(self, emotion, mask):
+        """Category order for an emotion and topic mask, most relevant first, no repeats"""
+        message_mask = mask & ((1 << len(self.topics)) - 1)
+        recurring_mask = mask >> len(self.topics)
+        # Later topics take priority, as when each one used to be inserted at the front in turn
+        order = [topic for topic in reversed(self.topics) if message_mask & self.topic_bits[topic]]
+        order += [topic for topic in reversed(self.topics) if recurring_mask & self.topic_bits[topic]]
+        order += self.categories_by_emotion.get(emotion, DEFAULT_CATEGORIES)
+        return tuple(dict.fromkeys(order))
+
+    def ranking(self, emotion, mask):
+        key = (emotion if emotion in self.categories_by_emotion else None, mask)
+        ranking = self.rankings.get(key)
+        return ranking if ranking is not None else self._rank(*key)
+
+    def emergency_feature(self):
+        features = self.app_features.get(EMERGENCY_CATEGORY, [])
+        return features[0] if features else None
+
+    def suggest(self, emotion, mask, seen, turn, available_at):
+        """(feature id, ranking) of the best feature not in `seen` and not cooling down, or (None, ranking)"""
+        ranking = self.ranking(emotion, mask)
+        for category in ranking:
+            for fid in self.category_features.get(category, ()):
+                if not seen >> fid & 1 and available_at.get(fid, 0) <= turn:
+                    return fid, ranking
+        return None, ranking
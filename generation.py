@@ -0,0 +1,384 @@
+"""Text generation that reuses KV caches of prompts already seen
+
+Every get_kozy_response prompt starts with the same few hundred tokens of
+instructions, and the only part of that header that changes are the emotion
+and response-style lines, which come in a handful of variants. Running GPT-2
+over those tokens (the prefill) dominates the time to the first generated
+token on CPU.
+
+PrefixCachedGenerator wraps the text-generation pipeline. It runs the model
+over each distinct prefix once, keeps the resulting past_key_values in an LRU
+cache (one entry per style variant), and for every request prefills only the
+tokens after the prefix.
+
+Within a conversation it goes further: a GenerationSession (one per
+firebase_session_key, LRU and idle-TTL evicted) keeps the token ids and KV
+cache of the conversation's last prompt. The prompt's history window stays
+anchored while the conversation grows, so the next prompt starts with the
+same header and history tokens and only the new turns are prefilled. A
+session whose prompt outgrows its token budget is reset, and the next prompt
+starts a new window with a full encode.
+
+Reuse is decided on token ids: the whole prompt is tokenized and only the
+longest run of leading tokens it shares with a cached sequence is taken from
+the cache, so the model sees exactly the tokens it would have seen without it.
+
+Generation stops as soon as the reply is complete (StopOnText): when it
+reaches one of the caller's stop markers, where the reply would be cut
+anyway, or ends a sentence once it is KOZY_STOP_SENTENCE_CHARS long (0 turns
+the sentence rule off). generation_stats() reports the tokens generated and
+the ones that were not sampled.
+
+Several candidate replies (num_return_sequences) are sampled as one batch:
+the prompt is prefilled once and its KV cache expanded to every candidate.
+
+stream() runs the same generation on a worker thread and yields the reply's
+text as it is produced (a TextIteratorStreamer between the two); when the
+caller stops reading, the generation is cancelled at the next token.
+
+KOZY_PREFIX_CACHE=0 turns the header cache off and KOZY_PREFIX_CACHE_SIZE
+bounds the number of headers; KOZY_SESSION_KV_CACHE=0 turns the per-session
+cache off, KOZY_SESSION_KV_SIZE / KOZY_SESSION_KV_TTL bound the number of
+sessions and their idle seconds, and KOZY_SESSION_KV_TOKENS the tokens kept
+per session.
+"""
+import copy
+import os
+import threading
+import time
+
+from bounded_cache import LRUCache
+from prompt_budget import PromptBudget
+
+PREFIX_CACHE_ENABLED = os.environ.get("KOZY_PREFIX_CACHE", "1") != "0"
+PREFIX_CACHE_SIZE = int(os.environ.get("KOZY_PREFIX_CACHE_SIZE", "32"))
+SESSION_KV_ENABLED = os.environ.get("KOZY_SESSION_KV_CACHE", "1") != "0"
+SESSION_KV_SIZE = int(os.environ.get("KOZY_SESSION_KV_SIZE", "8"))
+SESSION_KV_TTL = float(os.environ.get("KOZY_SESSION_KV_TTL", "1800"))
+SESSION_KV_TOKENS = int(os.environ.get("KOZY_SESSION_KV_TOKENS", "896"))
+STOP_SENTENCE_CHARS = int(os.environ.get("KOZY_STOP_SENTENCE_CHARS", "200"))
+SENTENCE_ENDINGS = (".", "!", "?")
+
+# Prefix text -> (prefix token ids, past_key_values)
+prefix_cache = LRUCache(PREFIX_CACHE_SIZE)
+# firebase_session_key -> GenerationSession
+session_cache = LRUCache(SESSION_KV_SIZE, SESSION_KV_TTL)
+
+_counters = {"prompts": 0, "prompt_tokens": 0, "reused_tokens": 0, "session_reuses": 0, "session_overflows": 0}
+_generation_counters = {"generations": 0, "sequences": 0, "generated_tokens": 0, "generation_seconds": 0.0,
+                        "stopped_early": 0, "tokens_not_sampled": 0, "cancelled": 0}
+_counters_lock = threading.Lock()
+
+def _count(counters=_counters, **increments):
+    with _counters_lock:
+        for name, value in increments.items():
+            counters[name] += value
+
+def session_kv_stats():
+    """Per-session cache size/hit counters plus how much of the prompts came from a cache"""
+    with _counters_lock:
+        snapshot = dict(_counters)
+    snapshot["reused_fraction"] = snapshot["reused_tokens"] / snapshot["prompt_tokens"] if snapshot["prompt_tokens"] else 0.0
+    snapshot["sessions"] = session_cache.stats()
+    return snapshot
+
+def generation_stats():
+    """Tokens generated per reply, and how many early stopping saved (time estimated at the mean per-token cost)"""
+    with _counters_lock:
+        snapshot = dict(_generation_counters)
+    generations, generated = snapshot["generations"], snapshot["generated_tokens"]
+    snapshot["mean_generated_tokens"] = generated / generations if generations else 0.0
+    seconds_per_token = snapshot["generation_seconds"] / generated if generated else 0.0
+    snapshot["estimated_ms_saved"] = snapshot["tokens_not_sampled"] * seconds_per_token * 1000
+    snapshot["mean_ms_saved"] = snapshot["estimated_ms_saved"] / generations if generations else 0.0
+    return snapshot
+
+def _private_copy(past_key_values):
+    """A cache the model may extend without touching the shared one
+
+    Legacy tuple caches are never modified in place (every step concatenates into
+    new tensors); newer Cache objects grow in place, so they are copied.
+    """
+    return past_key_values if isinstance(past_key_values, tuple) else copy.deepcopy(past_key_values)
+
+def _cropped(past_key_values, length):
+    """A private cache holding the first `length` positions of past_key_values"""
+    if isinstance(past_key_values, tuple):
+        return tuple((key[:, :, :length], value[:, :, :length]) for key, value in past_key_values)
+    past_key_values = copy.deepcopy(past_key_values)
+    past_key_values.crop(length)
+    return past_key_values
+
+def _expanded(past_key_values, batch_size):
+    """A private cache extended to batch_size sequences that all continue the cached prompt
+
+    Legacy tuples are expanded as views, without copying; Cache objects are repeated in place.
+    """
+    if isinstance(past_key_values, tuple):
+        return tuple((key.expand(batch_size, -1, -1, -1), value.expand(batch_size, -1, -1, -1))
+                     for key, value in past_key_values)
+    past_key_values.batch_repeat_interleave(batch_size)
+    return past_key_values
+
+def _shared_length(input_ids, cached_ids):
+    """Number of leading tokens two (1, n) id tensors have in common"""
+    length = min(input_ids.shape[-1], cached_ids.shape[-1])
+    mismatches = (input_ids[0, :length] != cached_ids[0, :length]).nonzero()
+    return int(mismatches[0, 0]) if len(mismatches) else length
+
+class StopOnText:
+    """Stopping criterion that ends generation once every sequence's reply is complete
+
+    Each step decodes only the tokens added since the last one. A reply (the text
+    after the prompt, leading whitespace stripped) is complete when it contains one
+    of `markers`, or when it ends a sentence once it is min_chars long. A sequence
+    that has generated eos_token_id is complete as well: generate() pads it with
+    more EOS tokens, which decode to nothing, while the rest of the batch goes on.
+    """
+
+    def __init__(self, tokenizer, prompt_length, markers, min_chars=STOP_SENTENCE_CHARS, eos_token_id=None):
+        self.tokenizer = tokenizer
+        self.markers = markers
+        self.min_chars = min_chars
+        self.eos_token_id = eos_token_id
+        self.decoded_length = prompt_length
+        self.replies = {}
+        self.ended = set()
+        self.stopped = False
+
+    def complete(self, reply):
+        if any(marker in reply for marker in self.markers):
+            return True
+        return 0 < self.min_chars <= len(reply) and reply.rstrip().endswith(SENTENCE_ENDINGS)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        new_ids = input_ids[:, self.decoded_length:]
+        self.decoded_length = input_ids.shape[-1]
+        done = True
+        for row, ids in enumerate(new_ids):
+            if self.eos_token_id is not None and row not in self.ended and (ids == self.eos_token_id).any():
+                self.ended.add(row)
+            if row in self.ended:
+                continue
+            reply = (self.replies.get(row, "") + self.tokenizer.decode(ids, skip_special_tokens=True)).lstrip()
+            self.replies[row] = reply
+            done = self.complete(reply) and done
+        # When every sequence ended on EOS, generate() stops by itself; that is not an early stop
+        self.stopped = done and len(self.ended) < len(new_ids)
+        return done
+
+class StopOnEvent:
+    """Stopping criterion that ends generation once a threading.Event is set"""
+
+    def __init__(self, event):
+        self.event = event
+        self.stopped = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.stopped = self.event.is_set()
+        return self.stopped
+
+class GenerationSession:
+    """One conversation's last prompt tokens and their KV cache
+
+    history_start is the first chat_history entry the prompts show. It stays put
+    while the conversation grows, so every prompt extends the previous one.
+    """
+
+    def __init__(self, max_tokens=SESSION_KV_TOKENS):
+        self.lock = threading.Lock()
+        self.max_tokens = max_tokens
+        self.history_start = None
+        self.token_ids = None
+        self.past_key_values = None
+
+    def window_start(self, history_length, min_turns, max_turns):
+        """First history entry to show: fixed while the window grows from min_turns to
+        max_turns entries, then moved up to the last min_turns"""
+        with self.lock:
+            if self.history_start is None or not 0 <= history_length - self.history_start <= max_turns:
+                self.history_start = max(0, history_length - min_turns)
+            return self.history_start
+
+    def restart_window(self, history_start=None):
+        """Move the history window's start (to the last min_turns entries when not given)"""
+        with self.lock:
+            self.history_start = history_start
+
+    def reset(self):
+        """Drop the cached tokens; the next prompt starts a new window and is encoded in full"""
+        self.history_start = None
+        self.token_ids = None
+        self.past_key_values = None
+
+class PrefixCachedGenerator:
+    """A text-generation pipeline plus reusable KV caches for prompt prefixes and sessions"""
+
+    def __init__(self, pipeline, cache=prefix_cache, enabled=PREFIX_CACHE_ENABLED,
+                 sessions=session_cache if SESSION_KV_ENABLED else None):
+        self.pipeline = pipeline
+        self.model = pipeline.model
+        self.tokenizer = pipeline.tokenizer
+        self.cache = cache
+        self.enabled = enabled
+        self.sessions = sessions
+        # Prompts are fitted to the model's context window, less the room for the reply
+        self.budget = PromptBudget(self.tokenizer, getattr(self.model.config, "n_positions", None) or self.tokenizer.model_max_length)
+
+    def __call__(self, text, **generate_kwargs):
+        """Plain pipeline call on the whole text"""
+        return self.pipeline(text, **generate_kwargs)
+
+    def as_tensor(self, token_ids):
+        import torch
+        return torch.tensor([token_ids], dtype=torch.long, device=self.model.device)
+
+    def encode(self, text):
+        return self.as_tensor(self.tokenizer.encode(text))
+
+    def _forward(self, input_ids, past_key_values=None):
+        """past_key_values after running the model over input_ids on top of past_key_values"""
+        import torch
+        with torch.no_grad():
+            return self.model(input_ids=input_ids, past_key_values=past_key_values, use_cache=True).past_key_values
+
+    def prefix_state(self, prefix):
+        """(token ids, past_key_values) of a prefix, computed the first time it is seen"""
+        def prefill():
+            prefix_ids = self.encode(prefix)
+            return prefix_ids, self._forward(prefix_ids)
+        return self.cache.get_or_create(prefix, prefill)
+
+    def session(self, session_key):
+        """The GenerationSession of a conversation, or None without a key or with the cache off"""
+        if self.sessions is None or not session_key:
+            return None
+        return self.sessions.get_or_create(session_key, GenerationSession)
+
+    def _prefill(self, input_ids, prefix, session):
+        """KV cache of every prompt token but the last, from the longest cached run of leading
+        tokens plus a prefill of the rest; None (generate() prefills everything) if nothing
+        cached applies and there is no session"""
+        # At least the last token is left for generate() to feed, exactly as it feeds each generated token
+        limit = input_ids.shape[-1] - 1
+        reused, source = 0, None
+        if self.enabled and prefix:
+            prefix_ids, prefix_past = self.prefix_state(prefix)
+            reused = min(_shared_length(input_ids, prefix_ids), limit)
+            source = prefix_past if reused else None
+        if session is not None and session.token_ids is not None:
+            shared = min(_shared_length(input_ids, session.token_ids), limit)
+            if shared > reused:
+                reused, source = shared, session.past_key_values
+                _count(session_reuses=1)
+        _count(prompts=1, prompt_tokens=input_ids.shape[-1], reused_tokens=reused)
+        if source is None and session is None:
+            return None
+
+        past = _cropped(source, reused) if source is not None else None
+        if limit > reused:
+            past = self._forward(input_ids[:, reused:limit], past)
+        return past
+
+    def generate(self, prefix, suffix, session=None, input_ids=None, stop_markers=None,
+                 stop_min_chars=STOP_SENTENCE_CHARS, cancel=None, **generate_kwargs):
+        """Generate a continuation of prefix + suffix, in the pipeline's output format
+
+        input_ids are the prompt's token ids when the caller already has them (see
+        prompt_budget.py); otherwise the prompt is tokenized here. With a
+        GenerationSession the prompt's KV cache is kept for the session's next prompt.
+        With stop_markers, generation stops once the reply is complete (StopOnText,
+        with stop_min_chars for the sentence rule). With a threading.Event as cancel,
+        generation stops at the next token once the event is set. With
+        num_return_sequences, the sequences are one batch sharing the prompt's prefill.
+        generate_kwargs are passed to model.generate.
+        """
+        import torch
+
+        prompt = prefix + suffix
+        input_ids = self.as_tensor(input_ids if input_ids is not None else self.tokenizer.encode(prompt))
+        if session is None:
+            past = self._prefill(input_ids, prefix, None)
+        else:
+            with session.lock:
+                past = self._prefill(input_ids, prefix, session)
+                if input_ids.shape[-1] > session.max_tokens:
+                    # Too long to keep growing; the next turn re-anchors its window and encodes it in full
+                    session.reset()
+                    _count(session_overflows=1)
+                else:
+                    session.token_ids, session.past_key_values = input_ids[:, :-1], past
+                    past = _private_copy(past)
+
+        # generate() does not expand a passed-in cache for several sequences per prompt, so the
+        # candidates are a batch of copies of the prompt sharing one prefill
+        sequences = generate_kwargs.pop("num_return_sequences", 1)
+        prompt_length = input_ids.shape[-1]
+        if sequences > 1:
+            if past is None and prompt_length > 1:
+                past = self._forward(input_ids[:, :-1])
+            if past is not None:
+                past = _expanded(past, sequences)
+            input_ids = input_ids.expand(sequences, -1)
+        if past is not None:
+            generate_kwargs["past_key_values"] = past
+        stop = cancelled = None
+        criteria = []
+        if stop_markers is not None:
+            stop = StopOnText(self.tokenizer, prompt_length, stop_markers, stop_min_chars,
+                              generate_kwargs.get("eos_token_id", self.tokenizer.eos_token_id))
+            criteria.append(stop)
+        if cancel is not None:
+            cancelled = StopOnEvent(cancel)
+            criteria.append(cancelled)
+        if criteria:
+            from transformers import StoppingCriteriaList
+            generate_kwargs["stopping_criteria"] = StoppingCriteriaList(criteria)
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            output_ids = self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                             **generate_kwargs)
+        generated = output_ids.shape[-1] - prompt_length
+        not_sampled = 0
+        if stop is not None and stop.stopped and generate_kwargs.get("max_new_tokens"):
+            not_sampled = max(0, generate_kwargs["max_new_tokens"] - generated)
+        _count(_generation_counters, generations=1, sequences=sequences, generated_tokens=generated,
+               generation_seconds=time.perf_counter() - start, stopped_early=int(not_sampled > 0),
+               tokens_not_sampled=not_sampled, cancelled=int(cancelled is not None and cancelled.stopped))
+        results = []
+        for sequence in output_ids:
+            completion = self.tokenizer.decode(sequence[prompt_length:], skip_special_tokens=True)
+            results.append({"generated_text": prompt + completion})
+        return results
+
+    def stream(self, prefix, suffix, **generate_kwargs):
+        """generate(), yielding the text of the reply (without the prompt) as it is produced
+
+        The generation runs on a worker thread that feeds a TextIteratorStreamer.
+        Closing the iterator early cancels it; an error in it is raised here.
+        """
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        cancel = threading.Event()
+        errors = []
+
+        def run():
+            try:
+                self.generate(prefix, suffix, streamer=streamer, cancel=cancel, **generate_kwargs)
+            except Exception as e:
+                errors.append(e)
+                # Unblock the reader; generate() only ends the streamer when it finishes
+                streamer.end()
+
+        worker = threading.Thread(target=run, name="kozy-stream", daemon=True)
+        worker.start()
+        try:
+            for text in streamer:
+                yield text
+        finally:
+            cancel.set()
+            worker.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,126 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class MicroBatcher:
+    """Collect single inference requests from many threads into small batches
+
+    Callers submit one item and get a Future back. A background worker waits up
+    to `max_wait_ms` (or until `max_batch_size` items are queued), runs
+    `batch_fn` once on the whole batch, and resolves each caller's future with
+    its own result. A request with nothing else in flight is run straight away
+    instead of waiting out `max_wait_ms` for company.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=5.0, name="batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._in_flight = 0
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "batched_requests": 0,
+            "errors": 0,
+            "max_queue_depth": 0,
+            "batch_sizes": {}
+        }
+
+    def submit(self, item):
+        """Queue one item and return a Future for its result"""
+        future = Future()
+        self._ensure_worker()
+
+        # Counted before it is queued, so the worker never takes it for a lone request
+        # while another one is on its way into the queue
+        with self._lock:
+            self._in_flight += 1
+            self._stats["requests"] += 1
+        self._queue.put((item, future))
+
+        with self._lock:
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+
+        return future
+
+    def __call__(self, item, timeout=None):
+        """Submit one item and block until its result is ready"""
+        return self.submit(item).result(timeout=timeout)
+
+    def stats(self):
+        """Return a snapshot of queue depth and batch-size metrics"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["batch_sizes"] = dict(self._stats["batch_sizes"])
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["max_batch_size"] = self.max_batch_size
+        snapshot["max_wait_ms"] = self.max_wait * 1000.0
+        snapshot["avg_batch_size"] = snapshot["batched_requests"] / snapshot["batches"] if snapshot["batches"] else 0.0
+        return snapshot
+
+    def _ensure_worker(self):
+        """Start the background worker on first use"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def _collect_batch(self):
+        """Block for the first item, then gather more until the batch is full or the wait expires"""
+        batch = [self._queue.get()]
+
+        # A lone request should not sit out the wait window; requests that arrive
+        # while it runs queue up and form the next batch
+        with self._lock:
+            alone = self._in_flight <= 1
+        deadline = time.monotonic() + (0.0 if alone else self.max_wait)
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Wait expired, but still take anything that is already queued
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        """Worker loop: run batch_fn on each collected batch"""
+        while True:
+            batch = self._collect_batch()
+            items = [item for item, _ in batch]
+
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["batched_requests"] += len(batch)
+                sizes = self._stats["batch_sizes"]
+                sizes[len(batch)] = sizes.get(len(batch), 0) + 1
+
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise ValueError(f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                    self._in_flight -= len(batch)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._lock:
+                self._in_flight -= len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -1,234 +1,186 @@
-import json
 import os
-import re
 import random
+import threading
+import time
+
+from emotion_result import emotion_label
+from faq_embeddings import DEFAULT_INDEX_PATH, ENCODER_MODEL_NAME, SemanticFaqIndex, SentenceEncoder
+from faq_index import FaqIndex
+from knowledge_bundle import (KNOWLEDGE_BUNDLE_PATH, KNOWLEDGE_RELOAD_SECONDS, KNOWLEDGE_SOURCE_PATH,
+                              bundle_stamp, compile_source, load_bundle)
+from message_analysis import analyze_message
+from model_registry import model_registry
+from session_state import SessionState
+
+# "keyword" scores literal word overlap; "semantic" ranks FAQs by embedding similarity
+# (index built with `python faq_embeddings.py build`) and falls back to keywords
+# whenever the encoder or index is unavailable
+FAQ_RETRIEVAL = os.environ.get("KOZY_FAQ_RETRIEVAL", "keyword")
+FAQ_EMBEDDINGS_PATH = os.environ.get("KOZY_FAQ_EMBEDDINGS", DEFAULT_INDEX_PATH)
+FAQ_SIMILARITY_THRESHOLD = float(os.environ.get("KOZY_FAQ_SIMILARITY", "0.45"))
+
+faq_encoder_model = model_registry.register(
+    "faq_encoder", SentenceEncoder,
+    warmup=lambda encoder: encoder.encode(["Warming up the FAQ encoder"])) if FAQ_RETRIEVAL == "semantic" else None
 
 class KnowledgeBase:
-    def __init__(self):
-        self.faqs = {
-            "mental health": [
-                {"q": "How can I manage stress?", 
-                 "a": "Managing stress can involve several strategies like deep breathing, regular exercise, adequate sleep, setting boundaries, and practicing mindfulness. Would you like more specific techniques for your situation?"},
-                {"q": "What are signs of anxiety?", 
-                 "a": "Common signs of anxiety include excessive worry, restlessness, feeling on edge, fatigue, difficulty concentrating, irritability, muscle tension, and sleep problems. Are you noticing any of these symptoms?"},
-                {"q": "How to improve mood?", 
-                 "a": "Improving your mood can involve physical activity, spending time in nature, connecting with loved ones, practicing gratitude, and doing activities you enjoy. What kinds of activities typically help lift your spirits?"}
-            ],
-            "relationships": [
-                {"q": "How to handle conflict?", 
-                 "a": "Handling conflict effectively involves active listening, using 'I' statements, staying calm, focusing on the problem rather than the person, and looking for compromise. Is there a specific conflict you're dealing with?"},
-                {"q": "Signs of a healthy relationship?", 
-                 "a": "Healthy relationships typically involve mutual respect, trust, honesty, good communication, support for each other's independence, and the ability to resolve conflicts constructively. How would you describe your relationship?"},
-                {"q": "How to set boundaries?", 
-                 "a": "Setting boundaries involves identifying your limits, communicating them clearly and directly, being consistent, preparing for pushback, and practicing self-care. Would you like help setting a specific boundary?"}
-            ],
-            "work": [
-                {"q": "How to handle work stress?", 
-                 "a": "Managing work stress can involve prioritizing tasks, taking breaks, setting realistic expectations, communicating with your manager, and maintaining work-life balance. Which area do you struggle with most?"},
-                {"q": "Dealing with difficult colleagues?", 
-                 "a": "When dealing with difficult colleagues, try to understand their perspective, focus on the issue not the person, communicate assertively, set boundaries, and seek mediation if needed. What specific challenges are you having?"},
-                {"q": "Managing workload?", 
-                 "a": "To manage workload effectively, try prioritizing tasks, breaking projects into smaller steps, learning to delegate, setting realistic deadlines, and communicating with your manager about capacity. Would you like more specific advice?"}
-            ],
-            "boredom": [
-                {"q": "Activities for boredom?",
-                 "a": "When feeling bored, try engaging your mind with reading, learning something new, creative activities like drawing or writing, or physical exercise. Which of these sounds most appealing to you?"},
-                {"q": "Productive ways to use free time?",
-                 "a": "Free time can be used to develop a new skill, work on a personal project, reach out to friends, or practice self-care. Is there something you've been wanting to try?"}
-            ],
-            "success": [
-                {"q": "How to celebrate achievements?",
-                 "a": "Celebrating achievements helps reinforce positive behavior. Consider treating yourself to something special, sharing your success with others, or simply taking time to acknowledge your hard work. How do you usually celebrate your wins?"},
-                {"q": "Handling impostor syndrome?",
-                 "a": "Many people feel like impostors even when successful. Remember your accomplishments, accept praise, talk about your feelings, and focus on the value you provide. Do you sometimes feel you don't deserve your success?"}
-            ]
-        }
-        
-        # Replace external resources with BeFriends app features
-        self.app_features = {
-            "self_reflection": [
-                {"name": "Mood Diary", "feature": "diary", "description": "Write in your diary and get a sentiment analysis score to track your emotional patterns"},
-                {"name": "Color Analysis", "feature": "color_analysis", "description": "Take our color test to receive a detailed personality report that may provide new insights"}
-            ],
-            "connection": [
-                {"name": "Listeners Chat", "feature": "listeners", "description": "Connect with our trained listeners who can provide additional emotional support"},
-                {"name": "Community Reels", "feature": "reels", "description": "Watch short, uplifting videos from our community that might boost your mood"}
-            ],
-            "relaxation": [
-                {"name": "Candle Store", "feature": "candle_store", "description": "Browse our selection of aromatherapy candles designed to create a calming environment"},
-                {"name": "Guided Meditation", "feature": "meditation", "description": "Try a quick guided meditation to help center yourself"}
-            ],
-            "emergency": [
-                {"name": "Crisis Support", "feature": "crisis_support", "description": "Connect immediately with specialized support resources"},
-                {"name": "Wellness Check", "feature": "wellness_check", "description": "Take a quick wellness assessment to receive personalized coping strategies"}
-            ]
-        }
-        
-        # Emotion-specific response templates for more personalized interactions
-        self.emotion_responses = {
-            "happy": [
-                "That's fantastic news! I'm so happy for you! 🎉 {follow_up_question}",
-                "Wow, that's something to celebrate! I'm genuinely thrilled to hear this! ✨ {follow_up_question}",
-                "That's wonderful! It's great to see good things happening for you! 🌟 {follow_up_question}",
-                "I'm so glad to hear that! You deserve this moment of joy! ☺️ {follow_up_question}",
-                "That's really something to be proud of! Congratulations! 🎊 {follow_up_question}"
-            ],
-            "sad": [
-                "I'm sorry you're feeling this way. It sounds really difficult right now. {follow_up_question}",
-                "That's tough to deal with. I'm here to listen if you want to talk more about what's got you feeling down. {follow_up_question}",
-                "I can hear that you're going through a hard time. Sometimes just expressing these feelings can help a little. {follow_up_question}",
-                "It's okay to feel sad sometimes. Would sharing more about what's happening help you process it? {follow_up_question}",
-                "I'm here with you during this difficult time. Your feelings are valid and important. {follow_up_question}"
-            ],
-            "angry": [
-                "I understand why you'd feel frustrated about that. It sounds genuinely aggravating. {follow_up_question}",
-                "That would annoy me too! It's completely valid to feel upset about this situation. {follow_up_question}",
-                "I can see why that would make you angry. Sometimes acknowledging these feelings is the first step. {follow_up_question}",
-                "That sounds really frustrating to deal with. I'm here to listen as you work through these feelings. {follow_up_question}",
-                "It makes sense that you're feeling upset about this. Would talking more about it help? {follow_up_question}"
-            ],
-            "excited": [
-                "That sounds amazing! I'm excited for you too! 🎉 {follow_up_question}",
-                "How wonderful! Your enthusiasm is contagious! ✨ {follow_up_question}",
-                "That's fantastic news! I'd love to hear more about what you're looking forward to! {follow_up_question}",
-                "I can feel your excitement! This sounds like such a great opportunity! 🌟 {follow_up_question}",
-                "Wow! That's definitely something to be excited about! Tell me more! {follow_up_question}"
-            ],
-            "fear": [
-                "It's completely natural to feel anxious about this. Many people feel the same way in similar situations. {follow_up_question}",
-                "I understand why you're worried. Uncertainty can be really challenging to deal with. {follow_up_question}",
-                "Those concerns make perfect sense. Let's talk through what's making you anxious. {follow_up_question}",
-                "It's okay to feel nervous about this. Would it help to talk about specific aspects that worry you most? {follow_up_question}",
-                "I hear your concern. Sometimes naming our fears can make them feel a bit more manageable. {follow_up_question}"
-            ],
-            "bored": [
-                "Feeling a bit unstimulated? Sometimes that's actually an opportunity for something new! {follow_up_question}",
-                "Having nothing to do can actually be a great moment to try something different. {follow_up_question}",
-                "Those moments when we feel bored can sometimes lead to unexpected creativity. {follow_up_question}",
-                "I get that feeling! Sometimes our minds just need a new challenge or experience. {follow_up_question}",
-                "Boredom can be surprisingly uncomfortable, but it can also be a doorway to discovering new interests. {follow_up_question}"
-            ],
-            "neutral": [
-                "I'd love to hear more about what's on your mind today. {follow_up_question}",
-                "Thanks for sharing that with me. {follow_up_question}",
-                "I appreciate you telling me about this. {follow_up_question}",
-                "That's interesting to hear. {follow_up_question}",
-                "I'm glad you're sharing this with me. {follow_up_question}"
-            ]
-        }
+    """Answers from the current knowledge content (see knowledge_bundle.py)
+
+    All FAQs, features and templates live in one read-only KnowledgeContent.
+    `reload()` swaps in a newly built bundle with a single assignment; a request
+    keeps using the content it started with.
+    """
+    def __init__(self, bundle_path=KNOWLEDGE_BUNDLE_PATH, source_path=KNOWLEDGE_SOURCE_PATH):
+        self.bundle_path = bundle_path
+        self.source_path = source_path
+        self.reloads = 0
+        self._bundle_stamp = None
+        self._reload_lock = threading.Lock()
+        
+        self.semantic_index = None
+        if FAQ_RETRIEVAL == "semantic":
+            self.load_semantic_index(FAQ_EMBEDDINGS_PATH)
+        
+        self._bundle_stamp = bundle_stamp(bundle_path)
+        content = None
+        if self._bundle_stamp is not None:
+            try:
+                content = load_bundle(bundle_path)
+            except Exception as e:
+                print(f"Error loading knowledge bundle {bundle_path}: {e}")
+        if content is None:
+            # No usable build (e.g. a fresh checkout): compile the source once at startup
+            content = compile_source(source_path)
+        self.install(content)
+    
+    # The current content's pieces, for callers outside the request path
+    @property
+    def faqs(self):
+        return self.content.faqs
+    
+    @property
+    def app_features(self):
+        return self.content.app_features
+    
+    @property
+    def faq_index(self):
+        return self.content.faq_index
+    
+    def install(self, content):
+        """Make `content` the current knowledge content"""
+        if self.semantic_index is not None:
+            content.semantic_rows = self._semantic_rows(content)
+        self.content = content
+    
+    def reload(self):
+        """Swap in the bundle if it was rebuilt since the last check; True if it was"""
+        with self._reload_lock:
+            stamp = bundle_stamp(self.bundle_path)
+            if stamp is None or stamp == self._bundle_stamp:
+                return False
+            self._bundle_stamp = stamp
+            try:
+                content = load_bundle(self.bundle_path)
+            except Exception as e:
+                # Keep serving the content we have
+                print(f"Error reloading knowledge bundle {self.bundle_path}: {e}")
+                return False
+            self.install(content)
+            self.reloads += 1
+            print(f"Knowledge content version {content.version} loaded from {self.bundle_path}")
+            return True
+    
+    def watch_bundle(self, interval=KNOWLEDGE_RELOAD_SECONDS):
+        """Check for a rebuilt bundle every `interval` seconds in a background thread"""
+        if interval <= 0:
+            return None
         
-        # Follow-up questions based on emotion
-        self.follow_up_questions = {
-            "happy": [
-                "What are you most excited about with this news?",
-                "How are you planning to celebrate?",
-                "Has this been something you've been working toward for a while?",
-                "Who was the first person you shared this news with?",
-                "What does this mean for you moving forward?"
-            ],
-            "sad": [
-                "Would you like to talk more about what's making you feel this way?",
-                "What's been the hardest part to deal with?",
-                "Is there anything specific that might help you feel a little better right now?",
-                "Have you been feeling this way for a while, or is it more recent?",
-                "Would it help to talk about some small steps that might make things easier?"
-            ],
-            "angry": [
-                "What exactly happened that frustrated you the most?",
-                "Have you had a chance to process these feelings yet?",
-                "What would a good resolution look like for you?",
-                "Is there a particular part of the situation that feels most unfair?",
-                "Is there something I can do to help you with this situation?"
-            ],
-            "excited": [
-                "Tell me more about what you're looking forward to!",
-                "How long have you been anticipating this?",
-                "What aspect are you most excited about?",
-                "How are you preparing for this?",
-                "What are you most looking forward to about this?"
-            ],
-            "fear": [
-                "What specifically feels most worrying to you?",
-                "What has helped you manage similar feelings in the past?",
-                "Is there a particular outcome you're concerned about?",
-                "Would it help to talk about some strategies for handling this?",
-                "On a scale of 1-10, how anxious are you feeling about this right now?"
-            ],
-            "bored": [
-                "What kinds of activities usually capture your interest?",
-                "Is there something new you've been wanting to try?",
-                "Would you prefer something active or something more relaxing right now?",
-                "Have you considered trying one of our mindfulness activities?",
-                "What's something you enjoy that you haven't done in a while?"
-            ],
-            "neutral": [
-                "How has your day been going so far?",
-                "Is there anything specific on your mind today?",
-                "What would be most helpful for us to talk about?",
-                "How are you feeling right now?",
-                "What brought you to our conversation today?"
-            ]
-        }
+        def watch():
+            while True:
+                time.sleep(interval)
+                self.reload()
         
-        # Track suggested resources and FAQs to avoid repetition
-        self.suggested_features = set()
-        self.suggested_faqs = set()
-        self.conversation_context = {
-            "last_emotion": None,
-            "emotion_history": [],
-            "topic_history": [],
-            "feature_suggestion_count": 0
-        }
+        thread = threading.Thread(target=watch, name="knowledge-bundle-watcher", daemon=True)
+        thread.start()
+        return thread
+    
+    def stats(self):
+        return dict(self.content.summary(), bundle_path=self.bundle_path, reloads=self.reloads)
+    
+    def load_semantic_index(self, path):
+        """Memory-map the FAQ embedding index; rows are lined up with each content version on install"""
+        try:
+            index = SemanticFaqIndex(path)
+        except (OSError, ValueError) as e:
+            print(f"Error loading FAQ embeddings {path}, using keyword retrieval: {e}")
+            return
+        if index.model_name != ENCODER_MODEL_NAME:
+            print(f"FAQ embeddings {path} were built with {index.model_name}, not {ENCODER_MODEL_NAME}; using keyword retrieval")
+            return
+        self.semantic_index = index
     
-    def find_relevant_faq(self, message, emotion=None, chat_history=None):
-        """Find FAQs relevant to the user's message and emotional state, avoiding repetition"""
-        message = message.lower()
+    def _semantic_rows(self, content):
+        """(FAQ per index row, stale rows, rows by FAQ key) for this content"""
+        faqs_by_question = {(category, faq["q"]): faq for category, faqs in content.faqs.items() for faq in faqs}
+        semantic_faqs = [faqs_by_question.get(entry) for entry in self.semantic_index.entries]
+        # Rows for FAQs that no longer exist are never returned (rebuild the index to drop them)
+        stale_rows = [row for row, faq in enumerate(semantic_faqs) if faq is None]
+        rows_by_key = {}
+        for row, faq in enumerate(semantic_faqs):
+            if faq is not None:
+                rows_by_key.setdefault(FaqIndex.faq_key(faq), []).append(row)
+        return semantic_faqs, stale_rows, rows_by_key
+    
+    def find_semantic_faq(self, content, message, state):
+        """Best unseen FAQ by embedding similarity, None if nothing is similar enough,
+        or False if semantic retrieval is unavailable right now"""
+        encoder = faq_encoder_model.get() if content.semantic_rows is not None else None
+        if encoder is None:
+            return False
+        semantic_faqs, stale_rows, rows_by_key = content.semantic_rows
+        
+        query_vector = encoder.encode([message])[0]
+        excluded = list(stale_rows)
+        for key in state.suggested_faqs:
+            excluded.extend(rows_by_key.get(key, ()))
+        # Everything has been suggested once; start over rather than go quiet
+        if len(set(excluded)) >= len(self.semantic_index):
+            state.suggested_faqs.clear()
+            excluded = list(stale_rows)
+        top = self.semantic_index.search(query_vector, k=1, threshold=FAQ_SIMILARITY_THRESHOLD, exclude_rows=excluded)
+        return semantic_faqs[top[0][1]] if top else None
+    
+    def find_relevant_faq(self, message, emotion=None, chat_history=None, state=None, analysis=None):
+        """Find FAQs relevant to the user's message and emotional state, avoiding repetition
+        
+        `state` is the conversation's SessionState; without one nothing is remembered
+        between calls. `analysis` is the turn's MessageAnalysis, computed here if not given.
+        """
+        state = state or SessionState()
+        analysis = analysis or analyze_message(message)
+        with state.lock:
+            return self._find_relevant_faq(self.content, analysis, emotion_label(emotion), state)
+    
+    def _find_relevant_faq(self, content, analysis, emotion, state):
+        message = analysis.lower
         relevant_faqs = []
         
         # Track this emotion
-        self.conversation_context["last_emotion"] = emotion
-        self.conversation_context["emotion_history"].append(emotion)
-        if len(self.conversation_context["emotion_history"]) > 5:
-            self.conversation_context["emotion_history"] = self.conversation_context["emotion_history"][-5:]
-        
-        # Expanded keywords for better topic detection
-        category_keywords = {
-            "mental health": ["anxiety", "stress", "depression", "mental health", "therapy", "mood", "emotion", 
-                            "feeling", "sad", "worried", "overwhelm", "anxious", "nervous", "tense", "pressure", 
-                            "burned out", "exhausted", "drained", "down", "upset"],
-            "relationships": ["relationship", "partner", "friend", "family", "boyfriend", "girlfriend", "husband", 
-                            "wife", "marriage", "date", "conflict", "team", "colleague", "coworker", "fight", 
-                            "argue", "misunderstand", "communicate", "trust"],
-            "work": ["work", "job", "boss", "colleague", "career", "workplace", "workload", "task", "project", 
-                    "manager", "coworker", "promotion", "deadline", "meeting", "presentation", "client", 
-                    "responsibility", "performance", "stress"],
-            "boredom": ["bored", "boring", "nothing to do", "idle", "unoccupied", "free time", "unstimulated", 
-                        "dull", "monotonous", "uninteresting"],
-            "success": ["success", "achievement", "accomplish", "promotion", "celebrate", "proud", "recognition", 
-                        "reward", "win", "achieve", "goal", "milestone", "proud"]
-        }
-        
-        # Extract keywords from message for topic tracking
-        message_words = set(re.findall(r'\b\w+\b', message))
-        detected_topics = set()
+        state.remember_emotion(emotion)
         
-        # Detect categories and track topics
-        relevant_categories = []
-        for category, keywords in category_keywords.items():
-            if any(keyword in message for keyword in keywords):
-                relevant_categories.append(category)
-                detected_topics.add(category)
+        # FAQ categories whose classifier topics the message has (see faq_category_topics)
+        message_tokens = analysis.tokens
+        message_words = set(message_tokens)
+        relevant_categories = [category for category, topics in content.category_topics.items() if analysis.has(*topics)]
         
         # Update topic history
-        for topic in detected_topics:
-            if topic not in self.conversation_context["topic_history"]:
-                self.conversation_context["topic_history"].append(topic)
+        state.remember_topics(relevant_categories)
         
         # If no direct category matches, use emotion as a guide
         if not relevant_categories and emotion:
             if emotion in ["sad", "fear"]:
                 relevant_categories.append("mental health")
-            elif emotion == "angry" and any(word in message for word in ["person", "people", "friend", "they", "team"]):
+            elif emotion == "angry" and analysis.has("people"):
                 relevant_categories.append("relationships")
             elif emotion == "happy" or emotion == "excited":
                 relevant_categories.append("success")
@@ -240,207 +192,108 @@ class KnowledgeBase:
             return []
             
         # Skip FAQ suggestions for happy/excited emotions unless explicitly asking for information
-        if (emotion in ["happy", "excited"]) and not any(x in message for x in ["how to", "how do", "advice", "help", "suggestion"]):
+        if (emotion in ["happy", "excited"]) and not analysis.has("asks_for_help"):
             return []
             
-        # Get FAQs from relevant categories
-        candidate_faqs = []
-        for category in relevant_categories:
-            for faq in self.faqs.get(category, []):
-                # Skip already suggested FAQs
-                faq_key = faq["q"][:30]  
-                if faq_key not in self.suggested_faqs:
-                    candidate_faqs.append(faq)
-        
-        # If no unseen FAQs, reset tracking to avoid getting stuck
-        if not candidate_faqs and len(self.suggested_faqs) > 0:
-            if len(relevant_categories) > 0:
-                self.suggested_faqs.clear()
-                # Try again with cleared history
-                for category in relevant_categories:
-                    candidate_faqs.extend(self.faqs.get(category, []))
-        
-        # Score FAQs by relevance
-        if candidate_faqs:
-            scored_faqs = []
-            for faq in candidate_faqs:
-                score = 0
-                # Match specific words
-                for word in re.findall(r'\b\w+\b', faq["q"].lower()):
-                    if word in message and len(word) > 3:  # Only count meaningful words
-                        score += 2
-                    # Emotion-relevant boosting
-                    if emotion == "sad" and word in ["improve", "help", "feel", "better"]:
-                        score += 1
-                    elif emotion == "angry" and word in ["handle", "manage", "difficult", "conflict"]:
-                        score += 1
-                    elif emotion == "fear" and word in ["anxiety", "worry", "stress", "manage"]:
-                        score += 1
-                scored_faqs.append((faq, score))
-            
-            # Sort by relevance score and take top
-            scored_faqs.sort(key=lambda x: x[1], reverse=True)
-            
-            # Take top FAQ if relevance is high enough
-            if scored_faqs and scored_faqs[0][1] >= 2:
-                top_faq = scored_faqs[0][0]
-                self.suggested_faqs.add(top_faq["q"][:30])
-                relevant_faqs = [top_faq]
+        # If every FAQ in these categories was suggested already, reset tracking to avoid getting stuck
+        if relevant_categories and state.suggested_faqs and not content.faq_index.has_unseen(relevant_categories, state.suggested_faqs):
+            state.suggested_faqs.clear()
+        
+        # Semantic mode: one embedding of the message, one matrix-vector product over every FAQ
+        if FAQ_RETRIEVAL == "semantic":
+            semantic_faq = self.find_semantic_faq(content, message, state)
+            if semantic_faq is not False:
+                if semantic_faq:
+                    state.remember_faq(FaqIndex.faq_key(semantic_faq))
+                    relevant_faqs = [semantic_faq]
+                return relevant_faqs
+        
+        # Score FAQs by relevance, touching only the postings for the message's words
+        top = content.faq_index.search(message_tokens, relevant_categories, emotion, exclude_keys=state.suggested_faqs)
+        
+        # Take top FAQ if relevance is high enough
+        if top and top[0][0] >= 2:
+            top_faq = top[0][1]
+            state.remember_faq(FaqIndex.faq_key(top_faq))
+            relevant_faqs = [top_faq]
         
         return relevant_faqs
     
-    def get_app_feature(self, emotion, message, chat_history=None):
-        """Get appropriate app feature suggestion based on emotion, message, and conversation context"""
-        previously_suggested = self.suggested_features
+    def get_app_feature(self, emotion, message, chat_history=None, state=None, analysis=None):
+        """Get appropriate app feature suggestion based on emotion, message, and conversation context
+        
+        `state` is the conversation's SessionState; without one nothing is remembered
+        between calls. `analysis` is the turn's MessageAnalysis, computed here if not given.
+        """
+        state = state or SessionState()
+        analysis = analysis or analyze_message(message)
+        with state.lock:
+            return self._get_app_feature(self.content, emotion_label(emotion), analysis, chat_history, state)
+    
+    def _get_app_feature(self, content, emotion, analysis, chat_history, state):
+        table = content.feature_table
         
         # Track suggestions to avoid repetition
-        self.conversation_context["feature_suggestion_count"] += 1
+        state.feature_suggestion_count += 1
+        turn = state.feature_suggestion_count
         
-        # Check chat history for recently mentioned topics to personalize feature recommendations
-        recent_topics = set()
-        recurring_topics = set()
-        
-        if chat_history and len(chat_history) > 0:
-            # Analyze recent messages for topic frequency
-            last_messages = chat_history[-5:] if len(chat_history) >= 5 else chat_history
-            topic_counts = {}
-            
-            for entry in last_messages:
-                if 'user' in entry and entry['user']:
-                    user_msg = entry['user'].lower()
-                    
-                    # Extract topics from user messages
-                    if "lonely" in user_msg or "alone" in user_msg or "talk" in user_msg:
-                        recent_topics.add("connection")
-                        topic_counts["connection"] = topic_counts.get("connection", 0) + 1
-                        
-                    if "stress" in user_msg or "relax" in user_msg or "calm" in user_msg:
-                        recent_topics.add("relaxation")
-                        topic_counts["relaxation"] = topic_counts.get("relaxation", 0) + 1
-                        
-                    if "feel" in user_msg or "emotion" in user_msg or "understand" in user_msg:
-                        recent_topics.add("self_reflection")
-                        topic_counts["self_reflection"] = topic_counts.get("self_reflection", 0) + 1
-            
-            # Identify recurring topics (mentioned 2+ times)
-            for topic, count in topic_counts.items():
-                if count >= 2:
-                    recurring_topics.add(topic)
-        
-        # Don't suggest features too often - adjusted to be less frequent (20% of messages)
-        if self.conversation_context["feature_suggestion_count"] % 5 != 0:
-            return None
+        # Topics that recur in the last few messages personalize the recommendation
+        # (kept up to date incrementally by the conversation profile)
+        recurring_topics = state.profile.update(chat_history).recurring_feature_topics()
         
-        # Crisis keywords trigger emergency features regardless of frequency rules
-        crisis_keywords = ["suicide", "kill myself", "end my life", "want to die", "hurt myself", "harming", "end it all"]
-        if any(keyword in message.lower() for keyword in crisis_keywords):
-            feature_category = "emergency"
-            feature_options = self.app_features.get(feature_category, [])
+        # Crisis phrases trigger emergency features regardless of frequency rules
+        if analysis.crisis:
             # Critical safety features should always be shown regardless of repetition
-            return feature_options[0] if feature_options else None
+            return table.emergency_feature()
         
-        # Map emotions to feature categories with BeFriends-specific mappings
-        emotion_to_feature = {
-            "sad": ["connection", "relaxation", "self_reflection"],
-            "fear": ["relaxation", "connection", "self_reflection"],
-            "angry": ["relaxation", "self_reflection", "connection"],
-            "happy": ["connection", "self_reflection"],  # Happy users might enjoy Reels or Diary
-            "excited": ["connection", "self_reflection"],  # Excited users might enjoy sharing via Reels
-            "bored": ["connection", "relaxation", "self_reflection"],  # Bored users could enjoy any feature
-            "neutral": ["self_reflection", "connection", "relaxation"]
-        }
-        
-        # Get relevant feature categories for this emotion
-        relevant_categories = emotion_to_feature.get(emotion, ["self_reflection", "connection"])
-        
-        # Prioritize recurring topics from conversation history
-        if recurring_topics:
-            for topic in recurring_topics:
-                if topic in self.app_features:
-                    relevant_categories.insert(0, topic)
-        
-        # Specific keywords in current message might override emotion-based suggestions
-        message_lower = message.lower()
-        if "understand" in message_lower or "feeling" in message_lower or "emotions" in message_lower:
-            relevant_categories.insert(0, "self_reflection")
-        if "alone" in message_lower or "talk" in message_lower or "lonely" in message_lower:
-            relevant_categories.insert(0, "connection")
-        if "stress" in message_lower or "relax" in message_lower or "calm" in message_lower:
-            relevant_categories.insert(0, "relaxation")
-            
-        # Try to find a feature from relevant categories that hasn't been suggested yet
-        for category in relevant_categories:
-            feature_options = self.app_features.get(category, [])
-            for feature in feature_options:
-                feature_key = f"{category}_{feature['name']}"
-                if feature_key not in previously_suggested:
-                    self.suggested_features.add(feature_key)
-                    return feature
+        # Don't suggest features too often (every_n_messages in the content bundle)
+        if turn % table.every_n_messages != 0:
+            return None
         
-        # If all relevant features have been suggested, pick a random one
-        # But first check if we've suggested too many already
-        if len(previously_suggested) >= 8:
-            # Reset tracking if we've suggested many features
-            self.suggested_features.clear()
-            # And skip this time to avoid being too pushy
+        # Topics in the current message come first, then recurring topics, then the emotion's
+        # defaults; the category order for that combination is precomputed in the table
+        state.use_feature_catalog(table.catalog_id)
+        mask = table.topic_mask(analysis.topics, recurring_topics)
+        feature_id, ranking = table.suggest(emotion, mask, state.seen_features, turn, state.feature_available_at)
+        if feature_id is not None:
+            state.remember_feature(feature_id, turn + table.cooldowns[feature_id])
+            return table.features[feature_id]
+        
+        # Everything relevant was suggested already; if that's a lot, start over and skip this time
+        if state.seen_feature_count >= table.max_seen:
+            state.clear_seen_features()
             return None
             
         # Try a random feature from the first relevant category
-        if relevant_categories and self.app_features.get(relevant_categories[0]):
-            random_feature = random.choice(self.app_features[relevant_categories[0]])
-            return random_feature
+        if ranking and content.app_features.get(ranking[0]):
+            return random.choice(content.app_features[ranking[0]])
             
         return None
     
-    def get_personality_response(self, message, emotion, features=None, chat_history=None):
-        """Generate a personality-driven response based on emotion and conversation context"""
-        if not emotion or emotion not in self.emotion_responses:
+    def get_personality_response(self, message, emotion, features=None, chat_history=None, state=None):
+        """Generate a personality-driven response based on emotion and conversation context
+        
+        Name and recurring topics come from the conversation's profile in `state`,
+        which only has to fold in the newest messages; without a state the whole
+        history is scanned.
+        """
+        content = self.content
+        emotion = emotion_label(emotion)
+        if not emotion or emotion not in content.emotion_responses:
             emotion = "neutral"
         
-        # Analyze conversation context for more personalization
-        conversation_depth = 0
-        recurring_topics = []
-        user_name = None
-        
-        if chat_history:
-            # Calculate conversation depth
-            conversation_depth = len(chat_history)
-            
-            # Extract user name if they've shared it
-            for entry in chat_history:
-                if entry.get('user'):
-                    user_msg = entry['user'].lower()
-                    name_matches = re.findall(r"(my name is|i am|i'm|call me) (\w+)", user_msg)
-                    if name_matches:
-                        potential_name = name_matches[0][1].capitalize()
-                        if len(potential_name) > 2:  # Avoid short words that aren't names
-                            user_name = potential_name
-                            break
-            
-            # Find recurring topics
-            topic_mentions = {}
-            for entry in chat_history:
-                if entry.get('user'):
-                    user_msg = entry['user'].lower()
-                    
-                    # Check for topic keywords
-                    for topic, keywords in {
-                        "work": ["work", "job", "boss", "career", "colleague"],
-                        "relationships": ["friend", "partner", "family", "relationship"],
-                        "self-care": ["self", "care", "health", "wellness"],
-                        "emotions": ["feel", "emotion", "mood", "happy", "sad", "angry"]
-                    }.items():
-                        if any(keyword in user_msg for keyword in keywords):
-                            topic_mentions[topic] = topic_mentions.get(topic, 0) + 1
-            
-            # Topics mentioned more than once are recurring
-            recurring_topics = [topic for topic, count in topic_mentions.items() if count > 1]
+        state = state or SessionState()
+        with state.lock:
+            profile = state.profile.update(chat_history)
+            conversation_depth = profile.conversation_depth
+            recurring_topics = profile.recurring_topics()
+            user_name = profile.user_name
         
         # Select a response template for this emotion
-        template = random.choice(self.emotion_responses[emotion])
+        template = random.choice(content.emotion_responses[emotion])
         
         # Select an appropriate follow-up question based on conversation context
-        follow_up_questions = self.follow_up_questions[emotion]
+        follow_up_questions = content.follow_up_questions[emotion]
         
         # For deeper conversations, use more personalized follow-ups
         if conversation_depth > 5 and recurring_topics:
@@ -0,0 +1,247 @@
+"""Versioned knowledge content, compiled into a fast-loading bundle
+
+The FAQs, app features (with weights, cooldowns and suggestion settings),
+emotion templates, follow-up questions, the FAQ category topics and emotion
+boost words live in content/knowledge.json. The build step validates that
+file, folds in KOZY_FAQ_LIBRARY if set, builds the FAQ index and the feature
+ranking table, and writes everything as one pickled KnowledgeContent. Loading
+a bundle therefore costs one unpickle with nothing left to compile. The write
+is atomic: the bundle goes to a temporary file first and is then renamed over
+the old one.
+
+A running KnowledgeBase (see KnowledgeBase.watch_bundle) polls the bundle file
+and swaps to a new build as soon as one lands, without a restart:
+    python knowledge_bundle.py check
+    python knowledge_bundle.py build
+
+Bundles are pickles, so only load bundles you built yourself.
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+from faq_index import FaqIndex
+from feature_ranking import FeatureTable
+from topic_classifier import TOPICS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCE_PATH = os.path.join(BASE_DIR, "content", "knowledge.json")
+DEFAULT_BUNDLE_PATH = os.path.join(BASE_DIR, "models", "knowledge.bundle")
+
+KNOWLEDGE_SOURCE_PATH = os.environ.get("KOZY_KNOWLEDGE_SOURCE", DEFAULT_SOURCE_PATH)
+KNOWLEDGE_BUNDLE_PATH = os.environ.get("KOZY_KNOWLEDGE_BUNDLE", DEFAULT_BUNDLE_PATH)
+# Seconds between checks for a new bundle; 0 turns hot reloading off
+KNOWLEDGE_RELOAD_SECONDS = float(os.environ.get("KOZY_KNOWLEDGE_RELOAD", "5"))
+# Optional JSON file of extra FAQs ({"category": [{"q": ..., "a": ...}]}) compiled in alongside the built-in ones
+FAQ_LIBRARY_PATH = os.environ.get("KOZY_FAQ_LIBRARY")
+
+# Bumped whenever KnowledgeContent or the indexes change shape; older bundles must be rebuilt
+BUNDLE_FORMAT = 3
+
+def validate_content(data):
+    """List of problems with a knowledge source (empty if it is usable)"""
+    problems = []
+
+    def check_section(name):
+        section = data.get(name)
+        if not isinstance(section, dict) or not section:
+            problems.append(f"'{name}' must be a non-empty object")
+            return {}
+        return section
+
+    if "version" not in data:
+        problems.append("'version' is missing")
+
+    for category, faqs in check_section("faqs").items():
+        if not isinstance(faqs, list):
+            problems.append(f"faqs['{category}'] must be a list")
+            continue
+        for i, faq in enumerate(faqs):
+            if not isinstance(faq, dict) or not str(faq.get("q") or "").strip() or not str(faq.get("a") or "").strip():
+                problems.append(f"faqs['{category}'][{i}] needs a non-empty 'q' and 'a'")
+
+    for label, keywords in check_section("faq_emotion_boost_words").items():
+        if not isinstance(keywords, list) or not keywords or not all(isinstance(k, str) and k.strip() for k in keywords):
+            problems.append(f"faq_emotion_boost_words['{label}'] must be a non-empty list of words")
+
+    # FAQ categories are detected by the shared topic classifier, so they name its topics
+    for category, topics in check_section("faq_category_topics").items():
+        if not isinstance(topics, list) or not topics:
+            problems.append(f"faq_category_topics['{category}'] must be a non-empty list of topics")
+            continue
+        unknown = [topic for topic in topics if topic not in TOPICS]
+        if unknown:
+            problems.append(f"faq_category_topics['{category}'] names unknown topics {unknown} (see topic_classifier.py)")
+
+    app_features = check_section("app_features")
+    for category, features in app_features.items():
+        if not isinstance(features, list) or not features:
+            problems.append(f"app_features['{category}'] must be a non-empty list")
+            continue
+        for i, feature in enumerate(features):
+            if not isinstance(feature, dict) or not all(feature.get(key) for key in ("name", "feature", "description")):
+                problems.append(f"app_features['{category}'][{i}] needs 'name', 'feature' and 'description'")
+                continue
+            weight, cooldown = feature.get("weight", 1), feature.get("cooldown", 0)
+            if not isinstance(weight, (int, float)) or weight < 0:
+                problems.append(f"app_features['{category}'][{i}] 'weight' must be a number >= 0")
+            if not isinstance(cooldown, int) or cooldown < 0:
+                problems.append(f"app_features['{category}'][{i}] 'cooldown' must be a whole number of turns >= 0")
+    if app_features and "emergency" not in app_features:
+        problems.append("app_features needs an 'emergency' category for crisis messages")
+
+    for emotion, categories in check_section("feature_categories_by_emotion").items():
+        unknown = [category for category in categories if category not in app_features]
+        if unknown:
+            problems.append(f"feature_categories_by_emotion['{emotion}'] names unknown categories {unknown}")
+
+    for name, value in data.get("feature_suggestions", {}).items():
+        if name not in ("every_n_messages", "max_seen") or not isinstance(value, int) or value < 1:
+            problems.append(f"feature_suggestions['{name}'] must be every_n_messages or max_seen, a whole number >= 1")
+
+    emotion_responses = check_section("emotion_responses")
+    follow_up_questions = check_section("follow_up_questions")
+    if emotion_responses and "neutral" not in emotion_responses:
+        problems.append("emotion_responses needs a 'neutral' entry")
+    for emotion, templates in emotion_responses.items():
+        if not isinstance(templates, list) or not templates:
+            problems.append(f"emotion_responses['{emotion}'] must be a non-empty list")
+            continue
+        if not follow_up_questions.get(emotion):
+            problems.append(f"follow_up_questions['{emotion}'] is missing or empty")
+        for i, template in enumerate(templates):
+            try:
+                template.format(follow_up_question="")
+            except (AttributeError, KeyError, IndexError, ValueError) as e:
+                problems.append(f"emotion_responses['{emotion}'][{i}] is not a valid template: {e!r}")
+
+    return problems
+
+class KnowledgeContent:
+    """One validated, compiled and read-only version of the knowledge content
+
+    Request handlers take a reference to the current KnowledgeContent once per
+    call and never modify it, so swapping in a new one is a single assignment.
+    """
+
+    def __init__(self, data, source_hash=None):
+        self.version = data["version"]
+        self.source_hash = source_hash
+        self.faqs = data["faqs"]
+        self.category_topics = data["faq_category_topics"]
+        self.emotion_boost_words = data["faq_emotion_boost_words"]
+        self.app_features = data["app_features"]
+        self.feature_categories_by_emotion = data["feature_categories_by_emotion"]
+        self.emotion_responses = data["emotion_responses"]
+        self.follow_up_questions = data["follow_up_questions"]
+        self.faq_index = FaqIndex(self.faqs, self.emotion_boost_words)
+        self.faq_index.compile()
+        self.feature_table = FeatureTable(self.app_features, self.feature_categories_by_emotion,
+                                          data.get("feature_suggestions"))
+        self.built_at = time.time()
+        # Row mapping for the semantic FAQ index, attached by the KnowledgeBase that loads this content
+        self.semantic_rows = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["semantic_rows"] = None
+        return state
+
+    def summary(self):
+        return {
+            "version": self.version,
+            "source_hash": self.source_hash,
+            "built_at": self.built_at,
+            "faqs": len(self.faq_index),
+            "app_features": len(self.feature_table)
+        }
+
+def add_faq_library(data, path):
+    """Merge the FAQs from a JSON file of {"category": [{"q": ..., "a": ...}]} into the source data"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            library = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error loading FAQ library {path}: {e}")
+        return
+    for category, faqs in library.items():
+        data["faqs"].setdefault(category, []).extend(faqs)
+
+def compile_source(source_path=KNOWLEDGE_SOURCE_PATH, library_path=FAQ_LIBRARY_PATH):
+    """Validate and compile the JSON source; raises ValueError listing every problem"""
+    with open(source_path, "rb") as f:
+        raw = f.read()
+    data = json.loads(raw.decode("utf-8"))
+    if library_path:
+        add_faq_library(data, library_path)
+    problems = validate_content(data)
+    if problems:
+        raise ValueError(f"{source_path} is not valid:\n  " + "\n  ".join(problems))
+    return KnowledgeContent(data, hashlib.sha256(raw).hexdigest()[:12])
+
+def write_bundle(content, bundle_path=KNOWLEDGE_BUNDLE_PATH):
+    """Pickle the content next to bundle_path and atomically rename it into place"""
+    directory = os.path.dirname(bundle_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".knowledge-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"format": BUNDLE_FORMAT, "content": content}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, bundle_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def load_bundle(bundle_path=KNOWLEDGE_BUNDLE_PATH):
+    """Read a bundle written by write_bundle; raises ValueError for other formats"""
+    with open(bundle_path, "rb") as f:
+        bundle = pickle.load(f)
+    if not isinstance(bundle, dict) or bundle.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"{bundle_path} is not a format {BUNDLE_FORMAT} knowledge bundle; rebuild it")
+    return bundle["content"]
+
+def bundle_stamp(bundle_path):
+    """Identity of the file currently at bundle_path (changes on every rebuild), or None"""
+    try:
+        stat = os.stat(bundle_path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and compile the knowledge content bundle")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check_parser = subparsers.add_parser("check", help="Validate the content source without writing a bundle")
+    check_parser.add_argument("--source", default=KNOWLEDGE_SOURCE_PATH)
+
+    build_parser = subparsers.add_parser("build", help="Validate, compile and atomically replace the bundle")
+    build_parser.add_argument("--source", default=KNOWLEDGE_SOURCE_PATH)
+    build_parser.add_argument("--out", default=KNOWLEDGE_BUNDLE_PATH)
+
+    args = parser.parse_args()
+
+    # Compile through the importable module so the pickle names knowledge_bundle.KnowledgeContent, not __main__
+    import knowledge_bundle
+
+    try:
+        content = knowledge_bundle.compile_source(args.source)
+    except (OSError, ValueError) as e:
+        print(e)
+        raise SystemExit(1)
+
+    if args.command == "build":
+        knowledge_bundle.write_bundle(content, args.out)
+        print(f"Saved knowledge bundle version {content.version} ({len(content.faq_index)} FAQs) to {args.out}")
+    else:
+        print(f"{args.source} is valid: version {content.version}, {len(content.faq_index)} FAQs")
+
+if __name__ == '__main__':
+    main()
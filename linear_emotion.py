@@ -0,0 +1,226 @@
+"""Cheap linear emotion classifier used as the first tier of the emotion cascade
+
+Messages are turned into hashed word unigram/bigram features and scored with a
+single weight matrix, so a prediction is one small gather-and-sum in NumPy.
+The weights are fitted offline on transcripts labelled by the transformer:
+
+    python linear_emotion.py fit transcripts.jsonl --out models/linear_emotion.npz
+    python linear_emotion.py report transcripts.jsonl --model models/linear_emotion.npz
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+import zlib
+
+import numpy as np
+
+LABELS = ["happy", "sad", "angry", "excited", "fear", "bored", "neutral"]
+DEFAULT_FEATURES = 2 ** 14
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "linear_emotion.npz")
+
+_WORD_PATTERN = re.compile(r"\w+(?:'\w+)*|[!?]")
+
+def hashed_features(text, n_features=DEFAULT_FEATURES):
+    """Return the hashed unigram and bigram bucket ids for a message"""
+    words = _WORD_PATTERN.findall(text.lower().replace("\u2019", "'"))
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    # crc32 keeps bucket ids stable across processes (unlike hash())
+    return [zlib.crc32(gram.encode("utf-8")) % n_features for gram in grams]
+
+def _feature_vector(buckets):
+    """Collapse bucket ids into (ids, L2-normalised counts)"""
+    if not buckets:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    ids, counts = np.unique(np.asarray(buckets, dtype=np.int64), return_counts=True)
+    values = counts.astype(np.float32)
+    return ids, values / np.sqrt((values * values).sum())
+
+def _softmax(logits):
+    """Numerically stable softmax over the last axis"""
+    shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return shifted / shifted.sum(axis=-1, keepdims=True)
+
+class LinearEmotionModel:
+    """Hashed n-gram softmax regression over our emotion categories"""
+
+    def __init__(self, weights, bias, labels=None):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.labels = list(labels or LABELS)
+        self.n_features = self.weights.shape[0]
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH):
+        """Load weights saved with save()"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["weights"], data["bias"], [str(label) for label in data["labels"]])
+
+    def save(self, path=DEFAULT_MODEL_PATH):
+        """Write the model to a small .npz file"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=np.array(self.labels))
+
+    def predict_proba(self, text):
+        """Return the class probabilities for one message"""
+        ids, values = _feature_vector(hashed_features(text, self.n_features))
+        logits = self.bias + values @ self.weights[ids]
+        return _softmax(logits)
+
+    def predict(self, text):
+        """Return (label, margin between the top two classes, probabilities)"""
+        probabilities = self.predict_proba(text)
+        top_two = np.argsort(probabilities)[-2:]
+        margin = float(probabilities[top_two[1]] - probabilities[top_two[0]])
+        return self.labels[top_two[1]], margin, probabilities
+
+def fit(texts, labels, n_features=DEFAULT_FEATURES, epochs=30, learning_rate=2.0, l2=1e-5, batch_size=256, seed=42):
+    """Fit a LinearEmotionModel with mini-batch gradient descent"""
+    label_index = {label: i for i, label in enumerate(LABELS)}
+    rows = [_feature_vector(hashed_features(text, n_features)) for text in texts]
+    targets = np.array([label_index[label] for label in labels], dtype=np.int64)
+
+    weights = np.zeros((n_features, len(LABELS)), dtype=np.float32)
+    bias = np.zeros(len(LABELS), dtype=np.float32)
+    order = list(range(len(rows)))
+    rng = random.Random(seed)
+
+    for _ in range(epochs):
+        rng.shuffle(order)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+
+            # Densify only the batch: batch_size x n_features stays a few MB
+            features = np.zeros((len(batch), n_features), dtype=np.float32)
+            for row, sample in enumerate(batch):
+                ids, values = rows[sample]
+                features[row, ids] = values
+
+            probabilities = _softmax(features @ weights + bias)
+            probabilities[np.arange(len(batch)), targets[batch]] -= 1.0
+            weights -= learning_rate * (features.T @ probabilities / len(batch) + l2 * weights)
+            bias -= learning_rate * probabilities.mean(axis=0)
+
+    return LinearEmotionModel(weights, bias)
+
+def load_transcripts(path):
+    """Read user messages from a .txt (one per line) or .json/.jsonl transcript export
+
+    JSON records may carry the message under "user" or "text", and an optional
+    "label" that is used instead of asking the transformer.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".txt"):
+            return [(line.strip(), None) for line in f if line.strip()]
+        if path.endswith(".jsonl"):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = json.load(f)
+            if isinstance(records, dict):
+                records = list(records.values())
+
+    samples = []
+    for record in records:
+        text = (record.get("user") or record.get("text") or "").strip()
+        if text:
+            samples.append((text, record.get("label")))
+    return samples
+
+def label_with_transformer(samples):
+    """Fill in missing labels using the transformer emotion classifier"""
+    from emotion_detector import get_emotion_backend, MODEL_TO_OUR_CATEGORIES
+
+    emotion_backend = get_emotion_backend() if any(label is None for _, label in samples) else None
+    missing = [text for text, label in samples if label is None]
+    if missing and emotion_backend is None:
+        raise SystemExit("Transformer emotion model is not available to label transcripts")
+
+    predicted = []
+    for start in range(0, len(missing), 32):
+        predicted.extend(scores[0]["label"] for scores in emotion_backend.classify(missing[start:start + 32]))
+
+    predicted = iter(predicted)
+    labelled = []
+    for text, label in samples:
+        if label is None:
+            label = MODEL_TO_OUR_CATEGORIES.get(next(predicted)) or "neutral"
+        labelled.append((text, label))
+    return labelled
+
+def agreement_report(model, samples, margin_threshold):
+    """Compare the linear tier against reference labels and time both paths"""
+    from emotion_detector import get_emotion_backend
+
+    emotion_backend = get_emotion_backend()
+    agreed = confident = confident_agreed = 0
+    linear_seconds = 0.0
+    for text, label in samples:
+        start = time.perf_counter()
+        predicted, margin, _ = model.predict(text)
+        linear_seconds += time.perf_counter() - start
+
+        agreed += predicted == label
+        if margin >= margin_threshold:
+            confident += 1
+            confident_agreed += predicted == label
+
+    total = len(samples) or 1
+    report = {
+        "samples": len(samples),
+        "margin_threshold": margin_threshold,
+        "agreement": agreed / total,
+        "coverage": confident / total,
+        "agreement_when_confident": confident_agreed / confident if confident else None,
+        "linear_ms_per_message": linear_seconds * 1000 / total,
+        "transformer_ms_per_message": None
+    }
+
+    # Time the transformer on a sample of the same messages for comparison
+    if emotion_backend is not None and samples:
+        timed = samples[:200]
+        start = time.perf_counter()
+        for text, _ in timed:
+            emotion_backend.classify([text])
+        report["transformer_ms_per_message"] = (time.perf_counter() - start) * 1000 / len(timed)
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit or evaluate the linear emotion tier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fit_parser = subparsers.add_parser("fit", help="Fit the linear tier on transformer-labelled transcripts")
+    fit_parser.add_argument("transcripts")
+    fit_parser.add_argument("--out", default=DEFAULT_MODEL_PATH)
+    fit_parser.add_argument("--features", type=int, default=DEFAULT_FEATURES)
+    fit_parser.add_argument("--epochs", type=int, default=30)
+    fit_parser.add_argument("--holdout", type=float, default=0.2, help="Fraction kept back for the report")
+    fit_parser.add_argument("--margin", type=float, default=0.35)
+
+    report_parser = subparsers.add_parser("report", help="Agreement/latency report for a fitted model")
+    report_parser.add_argument("transcripts")
+    report_parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    report_parser.add_argument("--margin", type=float, default=0.35)
+
+    args = parser.parse_args()
+    samples = label_with_transformer(load_transcripts(args.transcripts))
+
+    if args.command == "fit":
+        random.Random(42).shuffle(samples)
+        split = int(len(samples) * (1 - args.holdout))
+        train, holdout = samples[:split], samples[split:]
+        model = fit([t for t, _ in train], [l for _, l in train], n_features=args.features, epochs=args.epochs)
+        model.save(args.out)
+        print(f"Saved linear emotion model to {args.out} ({len(train)} training messages)")
+        samples = holdout
+    else:
+        model = LinearEmotionModel.load(args.model)
+
+    print(json.dumps(agreement_report(model, samples, args.margin), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Shared single-pass analysis of a user message
+
+`analyze_message` works out everything keyword routing needs once per message:
+the lowercased text, its tokens, whether it is a simple greeting, and its
+topics from the shared topic classifier (see topic_classifier.py). Every
+consumer then reads the same MessageAnalysis instead of scanning the message
+with its own keyword list. `analyze_messages` does the same for a batch, with
+one classifier call for all of them.
+"""
+from crisis_screener import screen_crisis
+from faq_index import tokenize
+from topic_classifier import classify_topics
+
+SIMPLE_GREETINGS = ["hi", "hey", "hello", "yo", "sup", "hiya", "good morning", "good afternoon", "good evening"]
+
+_NOT_SCREENED = object()
+
+class MessageAnalysis:
+    """Everything keyword routing needs to know about one message, computed once"""
+    __slots__ = ("text", "lower", "stripped", "tokens", "topics", "is_greeting", "_crisis")
+
+    def __init__(self, text, topics):
+        self.text = text
+        self.lower = text.lower()
+        self.stripped = self.lower.strip()
+        self.tokens = tokenize(self.lower)
+        self.topics = topics
+        self.is_greeting = self.stripped in SIMPLE_GREETINGS or self.stripped.startswith(tuple(SIMPLE_GREETINGS))
+        self._crisis = _NOT_SCREENED
+
+    @property
+    def crisis(self):
+        """screen_crisis result for the message, screened at most once"""
+        if self._crisis is _NOT_SCREENED:
+            self._crisis = screen_crisis(self.text)
+        return self._crisis
+
+    def has(self, *topics):
+        """True if the classifier found any of the given topics in the message"""
+        return any(topic in self.topics for topic in topics)
+
+def analyze_messages(texts):
+    texts = [text or "" for text in texts]
+    return [MessageAnalysis(text, topics) for text, topics in zip(texts, classify_topics(texts))]
+
+def analyze_message(text):
+    return analyze_messages([text])[0]
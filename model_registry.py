@@ -0,0 +1,149 @@
+"""Lazy, warm-up-aware model loading with readiness reporting
+
+Models register a loader (and optionally a warm-up call) instead of loading at
+import time. A model is loaded either on first use or ahead of time by
+`model_registry.start()`, which loads everything in one background thread.
+Callers only ever get a model back once its warm-up inference has finished;
+anyone asking while it is still loading waits for it, and a model that failed
+to load comes back as None so the caller can use its fallback.
+
+KOZY_MODEL_LOADING picks when the app loads its models:
+
+    background  load in a background thread at startup (default)
+    eager       load before the app starts serving
+    lazy        load each model the first time it is needed
+"""
+import os
+import threading
+import time
+
+NOT_LOADED = "not_loaded"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+MODEL_LOADING = os.environ.get("KOZY_MODEL_LOADING", "background")
+
+def resident_memory_mb():
+    """Current resident set size of this process in MB (Linux), or None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+class ModelHandle:
+    """One registered model and its load state"""
+
+    def __init__(self, name, loader, warmup=None):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.state = NOT_LOADED
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.memory_mb = None
+        self._model = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def load(self):
+        """Load and warm up the model unless another thread already has"""
+        with self._lock:
+            if self.state != NOT_LOADED:
+                return
+            self.state = LOADING
+
+        memory_before = resident_memory_mb()
+        start = time.perf_counter()
+        try:
+            model = self.loader()
+            self.load_seconds = time.perf_counter() - start
+
+            if self.warmup:
+                start = time.perf_counter()
+                self.warmup(model)
+                self.warmup_seconds = time.perf_counter() - start
+
+            memory_after = resident_memory_mb()
+            if memory_before is not None and memory_after is not None:
+                self.memory_mb = memory_after - memory_before
+
+            # Published only after warm-up so nobody is served by a half-loaded model
+            self._model = model
+            self.state = READY
+            print(f"Model '{self.name}' ready in {self.load_seconds + (self.warmup_seconds or 0):.2f}s")
+        except Exception as e:
+            self.error = str(e)
+            self.state = FAILED
+            print(f"Error loading model '{self.name}': {e}")
+        finally:
+            self._done.set()
+
+    def get(self, timeout=None):
+        """Return the loaded model, loading or waiting for it as needed; None if it failed"""
+        if self.state == NOT_LOADED:
+            self.load()
+        if not self._done.wait(timeout):
+            return None
+        return self._model
+
+    def status(self):
+        return {
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "memory_mb": self.memory_mb,
+            "error": self.error
+        }
+
+class ModelRegistry:
+    """Named models that load lazily or in the background"""
+
+    def __init__(self):
+        self.models = {}
+        self.mode = None
+        self._thread = None
+
+    def register(self, name, loader, warmup=None):
+        """Register a model; nothing is loaded until it is asked for or start() runs"""
+        if name not in self.models:
+            self.models[name] = ModelHandle(name, loader, warmup)
+        return self.models[name]
+
+    def get(self, name, timeout=None):
+        return self.models[name].get(timeout)
+
+    def load_all(self):
+        """Load every registered model in the calling thread"""
+        for handle in list(self.models.values()):
+            handle.load()
+
+    def start(self, mode=None):
+        """Begin loading according to KOZY_MODEL_LOADING (or the given mode)"""
+        mode = self.mode = mode or MODEL_LOADING
+        if mode == "eager":
+            self.load_all()
+        elif mode == "background" and self._thread is None:
+            # One thread, one model at a time, so the per-model memory numbers mean something
+            self._thread = threading.Thread(target=self.load_all, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def ready(self):
+        """True once every model has either loaded or failed (and so has a fallback in use)
+
+        In lazy mode models load on first use, so the instance counts as ready straight away.
+        """
+        if self.mode == "lazy":
+            return True
+        return all(handle.state in (READY, FAILED) for handle in self.models.values())
+
+    def status(self):
+        return {name: handle.status() for name, handle in self.models.items()}
+
+# Shared by every module that owns a model
+model_registry = ModelRegistry()
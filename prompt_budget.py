@@ -0,0 +1,135 @@
+"""Token-budgeted assembly of the generator prompt
+
+GPT-2 sees at most its context window (1,024 tokens) of prompt plus reply. The
+get_kozy_response prompt is an instruction header, the recent conversation,
+topic notes, the current message and closing reasoning instructions.
+PromptBudget tokenizes each piece once (recurring pieces - headers, notes,
+history entries, instructions - through an LRU cache of token ids),
+concatenates the ids, and fits them into the context minus max_new_tokens:
+
+- the header, the reasoning instructions and the message's framing always stay
+- the current message gets at most half of the remaining room; a longer one keeps its end
+- topic notes are kept while they fit
+- history entries fill what is left, newest first, so the oldest turns go first
+
+Pieces meet at a newline or just before a space, where GPT-2's pre-tokenizer
+splits anyway, so the concatenated ids are the ids of the whole prompt text.
+
+KOZY_MAX_NEW_TOKENS sets the reply length and KOZY_TOKEN_CACHE_SIZE the number
+of pieces whose token ids are kept.
+"""
+import os
+import threading
+
+from bounded_cache import LRUCache
+
+MAX_NEW_TOKENS = int(os.environ.get("KOZY_MAX_NEW_TOKENS", "150"))
+TOKEN_CACHE_SIZE = int(os.environ.get("KOZY_TOKEN_CACHE_SIZE", "4096"))
+MESSAGE_SHARE = 0.5
+MESSAGE_PREFIX = "Friend:"
+MESSAGE_SUFFIX = "\nKozy:"
+
+# Prompt piece text -> token ids
+token_cache = LRUCache(TOKEN_CACHE_SIZE)
+
+_totals = {"prompts": 0, "prompt_tokens": 0, "max_prompt_tokens": 0, "truncated_prompts": 0,
+           "history_dropped": 0, "notes_dropped": 0, "message_tokens_cut": 0}
+_totals_lock = threading.Lock()
+
+def prompt_budget_stats():
+    """Prompt sizes and truncation counts so far, plus the token id cache"""
+    with _totals_lock:
+        snapshot = dict(_totals)
+    snapshot["mean_prompt_tokens"] = snapshot["prompt_tokens"] / snapshot["prompts"] if snapshot["prompts"] else 0.0
+    snapshot["max_new_tokens"] = MAX_NEW_TOKENS
+    snapshot["token_cache"] = token_cache.stats()
+    return snapshot
+
+class BudgetedPrompt:
+    """A prompt that fits the context: its text, token ids and what was left out"""
+
+    def __init__(self, prefix, text, ids, prompt_input, max_new_tokens, stats):
+        self.prefix = prefix
+        self.text = text
+        self.ids = ids
+        self.prompt_input = prompt_input
+        self.max_new_tokens = max_new_tokens
+        self.stats = stats
+
+    @property
+    def suffix(self):
+        return self.text[len(self.prefix):]
+
+class PromptBudget:
+    """Fits prompt pieces into a model's context window, counting in tokens"""
+
+    def __init__(self, tokenizer, context_length, max_new_tokens=MAX_NEW_TOKENS, cache=token_cache):
+        self.tokenizer = tokenizer
+        self.context_length = context_length
+        self.max_new_tokens = max_new_tokens
+        self.cache = cache
+
+    def ids(self, text):
+        """Token ids of a recurring piece of text, tokenized the first time it is seen"""
+        return self.cache.get_or_create(text, lambda: self.tokenizer.encode(text))
+
+    def build(self, prefix, separator, history, notes, message, instructions):
+        """Assemble prefix + separator + history + notes + the message line + instructions
+
+        history and notes are lists of text pieces, oldest history entry first;
+        prefix is kept separately on the result so its KV cache can be shared.
+        """
+        fixed = [self.ids(prefix), self.ids(separator), self.ids(MESSAGE_PREFIX),
+                 self.ids(MESSAGE_SUFFIX), self.ids(instructions)]
+        room = self.context_length - self.max_new_tokens - sum(len(ids) for ids in fixed)
+
+        # The message is new each turn, so it is not cached; a long one keeps its most recent part
+        message_ids = self.tokenizer.encode(" " + message)
+        message_room = max(1, int(room * MESSAGE_SHARE))
+        message_cut = max(0, len(message_ids) - message_room)
+        if message_cut:
+            message_ids = message_ids[message_cut:]
+            message = self.tokenizer.decode(message_ids).lstrip()
+        room -= len(message_ids)
+
+        kept_notes = []
+        for note in notes:
+            note_ids = self.ids(note)
+            if len(note_ids) <= room:
+                kept_notes.append((note, note_ids))
+                room -= len(note_ids)
+
+        kept_history = []
+        for entry in reversed(history):
+            entry_ids = self.ids(entry)
+            if len(entry_ids) > room:
+                break
+            kept_history.append((entry, entry_ids))
+            room -= len(entry_ids)
+        kept_history.reverse()
+
+        prompt_input = f"{MESSAGE_PREFIX} {message}{MESSAGE_SUFFIX}"
+        text = "".join([prefix, separator] + [piece for piece, _ in kept_history + kept_notes] + [prompt_input, instructions])
+        ids = fixed[0] + fixed[1]
+        for _, piece_ids in kept_history + kept_notes:
+            ids.extend(piece_ids)
+        ids.extend(fixed[2] + message_ids + fixed[3] + fixed[4])
+
+        # Only if the fixed pieces alone overrun the budget does the reply lose room
+        max_new_tokens = min(self.max_new_tokens, self.context_length - len(ids))
+        stats = {
+            "prompt_tokens": len(ids),
+            "budget": self.context_length - self.max_new_tokens,
+            "history_kept": len(kept_history),
+            "history_dropped": len(history) - len(kept_history),
+            "notes_dropped": len(notes) - len(kept_notes),
+            "message_tokens_cut": message_cut
+        }
+        with _totals_lock:
+            _totals["prompts"] += 1
+            _totals["prompt_tokens"] += len(ids)
+            _totals["max_prompt_tokens"] = max(_totals["max_prompt_tokens"], len(ids))
+            _totals["truncated_prompts"] += bool(stats["history_dropped"] or stats["notes_dropped"] or message_cut)
+            for name in ("history_dropped", "notes_dropped", "message_tokens_cut"):
+                _totals[name] += stats[name]
+        return BudgetedPrompt(prefix, text, ids, prompt_input, max_new_tokens, stats)
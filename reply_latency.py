@@ -0,0 +1,48 @@
+"""Reply latency as the chat page sees it
+
+The time until the first message of a reply is on screen is what the user
+waits for; the time until the whole reply is there is kept next to it.
+/send_message shows its first message only once the complete reply is ready,
+/stream_message as soon as the first part is (see stream_kozy_response), so
+the routes are tracked separately. Percentiles are over the last
+KOZY_LATENCY_SAMPLES replies of each route.
+"""
+import os
+import threading
+from collections import deque
+
+LATENCY_SAMPLES = int(os.environ.get("KOZY_LATENCY_SAMPLES", "1000"))
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p90": None}
+    return {"p50": values[len(values) // 2], "p90": values[min(len(values) - 1, int(len(values) * 0.9))]}
+
+class ReplyLatency:
+    """Recent time-to-first-text and time-to-complete-reply samples per route, in milliseconds"""
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.samples = samples
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, first_text_ms, complete_ms):
+        with self._lock:
+            if route not in self._routes:
+                self._routes[route] = {"replies": 0, "first_text_ms": deque(maxlen=self.samples),
+                                       "complete_ms": deque(maxlen=self.samples)}
+            timings = self._routes[route]
+            timings["replies"] += 1
+            timings["first_text_ms"].append(first_text_ms)
+            timings["complete_ms"].append(complete_ms)
+
+    def stats(self):
+        """Replies per route with the p50/p90 of both times"""
+        with self._lock:
+            snapshot = {route: (timings["replies"], list(timings["first_text_ms"]), list(timings["complete_ms"]))
+                        for route, timings in self._routes.items()}
+        return {route: {"replies": replies, "first_text_ms": _percentiles(first_text), "complete_ms": _percentiles(complete)}
+                for route, (replies, first_text, complete) in snapshot.items()}
+
+reply_latency = ReplyLatency()
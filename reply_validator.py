@@ -0,0 +1,185 @@
+"""Validation of generated replies, one at a time or a batch of candidates
+
+get_kozy_response samples KOZY_REPLY_CANDIDATES replies in one batched
+generate call and sends the best one that passes, instead of falling back to
+a canned reply as soon as a single sample fails. A reply is rejected when it
+is short, leaks the prompt in its first 70 characters, says something unsafe
+or nonsensical, heavily validates a simple greeting, or ignores the
+important topics of the message (neither the topic classifier nor the
+topic's related words find it).
+
+Every keyword list is compiled into one pattern, so a reply is scanned once
+however many lists there are, and the topic classifier gets all candidates
+in one call. The validator counts how often each reason rejects a
+candidate, and how often a reply was saved by a candidate other than the
+first.
+"""
+import os
+import re
+import threading
+
+from topic_classifier import classify_topics
+
+REPLY_CANDIDATES = int(os.environ.get("KOZY_REPLY_CANDIDATES", "4"))
+MIN_REPLY_CHARS = 15
+LEAK_WINDOW = 70
+
+PROMPT_LEAK_KEYWORDS = ["empathy", "companion", "kozy", "respond", "deeply", "caring", "authentic", "validate", "acknowledge"]
+UNSAFE_KEYWORDS = ["fight back", "hit them", "attack", "kill", "hurt them"]
+NONSENSE_PHRASES = ["feathers are feathers"]
+# Validation that is out of place in the reply to a simple greeting
+GREETING_VALIDATIONS = [
+    "it makes complete sense that you'd feel that way",
+    "that sounds really difficult",
+    "i understand your feelings",
+    "your feelings are valid",
+    "that's a lot to handle",
+    "it sounds like you're carrying"
+]
+# Topics (labels of the shared topic classifier) that a reply has to acknowledge, with the
+# related words that also count as acknowledging them
+IMPORTANT_TOPICS = {
+    "boss": ["manager", "supervisor", "workplace", "management", "superior"],
+    "work": ["workload", "job", "task", "professional", "career", "workplace"],
+    "peers": ["coworker", "colleague", "relationship", "team", "professional relationship"],
+    "conflict": ["tension", "disagreement", "argument", "situation", "difficult interaction", "confrontation"]
+}
+REJECTION_REASONS = ("short", "prompt_leak", "unsafe", "nonsense", "greeting_validation", "missing_topic")
+
+def _phrase_pattern(phrases):
+    """Regex source matching the longest of `phrases` at a position, with the phrases
+    merged into a trie so the engine follows one branch per character"""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def source(node):
+        branches = [re.escape(char) + source(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A phrase may end here; the longer ones are tried first
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return source(trie)
+
+class ReplyCheck:
+    """What the validator found in one reply"""
+
+    def __init__(self, reply, reasons, pending, score):
+        self.reply = reply
+        self.reasons = reasons
+        self.pending = pending
+        self.score = score
+
+    @property
+    def verdict(self):
+        """"reject", "wait" for a partial reply that can't be judged yet, or "ok\""""
+        if self.reasons:
+            return "reject"
+        return "wait" if self.pending else "ok"
+
+class ReplyValidator:
+    """Checks generated replies against all keyword lists with one compiled pattern"""
+
+    def __init__(self):
+        lists = {"prompt_leak": PROMPT_LEAK_KEYWORDS, "unsafe": UNSAFE_KEYWORDS, "nonsense": NONSENSE_PHRASES,
+                 "greeting_validation": GREETING_VALIDATIONS}
+        lists.update({f"topic:{topic}": terms for topic, terms in IMPORTANT_TOPICS.items()})
+        # Lowercased phrase -> names of the lists it is on
+        self._lists = {}
+        for name, phrases in lists.items():
+            for phrase in phrases:
+                self._lists.setdefault(phrase.lower(), set()).add(name)
+        phrases = list(self._lists)
+        # A lookahead matches at every position, so overlapping phrases are all found: the longest
+        # phrase starting at a position is matched, and the shorter ones it starts with come with it
+        self._pattern = re.compile(f"(?=({_phrase_pattern(phrases)}))")
+        self._starts_with = {phrase: [other for other in phrases if phrase.startswith(other)] for phrase in phrases}
+        self._counters = {"candidates": 0, "passed": 0, "replies": 0, "no_candidate_passed": 0,
+                          "saved_by_later_candidate": 0}
+        self._rejected = {reason: 0 for reason in REJECTION_REASONS}
+        self._lock = threading.Lock()
+
+    def matches(self, text):
+        """{list name: end offset of its earliest-ending phrase} for the phrases found in text"""
+        found = {}
+        for match in self._pattern.finditer(text.lower()):
+            for phrase in self._starts_with[match.group(1)]:
+                end = match.start() + len(phrase)
+                for name in self._lists[phrase]:
+                    if end < found.get(name, end + 1):
+                        found[name] = end
+        return found
+
+    def check(self, replies, analysis, complete=True):
+        """A ReplyCheck for each reply to the message `analysis` describes
+
+        With complete=False the replies are still being generated: they are rejected
+        only for what more text can't take back (a leak, unsafe or nonsensical
+        content, greeting validation), and pending while shorter than the leak
+        window or not at the message's topics yet.
+        """
+        detected_topics = [topic for topic in IMPORTANT_TOPICS if analysis.has(topic)]
+        classified = classify_topics(replies) if detected_topics else [()] * len(replies)
+        checks = []
+        for reply, reply_topics in zip(replies, classified):
+            found = self.matches(reply)
+            acknowledged = [topic for topic in detected_topics
+                            if topic in reply_topics or f"topic:{topic}" in found]
+            missing_topic = bool(detected_topics) and not acknowledged
+            reasons = []
+            if complete and len(reply) < MIN_REPLY_CHARS:
+                reasons.append("short")
+            if found.get("prompt_leak", LEAK_WINDOW + 1) <= LEAK_WINDOW:
+                reasons.append("prompt_leak")
+            if "unsafe" in found:
+                reasons.append("unsafe")
+            if "nonsense" in found:
+                reasons.append("nonsense")
+            if analysis.is_greeting and "greeting_validation" in found:
+                reasons.append("greeting_validation")
+            if complete and missing_topic:
+                reasons.append("missing_topic")
+            pending = not complete and (len(reply) < LEAK_WINDOW or missing_topic)
+            # Preferred: ends with a question as the prompt asks, then more of the topics, then more to say
+            score = (reply.rstrip().endswith("?"), len(acknowledged), min(len(reply), 300))
+            checks.append(ReplyCheck(reply, reasons, pending, score))
+
+        with self._lock:
+            for check in checks:
+                # Partial replies count once they are rejected; until then they are checked again
+                if complete or check.reasons:
+                    self._counters["candidates"] += 1
+                    self._counters["passed"] += not check.reasons
+                    for reason in check.reasons:
+                        self._rejected[reason] += 1
+        return checks
+
+    def choose(self, checks):
+        """The best of the passing checks (see the score; the earliest on ties), or None"""
+        passing = [check for check in checks if check.verdict == "ok"]
+        with self._lock:
+            self._counters["replies"] += 1
+            if not passing:
+                self._counters["no_candidate_passed"] += 1
+            elif checks[0].reasons:
+                self._counters["saved_by_later_candidate"] += 1
+        return max(passing, key=lambda check: check.score) if passing else None
+
+    def stats(self):
+        """Candidates checked and passed, rejections and rejection rate per reason, and replies
+        with no passing candidate or saved by a later one"""
+        with self._lock:
+            snapshot = dict(self._counters)
+            snapshot["rejected"] = dict(self._rejected)
+        candidates = snapshot["candidates"]
+        snapshot["rejection_rate"] = {reason: count / candidates if candidates else 0.0
+                                      for reason, count in snapshot["rejected"].items()}
+        snapshot["candidates_per_reply"] = REPLY_CANDIDATES
+        return snapshot
+
+reply_validator = ReplyValidator()
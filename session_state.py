@@ -0,0 +1,107 @@
+"""Per-session KnowledgeBase state
+
+The KnowledgeBase holds only read-only content (FAQs, templates, the feature
+catalog). Everything that changes as a conversation goes on lives in a
+SessionState owned by one uid/session, so one user's suggestions never
+suppress another's and requests from different users never touch the same
+objects. Every collection in a SessionState has a fixed upper size, and the
+store keeps at most KOZY_SESSION_STATE_MAX sessions, dropping those idle for
+longer than KOZY_SESSION_STATE_TTL seconds.
+"""
+import os
+import threading
+from collections import deque
+
+from bounded_cache import LRUCache
+from conversation_profile import ConversationProfile
+
+SESSION_STATE_MAX = int(os.environ.get("KOZY_SESSION_STATE_MAX", "10000"))
+SESSION_STATE_TTL = float(os.environ.get("KOZY_SESSION_STATE_TTL", "3600"))
+
+EMOTION_HISTORY_LENGTH = 5
+TOPIC_HISTORY_LENGTH = 20
+MAX_SUGGESTED_FAQS = 64
+
+class SessionState:
+    """What the KnowledgeBase remembers about one conversation
+
+    Hold `lock` while reading and updating it; the store hands the same record
+    to every request of a session.
+    """
+    __slots__ = ("seen_features", "seen_feature_count", "feature_catalog_id", "feature_available_at",
+                 "suggested_faqs", "last_emotion", "emotion_history",
+                 "topic_history", "feature_suggestion_count", "profile", "lock")
+
+    def __init__(self):
+        # Bit i is set once feature id i of the FeatureTable with feature_catalog_id was suggested
+        self.seen_features = 0
+        self.seen_feature_count = 0
+        self.feature_catalog_id = None
+        # Feature id -> turn (feature_suggestion_count) from which it may be suggested again
+        self.feature_available_at = {}
+        self.suggested_faqs = set()
+        self.last_emotion = None
+        self.emotion_history = deque(maxlen=EMOTION_HISTORY_LENGTH)
+        self.topic_history = deque(maxlen=TOPIC_HISTORY_LENGTH)
+        self.feature_suggestion_count = 0
+        self.profile = ConversationProfile()
+        self.lock = threading.RLock()
+
+    def remember_emotion(self, emotion):
+        self.last_emotion = emotion
+        self.emotion_history.append(emotion)
+
+    def remember_topics(self, topics):
+        for topic in topics:
+            if topic not in self.topic_history:
+                self.topic_history.append(topic)
+
+    def use_feature_catalog(self, catalog_id):
+        """Feature ids only mean something within one catalog; start over when it changes"""
+        if catalog_id != self.feature_catalog_id:
+            self.feature_catalog_id = catalog_id
+            self.clear_seen_features()
+            self.feature_available_at.clear()
+
+    def remember_feature(self, feature_id, available_at):
+        self.seen_features |= 1 << feature_id
+        self.seen_feature_count += 1
+        if available_at > self.feature_suggestion_count:
+            self.feature_available_at[feature_id] = available_at
+
+    def clear_seen_features(self):
+        self.seen_features = 0
+        self.seen_feature_count = 0
+
+    def remember_faq(self, key):
+        # Past the cap, start over rather than grow without bound
+        if len(self.suggested_faqs) >= MAX_SUGGESTED_FAQS:
+            self.suggested_faqs.clear()
+        self.suggested_faqs.add(key)
+
+    def as_dict(self):
+        return {
+            "suggested_features": [i for i in range(self.seen_features.bit_length()) if self.seen_features >> i & 1],
+            "suggested_faqs": sorted(self.suggested_faqs),
+            "last_emotion": self.last_emotion,
+            "emotion_history": list(self.emotion_history),
+            "topic_history": list(self.topic_history),
+            "feature_suggestion_count": self.feature_suggestion_count,
+            "profile": self.profile.as_dict()
+        }
+
+class SessionStateStore:
+    """SessionState records keyed by (uid, session key), LRU and idle-TTL evicted"""
+
+    def __init__(self, max_sessions=SESSION_STATE_MAX, ttl_seconds=SESSION_STATE_TTL):
+        self._states = LRUCache(max_sessions, ttl_seconds)
+
+    def get(self, uid, session_key=None):
+        """The state for this conversation, created empty the first time it is seen"""
+        return self._states.get_or_create((uid, session_key), SessionState)
+
+    def __len__(self):
+        return len(self._states)
+
+    def stats(self):
+        return self._states.stats()
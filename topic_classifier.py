@@ -0,0 +1,335 @@
+"""Multi-label topic classifier shared by every topic-based routing decision
+
+A message becomes hashed word n-gram features (unigrams to trigrams of crudely
+stemmed words) and is scored against one weight matrix with a row per known
+feature and a column per topic. A batch of messages is classified with a
+single matrix multiply, and a topic is on when its logit is above zero.
+
+The starting point is a seed model compiled from TOPIC_KEYWORDS: each keyword
+phrase is one feature that switches its topic on. Because features are whole
+words, "ill" no longer fires on "will" as the old substring checks did, while
+stemming keeps "stressed"/"stressful" matching "stress". Weights are refined
+offline on transcripts labelled with topics and saved as a small .npz that
+the app loads instead of the seed:
+
+    python topic_classifier.py fit transcripts.jsonl --out models/topic_classifier.npz
+    python topic_classifier.py report transcripts.jsonl --model models/topic_classifier.npz
+"""
+import argparse
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from bounded_cache import LRUCache
+
+# Seed keywords per topic (up to MAX_NGRAM words); a message containing any of them as whole words has the topic
+TOPIC_KEYWORDS = {
+    "work": ["work", "job", "task", "assignment", "project", "workload", "career", "office", "workplace", "meeting",
+             "presentation", "client", "promotion"],
+    "boss": ["boss", "manager", "supervisor", "superior", "management"],
+    "workload": ["too much work", "so much work", "too many tasks", "workload", "overload", "overwhelmed at work", "pile", "deadlines"],
+    "time_pressure": ["little time", "not enough time", "deadline", "behind", "catching up"],
+    "stress": ["stress", "anxious", "anxiety", "worried", "overwhelm", "pressure", "tension", "tense"],
+    "peers": ["peer", "colleague", "coworker", "workmate", "teammate"],
+    "conflict": ["fight", "argument", "argue", "conflict", "disagreement"],
+    "hectic": ["hectic", "busy", "crazy day", "wild day", "rough day", "tough day"],
+    "unwell": ["not feeling well", "not feeling good", "not well", "feel sick", "feel bad", "unwell", "ill", "sick"],
+    "pain": ["pain", "hurt", "ache", "headache", "body", "physical"],
+    "negative": ["bad", "awful", "terrible", "worst", "horrible", "not good", "difficult", "rough", "problem", "issue", "sad", "upset"],
+    "positive": ["happy", "good", "great", "wonderful", "excited", "amazing", "joy"],
+    "relationships": ["friend", "partner", "family", "relationship", "boyfriend", "girlfriend", "husband", "wife",
+                      "marriage", "trust"],
+    "people": ["person", "people", "friend", "they", "team"],
+    "self_care": ["self care", "health", "healthy", "wellbeing"],
+    "emotions": ["feel", "emotion", "mood", "happy", "sad", "angry"],
+    "self_reflection": ["feel", "emotion", "understand"],
+    "connection": ["lonely", "alone", "talk"],
+    "relaxation": ["stress", "relax", "calm"],
+    "asks_for_help": ["how to", "how do", "advice", "help", "suggestion"],
+    "mental_health": ["mental health", "depression", "depressed", "therapy", "nervous", "burned out", "burnt out",
+                      "exhausted", "drained", "feel down", "upset", "mood", "emotion", "sad"],
+    "boredom": ["bored", "boring", "nothing to do", "idle", "unoccupied", "free time", "unstimulated", "dull",
+                "monotonous", "uninteresting"],
+    "success": ["success", "achievement", "accomplish", "promotion", "celebrate", "proud", "recognition", "reward",
+                "win", "achieve", "goal", "milestone"]
+}
+TOPICS = list(TOPIC_KEYWORDS)
+
+MAX_NGRAM = 3
+# Seed logits: bias alone is clearly off, one keyword is clearly on
+SEED_BIAS = -4.0
+SEED_WEIGHT = 8.0
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "topic_classifier.npz")
+TOPIC_MODEL_PATH = os.environ.get("KOZY_TOPIC_MODEL", DEFAULT_MODEL_PATH)
+# Each message is classified when it arrives and again when the conversation profile folds it in
+TOPIC_CACHE_SIZE = int(os.environ.get("KOZY_TOPIC_CACHE_SIZE", "4096"))
+
+_WORD_PATTERN = re.compile(r"\w+(?:'\w+)*")
+# (suffix, replacement), first match wins; "ss" guards words like "stress" from losing their s
+_SUFFIXES = [("iness", "y"), ("ness", ""), ("ful", ""), ("ings", ""), ("ing", ""), ("ied", "y"), ("ies", "y"),
+             ("sses", "ss"), ("ed", ""), ("ly", ""), ("ss", "ss"), ("s", "")]
+# Words the suffix rules would turn into a different word ("business" -> "busy")
+_STEM_EXCEPTIONS = {"business": "business", "businesses": "business"}
+
+# Conversations reuse a small vocabulary, so each word is stemmed once
+@functools.lru_cache(maxsize=65536)
+def stem(word):
+    """Crude suffix stripping so "stressed", "stressful" and "stress" share a feature"""
+    if word in _STEM_EXCEPTIONS:
+        return _STEM_EXCEPTIONS[word]
+    for _ in range(2):
+        for suffix, replacement in _SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                word = word[:-len(suffix)] + replacement
+                break
+        else:
+            break
+    return word[:-1] if word.endswith("e") and len(word) > 3 else word
+
+def topic_grams(text):
+    """Stemmed word n-grams (up to MAX_NGRAM words) of a message"""
+    words = [stem(word) for word in _WORD_PATTERN.findall(text.lower().replace("’", "'"))]
+    grams = []
+    for n in range(1, MAX_NGRAM + 1):
+        grams.extend(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+    return grams
+
+def gram_ids(grams):
+    # crc32 keeps feature ids stable across processes (unlike hash())
+    return [zlib.crc32(gram.encode("utf-8")) for gram in grams]
+
+class TopicClassifier:
+    """Sparse hashed n-gram logistic regression, one independent output per topic"""
+
+    def __init__(self, feature_ids, weights, bias, labels=None):
+        order = np.argsort(feature_ids)
+        self.feature_ids = np.asarray(feature_ids, dtype=np.int64)[order]
+        self.weights = np.asarray(weights, dtype=np.float32)[order]
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.labels = list(labels or TOPICS)
+        self.rows = {feature_id: row for row, feature_id in enumerate(self.feature_ids.tolist())}
+
+    @classmethod
+    def from_keywords(cls, topic_keywords=TOPIC_KEYWORDS):
+        """Seed model: every keyword phrase is a feature that turns its topics on"""
+        labels = list(topic_keywords)
+        rows = {}
+        for t, keywords in enumerate(topic_keywords.values()):
+            for keyword in keywords:
+                grams = topic_grams(keyword)
+                if len(keyword.split()) > MAX_NGRAM:
+                    raise ValueError(f"Topic keyword '{keyword}' is longer than {MAX_NGRAM} words")
+                # The whole phrase is the longest gram; a single word is its only gram
+                feature_id = gram_ids([grams[-1]])[0]
+                rows.setdefault(feature_id, np.zeros(len(labels), dtype=np.float32))[t] = SEED_WEIGHT
+        feature_ids = list(rows)
+        weights = np.array([rows[feature_id] for feature_id in feature_ids], dtype=np.float32).reshape(-1, len(labels))
+        return cls(feature_ids, weights, np.full(len(labels), SEED_BIAS, dtype=np.float32), labels)
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH):
+        """Load a model saved with save()"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["feature_ids"], data["weights"], data["bias"], [str(label) for label in data["labels"]])
+
+    def save(self, path=DEFAULT_MODEL_PATH):
+        """Write the model to a small .npz file"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez_compressed(path, feature_ids=self.feature_ids, weights=self.weights, bias=self.bias,
+                            labels=np.array(self.labels))
+
+    def __len__(self):
+        return len(self.feature_ids)
+
+    def logits(self, texts):
+        """(len(texts), topics) logits for a batch of messages, in one matrix multiply"""
+        # Keep only features the model knows; each weight row the batch touches gets a column
+        used = {}
+        rows, columns = [], []
+        for row, text in enumerate(texts):
+            for feature_id in set(gram_ids(topic_grams(text))):
+                weight_row = self.rows.get(feature_id)
+                if weight_row is not None:
+                    rows.append(row)
+                    columns.append(used.setdefault(weight_row, len(used)))
+        if not used:
+            return np.tile(self.bias, (len(texts), 1))
+
+        presence = np.zeros((len(texts), len(used)), dtype=np.float32)
+        presence[rows, columns] = 1.0
+        return self.bias + presence @ self.weights[list(used)]
+
+    def predict_proba(self, texts):
+        """(len(texts), topics) probability of each topic"""
+        return 1.0 / (1.0 + np.exp(-self.logits(texts)))
+
+    def classify(self, texts):
+        """Topics present in each message, as tuples in label order"""
+        return [tuple(self.labels[t] for t in np.flatnonzero(row)) for row in self.logits(texts) > 0]
+
+def fit(texts, topic_lists, seed_model=None, epochs=20, learning_rate=1.0, l2=1e-4, batch_size=256, seed=42):
+    """Fit a TopicClassifier on labelled messages, starting from (and regularised towards) the keyword seed"""
+    seed_model = seed_model or TopicClassifier.from_keywords()
+    labels = seed_model.labels
+    label_index = {label: i for i, label in enumerate(labels)}
+
+    # Feature rows: the seed's keywords plus every n-gram seen in training
+    samples = [set(gram_ids(topic_grams(text))) for text in texts]
+    vocabulary = sorted(set(seed_model.feature_ids.tolist()).union(*samples))
+    index = {feature_id: i for i, feature_id in enumerate(vocabulary)}
+    rows = [np.array([index[feature_id] for feature_id in sample], dtype=np.int64) for sample in samples]
+    targets = np.zeros((len(texts), len(labels)), dtype=np.float32)
+    for i, topics in enumerate(topic_lists):
+        targets[i, [label_index[topic] for topic in topics if topic in label_index]] = 1.0
+
+    prior = np.zeros((len(vocabulary), len(labels)), dtype=np.float32)
+    prior[[index[feature_id] for feature_id in seed_model.feature_ids.tolist()]] = seed_model.weights
+    weights = prior.copy()
+    bias = seed_model.bias.copy()
+    order = list(range(len(rows)))
+    rng = random.Random(seed)
+
+    for _ in range(epochs):
+        rng.shuffle(order)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+
+            # Densify only the batch's features
+            used, columns = np.unique(np.concatenate([rows[sample] for sample in batch]), return_inverse=True)
+            features = np.zeros((len(batch), len(used)), dtype=np.float32)
+            offsets = np.cumsum([0] + [len(rows[sample]) for sample in batch])
+            for row in range(len(batch)):
+                features[row, columns[offsets[row]:offsets[row + 1]]] = 1.0
+
+            errors = 1.0 / (1.0 + np.exp(-(features @ weights[used] + bias))) - targets[batch]
+            weights[used] -= learning_rate * (features.T @ errors / len(batch) + l2 * (weights[used] - prior[used]))
+            bias -= learning_rate * errors.mean(axis=0)
+
+    # Rows that never moved away from zero would only make the artifact bigger
+    keep = np.abs(weights).max(axis=1) > 1e-3
+    return TopicClassifier(np.asarray(vocabulary, dtype=np.int64)[keep], weights[keep], bias, labels)
+
+def load_labelled_transcripts(path):
+    """Read (message, topics) pairs from a .json/.jsonl export with "user" or "text" and a "topics" list
+
+    Records without "topics" are skipped: the classifier only learns from labelled messages.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = json.load(f)
+            if isinstance(records, dict):
+                records = list(records.values())
+
+    samples = []
+    for record in records:
+        text = (record.get("user") or record.get("text") or "").strip()
+        if text and isinstance(record.get("topics"), list):
+            samples.append((text, record["topics"]))
+    return samples
+
+def topic_report(model, samples):
+    """Per-topic precision/recall of a model against labelled messages, and its speed"""
+    texts = [text for text, _ in samples]
+    start = time.perf_counter()
+    predicted = model.classify(texts)
+    batch_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for text in texts[:500]:
+        model.classify([text])
+    single_seconds = (time.perf_counter() - start) / max(1, min(len(texts), 500))
+
+    topics = {}
+    for label in model.labels:
+        true_positive = sum(label in p and label in t for p, (_, t) in zip(predicted, samples))
+        predicted_count = sum(label in p for p in predicted)
+        labelled_count = sum(label in t for _, t in samples)
+        if predicted_count or labelled_count:
+            topics[label] = {
+                "precision": true_positive / predicted_count if predicted_count else None,
+                "recall": true_positive / labelled_count if labelled_count else None,
+                "labelled": labelled_count
+            }
+    return {
+        "samples": len(samples),
+        "features": len(model),
+        "exact_match": sum(set(p) == set(t) for p, (_, t) in zip(predicted, samples)) / (len(samples) or 1),
+        "us_per_message_single": single_seconds * 1e6,
+        "us_per_message_batched": batch_seconds * 1e6 / (len(samples) or 1),
+        "topics": topics
+    }
+
+_classifier = None
+_classifier_lock = threading.Lock()
+topic_cache = LRUCache(TOPIC_CACHE_SIZE)
+
+def get_topic_classifier():
+    """The fitted model at KOZY_TOPIC_MODEL if there is one, otherwise the keyword seed"""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            if os.path.exists(TOPIC_MODEL_PATH):
+                try:
+                    _classifier = TopicClassifier.load(TOPIC_MODEL_PATH)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Error loading topic model {TOPIC_MODEL_PATH}, using keyword seed: {e}")
+            if _classifier is None:
+                _classifier = TopicClassifier.from_keywords()
+        return _classifier
+
+def classify_topics(texts):
+    """Topics of each message in a batch, using the shared classifier; uncached messages are classified together"""
+    topics = [topic_cache.get(text) for text in texts]
+    missing = [text for text, cached in zip(texts, topics) if cached is None]
+    if missing:
+        classified = dict(zip(missing, get_topic_classifier().classify(missing)))
+        for text, text_topics in classified.items():
+            topic_cache.put(text, text_topics)
+        topics = [classified[text] if cached is None else cached for text, cached in zip(texts, topics)]
+    return topics
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit or evaluate the topic classifier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fit_parser = subparsers.add_parser("fit", help="Fit on transcripts labelled with topics")
+    fit_parser.add_argument("transcripts")
+    fit_parser.add_argument("--out", default=DEFAULT_MODEL_PATH)
+    fit_parser.add_argument("--epochs", type=int, default=20)
+    fit_parser.add_argument("--holdout", type=float, default=0.2, help="Fraction kept back for the report")
+
+    report_parser = subparsers.add_parser("report", help="Precision/recall report for a fitted model and the seed")
+    report_parser.add_argument("transcripts")
+    report_parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+
+    args = parser.parse_args()
+    samples = load_labelled_transcripts(args.transcripts)
+    if not samples:
+        raise SystemExit(f"No messages with a 'topics' list in {args.transcripts}")
+
+    if args.command == "fit":
+        random.Random(42).shuffle(samples)
+        split = int(len(samples) * (1 - args.holdout))
+        train, holdout = samples[:split], samples[split:] or samples[:split]
+        model = fit([t for t, _ in train], [topics for _, topics in train], epochs=args.epochs)
+        model.save(args.out)
+        print(f"Saved topic model to {args.out} ({len(train)} training messages, {len(model)} features)")
+        samples = holdout
+    else:
+        model = TopicClassifier.load(args.model)
+
+    print(json.dumps({"model": topic_report(model, samples),
+                      "keyword_seed": topic_report(TopicClassifier.from_keywords(), samples)}, indent=2))
+
+if __name__ == '__main__':
+    main()